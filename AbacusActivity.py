@@ -16,6 +16,9 @@
 # You should have received a copy of the GNU General Public License
 # along with the Abacus Activity.  If not, see <http://www.gnu.org/licenses/>.
 
+# First, so that the startup trace includes the imports
+from profiling import STARTUP
+STARTUP.begin('imports')
 
 import gi
 gi.require_version('Gtk', '3.0')
@@ -37,10 +40,13 @@ from gettext import gettext as _
 import logging
 _logger = logging.getLogger('abacus-activity')
 
-from abacus_window import Abacus, Custom, MAX_RODS, MAX_TOP, MAX_BOT
+from abacus_window import Abacus, MAX_RODS, MAX_TOP, MAX_BOT, \
+    parse_number
 from toolbar_utils import separator_factory, radio_factory, label_factory, \
     button_factory, spin_factory
 
+STARTUP.end()
+
 
 NAMES = {
     # TRANS: http://en.wikipedia.org/wiki/Suanpan (Chinese abacus)
@@ -63,6 +69,8 @@ NAMES = {
     'caacupe': _('Caacupé'),
     # TRANS: Cuisenaire Rods
     'cuisenaire': _('Rods'),
+    # TRANS: a very wide abacus, which scrolls
+    'virtual': _('Virtual'),
     # TRANS: Custom abacus
     'custom': _('Custom')
     }
@@ -75,15 +83,17 @@ class AbacusActivity(activity.Activity):
         super(AbacusActivity, self).__init__(handle)
 
         self._setting_up = True
+        self._custom_pending = False  # a change to the custom abacus
         self.bead_colors = profile.get_color().to_string().split(',')
 
         # no sharing
         self.max_participants = 1
 
+        STARTUP.begin('toolbars')
         self.sep = []
         self.abacus_toolbar = Gtk.Toolbar()
-        custom_toolbar = Gtk.Toolbar()
-        edit_toolbar = Gtk.Toolbar()
+        self._custom_toolbar = Gtk.Toolbar()
+        self._edit_toolbar = Gtk.Toolbar()
 
         toolbox = ToolbarBox()
 
@@ -92,7 +102,7 @@ class AbacusActivity(activity.Activity):
         activity_button.show()
 
         edit_toolbar_button = ToolbarButton(label=_('Edit'),
-                                            page=edit_toolbar,
+                                            page=self._edit_toolbar,
                                             icon_name='toolbar-edit')
         edit_toolbar_button.show()
         toolbox.toolbar.insert(edit_toolbar_button, -1)
@@ -106,9 +116,9 @@ class AbacusActivity(activity.Activity):
         self.abacus_toolbar_button.show()
 
         self.custom_toolbar_button = ToolbarButton(
-            page=custom_toolbar,
+            page=self._custom_toolbar,
             icon_name='view-source')
-        custom_toolbar.show()
+        self._custom_toolbar.show()
         toolbox.toolbar.insert(self.custom_toolbar_button, -1)
         self.custom_toolbar_button.show()
 
@@ -157,78 +167,36 @@ class AbacusActivity(activity.Activity):
 
         # Non-traditional
         self._add_abacus_button('cuisenaire', self.abacus_buttons['decimal'])
+        self._add_abacus_button('virtual', self.abacus_buttons['decimal'])
 
         self.sep.append(separator_factory(self.abacus_toolbar))
 
         # Custom
         self._add_abacus_button('custom', self.abacus_buttons['decimal'])
 
-        preferences_button = ToolButton('preferences-system')
-        preferences_button.set_tooltip(_('Custom'))
-        custom_toolbar.insert(preferences_button, -1)
-        preferences_button.palette_invoker.props.toggle_palette = True
-        preferences_button.palette_invoker.props.lock_palette = True
-        preferences_button.props.hide_tooltip_on_click = False
-        preferences_button.show()
-
-        self._palette = preferences_button.get_palette()
-        button_box = Gtk.VBox()
-        # TRANS: Number of rods on the abacus
-        self._rods_spin = add_spinner_and_label(
-            15, 1, MAX_RODS, _('Rods:'), self._rods_spin_cb, button_box)
-        # TRANS: Number of beads in the top section of the abacus
-        self._top_spin = add_spinner_and_label(
-            2, 0, MAX_TOP, _('Top:'), self._top_spin_cb, button_box)
-        # TRANS: Number of beads in the bottom section of the abacus
-        self._bottom_spin = add_spinner_and_label(
-            5, 0, MAX_BOT, _('Bottom:'), self._bottom_spin_cb, button_box)
-        # TRANS: Scale factor between bottom and top beads
-        self._value_spin = add_spinner_and_label(
-            5, 1, MAX_BOT + 1, _('Factor:'), self._value_spin_cb, button_box)
-        # TRANS: Scale factor between rods
-        self._base_spin = add_spinner_and_label(
-            10, 1, (MAX_TOP + 1) * MAX_BOT, _('Base:'), self._base_spin_cb,
-            button_box)
-        hbox = Gtk.HBox()
-        hbox.pack_start(button_box, True, True, style.DEFAULT_SPACING)
-        hbox.show_all()
-        self._palette.set_content(hbox)
-
-        separator_factory(custom_toolbar, False, False)
-
-        self.custom_maker = button_factory('new-abacus', custom_toolbar,
-                                           self._custom_cb,
-                                           tooltip=_('Custom'))
-
-        button_factory('edit-copy', edit_toolbar, self._copy_cb,
-                       tooltip=_('Copy'), accelerator='<Ctrl>c')
-        button_factory('edit-paste', edit_toolbar, self._paste_cb,
-                       tooltip=_('Paste'), accelerator='<Ctrl>v')
+        # The custom and edit toolbars are filled in after the first
+        # frame is drawn (see _finish_toolbars).
+        self._rods_spin = None
+        STARTUP.end()
 
         # Create a canvas
+        STARTUP.begin('canvas')
         canvas = Gtk.DrawingArea()
         canvas.set_size_request(Gdk.Screen.width(),
                                 Gdk.Screen.height())
         self.set_canvas(canvas)
         canvas.show()
         self.show_all()
+        STARTUP.end()
 
         # Initialize the canvas
+        STARTUP.begin('abacus')
         self.abacus = Abacus(canvas, self)
+        STARTUP.end()
 
         self._setting_up = False
 
         # Read the current mode from the Journal
-        if 'rods' in self.metadata:
-            self._rods_spin.set_value(int(self.metadata['rods']))
-        if 'top' in self.metadata:
-            self._top_spin.set_value(int(self.metadata['top']))
-        if 'bottom' in self.metadata:
-            self._bottom_spin.set_value(int(self.metadata['bottom']))
-        if 'factor' in self.metadata:
-            self._value_spin.set_value(int(self.metadata['factor']))
-        if 'base' in self.metadata:
-            self._base_spin.set_value(int(self.metadata['base']))
         if 'abacus' in self.metadata:
             if self.metadata['abacus'] in self.abacus_buttons:
                 _logger.debug('restoring %s', self.metadata['abacus'])
@@ -248,6 +216,68 @@ class AbacusActivity(activity.Activity):
         # Start with abacus toolbar expanded and suanpan as default
         self.abacus_toolbar_button.set_expanded(True)
 
+        GObject.idle_add(self._finish_toolbars)
+
+    def _finish_toolbars(self):
+        ''' Fill in the custom and edit toolbars: they are not needed for
+        the first frame, so (unless restoring a custom abacus) this is
+        deferred until we are idle. '''
+        if self._rods_spin is not None:
+            return False
+        STARTUP.begin('deferred_toolbars')
+        preferences_button = ToolButton('preferences-system')
+        preferences_button.set_tooltip(_('Custom'))
+        self._custom_toolbar.insert(preferences_button, -1)
+        preferences_button.palette_invoker.props.toggle_palette = True
+        preferences_button.palette_invoker.props.lock_palette = True
+        preferences_button.props.hide_tooltip_on_click = False
+        preferences_button.show()
+
+        self._palette = preferences_button.get_palette()
+        button_box = Gtk.VBox()
+        # The spinners start as saved in the Journal
+        # TRANS: Number of rods on the abacus
+        self._rods_spin = add_spinner_and_label(
+            int(self.metadata.get('rods', 15)), 1, MAX_RODS, _('Rods:'),
+            self._rods_spin_cb, button_box)
+        # TRANS: Number of beads in the top section of the abacus
+        self._top_spin = add_spinner_and_label(
+            int(self.metadata.get('top', 2)), 0, MAX_TOP, _('Top:'),
+            self._top_spin_cb, button_box)
+        # TRANS: Number of beads in the bottom section of the abacus
+        self._bottom_spin = add_spinner_and_label(
+            int(self.metadata.get('bottom', 5)), 0, MAX_BOT, _('Bottom:'),
+            self._bottom_spin_cb, button_box)
+        # TRANS: Scale factor between bottom and top beads
+        self._value_spin = add_spinner_and_label(
+            int(self.metadata.get('factor', 5)), 1, MAX_BOT + 1,
+            _('Factor:'), self._value_spin_cb, button_box)
+        # TRANS: Scale factor between rods
+        self._base_spin = add_spinner_and_label(
+            int(self.metadata.get('base', 10)), 1, (MAX_TOP + 1) * MAX_BOT,
+            _('Base:'), self._base_spin_cb, button_box)
+        hbox = Gtk.HBox()
+        hbox.pack_start(button_box, True, True, style.DEFAULT_SPACING)
+        hbox.show_all()
+        self._palette.set_content(hbox)
+
+        separator_factory(self._custom_toolbar, False, False)
+
+        self.custom_maker = button_factory('new-abacus', self._custom_toolbar,
+                                           self._custom_cb,
+                                           tooltip=_('Custom'))
+
+        button_factory('edit-copy', self._edit_toolbar, self._copy_cb,
+                       tooltip=_('Copy'), accelerator='<Ctrl>c')
+        button_factory('edit-paste', self._edit_toolbar, self._paste_cb,
+                       tooltip=_('Paste'), accelerator='<Ctrl>v')
+        button_factory('edit-undo', self._edit_toolbar, self._undo_cb,
+                       tooltip=_('Undo'), accelerator='<Ctrl>z')
+        button_factory('edit-redo', self._edit_toolbar, self._redo_cb,
+                       tooltip=_('Redo'), accelerator='<Ctrl>y')
+        STARTUP.end()
+        return False
+
     def _add_abacus_button(self, name, group):
         self.abacus_buttons[name] = radio_factory(
             name,
@@ -306,41 +336,71 @@ class AbacusActivity(activity.Activity):
             self.get_window().set_cursor(None)
 
     def _rods_spin_cb(self, button=None):
-        return
+        self._custom_changed()
 
     def _top_spin_cb(self, button=None):
-        return
+        self._custom_changed()
 
     def _bottom_spin_cb(self, button=None):
-        return
+        self._custom_changed()
 
     def _value_spin_cb(self, button=None):
-        return
+        self._custom_changed()
 
     def _base_spin_cb(self, button=None):
-        return
+        self._custom_changed()
+
+    def _custom_parameters(self):
+        ''' The custom abacus as set by the spinners '''
+        self._finish_toolbars()
+        return {'rods': self._rods_spin.get_value_as_int(),
+                'top': self._top_spin.get_value_as_int(),
+                'bot': self._bottom_spin.get_value_as_int(),
+                'factor': self._value_spin.get_value_as_int(),
+                'base': self._base_spin.get_value_as_int()}
+
+    def _custom_changed(self):
+        ''' If the custom abacus is shown, change it once we are idle:
+        while a spinner is held down, its changes are coalesced. '''
+        if not hasattr(self, 'abacus') or self._setting_up or \
+                self._custom_pending or self.abacus.custom is None or \
+                self.abacus.mode is not self.abacus.custom:
+            return
+        self._custom_pending = True
+        GObject.idle_add(self._update_custom)
+
+    def _update_custom(self):
+        ''' Change the custom abacus (in place) to match the spinners '''
+        self._custom_pending = False
+        if self.abacus.mode is not self.abacus.custom:
+            return False
+        value = float(self.abacus.mode.value(count_beads=False))
+        try:
+            self.abacus.custom.change_custom_parameters(
+                **self._custom_parameters())
+        except ValueError, e:
+            _logger.debug('cannot change the custom abacus: %s', e)
+            return False
+        self.abacus.mode.set_value_from_number(value)
+        self.abacus.mode.label(self.abacus.generate_label())
+        return False
 
     def _custom_cb(self, button=None):
         ''' Display the custom abacus; hide the others '''
+        if self.abacus.mode is self.abacus.custom:
+            self._update_custom()
+            self.abacus_toolbar_button.set_expanded(True)
+            return
         value = float(self.abacus.mode.value(count_beads=False))
-        self.abacus.mode.hide()
-        if self.abacus.custom is not None:
-            self.abacus.custom.hide()
-        self.abacus.custom = Custom(self.abacus, self.abacus.bead_colors)
-        self.abacus.custom.set_custom_parameters(
-            rods=self._rods_spin.get_value_as_int(),
-            top=self._top_spin.get_value_as_int(),
-            bot=self._bottom_spin.get_value_as_int(),
-            factor=self._value_spin.get_value_as_int(),
-            base=self._base_spin.get_value_as_int())
-        self.abacus.custom.create()
-        self.abacus.custom.draw_rods_and_beads()
-        self.abacus.custom.show()
+        try:
+            self.abacus.select_custom(**self._custom_parameters())
+        except ValueError, e:
+            _logger.debug('cannot make the custom abacus: %s', e)
+            return
         self._label.set_text(NAMES['custom'])
-        self.abacus.mode = self.abacus.custom
-        self.abacus.mode_dict['custom'][0] = self.abacus.custom
         self.abacus_toolbar_button.set_expanded(True)
         self.abacus.mode.set_value_from_number(value)
+        self.abacus.mode.label(self.abacus.generate_label())
 
     def _copy_cb(self, arg=None):
         ''' Copy a number to the clipboard from the active abacus. '''
@@ -356,19 +416,29 @@ class AbacusActivity(activity.Activity):
         text = clipboard.wait_for_text()
         if text is not None:
             try:
-                self.abacus.mode.set_value_from_number(float(text))
+                number = parse_number(text)
             except ValueError, e:
                 _logger.debug(str(e))
                 return
+            self.abacus.mode.set_value_from_number(number)
             self.abacus.mode.label(self.abacus.generate_label())
         return
 
+    def _undo_cb(self, arg=None):
+        ''' Undo the last change to the active abacus. '''
+        self.abacus.undo()
+
+    def _redo_cb(self, arg=None):
+        ''' Redo the last change undone on the active abacus. '''
+        self.abacus.redo()
+
     def write_file(self, file_path):
         ''' Write the bead positions to the Journal '''
         _logger.debug('Saving current abacus to Journal: %s %s' % (
             self.abacus.mode.name, self.abacus.mode.value(True)))
         self.metadata['abacus'] = self.abacus.mode.name
         self.metadata['value'] = self.abacus.mode.value(True)
+        self._finish_toolbars()
         self.metadata['rods'] = str(self._rods_spin.get_value_as_int())
         self.metadata['top'] = str(self._top_spin.get_value_as_int())
         self.metadata['bottom'] = str(self._bottom_spin.get_value_as_int())
@@ -19,6 +19,7 @@
 # along with the Abacus Activity.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import sys
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, Gdk
@@ -39,7 +40,8 @@ class AbacusMain:
         'r': 'schety',
         'd': 'decimal',
         'C': 'caacupe',
-        'R': 'cuisenaire'
+        'R': 'cuisenaire',
+        'v': 'virtual'
     }
 
     def __init__(self):
@@ -65,6 +67,12 @@ class AbacusMain:
         menu_items = Gtk.MenuItem.new_with_label(_('Reset'))
         menu.append(menu_items)
         menu_items.connect('activate', self._reset)
+        menu_items = Gtk.MenuItem.new_with_label(_('Undo'))
+        menu.append(menu_items)
+        menu_items.connect('activate', lambda w: self.abacus.undo())
+        menu_items = Gtk.MenuItem.new_with_label(_('Redo'))
+        menu.append(menu_items)
+        menu_items.connect('activate', lambda w: self.abacus.redo())
         menu_items = Gtk.MenuItem.new_with_label(_('Quit'))
         menu.append(menu_items)
         menu_items.connect('activate', self.destroy)
@@ -124,5 +132,9 @@ def main():
     return 0
 
 if __name__ == '__main__':
-    AbacusMain()
-    main()
+    # abacus.py --export FILE [ABACUS [VALUE]] renders without a display
+    if len(sys.argv) > 2 and sys.argv[1] == '--export':
+        Abacus(None).export(sys.argv[2], *sys.argv[3:5])
+    else:
+        AbacusMain()
+        main()
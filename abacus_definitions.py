@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# Copyright 2010-13, Walter Bender
+
+# This file is part of the Abacus Activity.
+
+# The Abacus Activity is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# The Abacus Activity is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with the Abacus Activity.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+abacus_definitions.py describes the abaci as data. A definition is a
+dictionary (as read from JSON) with these keys:
+
+        rods       the number of rods
+        top        beads above the bar (default 0)
+        bottom     beads below the bar
+        factor     the value of a top bead in bottom beads (default 1)
+        base       the ratio between neighboring rods (default 10)
+        units      the rod worth one, counting from 0 at the left (by
+                   default, the rightmost rod)
+        values     the value of a bottom bead: numbers or strings such as
+                   "1/4" (by default, base ** (units - rod))
+        beads      "white" beads that fade as they move (the default),
+                   a "color" per rod, "black" beads, or white beads with
+                   black in the "middle" (as on a schety)
+        tristate   beads can also move down from the center
+        rod_color  the color of the rods (by default, they alternate)
+        lozenge    stretch the beads to fill the rod (Cuisenaire rods)
+        dots       mark the units and thousands with dots (soroban)
+
+top, bottom, values, beads, and tristate can be given for every rod or
+as a list, one entry per rod.
+
+Example usage:
+        # Load more abaci and add them to the activity.
+        types = load_definitions('abaci.json')
+        abacus.add_types(types)
+
+        # abaci.json:
+        # {"tens": {"rods": 5, "bottom": 9, "beads": "color"}}
+
+'''
+
+import json
+from collections import OrderedDict
+from fractions import Fraction
+
+BEAD_STYLES = ('white', 'color', 'black', 'middle')
+KEYS = ('rods', 'top', 'bottom', 'factor', 'base', 'units', 'values',
+        'beads', 'tristate', 'rod_color', 'lozenge', 'dots')
+
+_FRACTIONS = ['1/%d' % (n) for n in (2, 3, 4, 5, 6, 8, 9, 10, 12)]
+
+DEFINITIONS = OrderedDict([
+    ('suanpan', {'rods': 15, 'top': 2, 'bottom': 5, 'factor': 5}),
+    ('soroban', {'rods': 15, 'top': 1, 'bottom': 4, 'factor': 5,
+                 'units': 7, 'dots': True}),
+    ('decimal', {'rods': 10, 'bottom': 10, 'beads': 'color',
+                 'rod_color': '#404040'}),
+    ('nepohualtzintzin', {'rods': 13, 'top': 3, 'bottom': 4, 'factor': 5,
+                          'base': 20}),
+    ('hexadecimal', {'rods': 15, 'top': 1, 'bottom': 7, 'factor': 8,
+                     'base': 16}),
+    ('binary', {'rods': 15, 'bottom': 1, 'base': 2}),
+    ('schety', {'rods': 15, 'bottom': [10] * 10 + [4] + [10] * 4,
+                'values': [10 ** n for n in range(9, -1, -1)] +
+                ['1/4', '1/10', '1/100', '1/1000', '1/10000'],
+                'beads': 'middle', 'rod_color': '#404040'}),
+    ('fraction', {'rods': 15,
+                  'bottom': [10] * 6 + [2, 3, 4, 5, 6, 8, 9, 10, 12],
+                  'values': [10 ** n for n in range(5, -1, -1)] + _FRACTIONS,
+                  'beads': ['white'] * 6 + ['black'] * 9,
+                  'rod_color': '#404040'}),
+    ('caacupe', {'rods': 15,
+                 'bottom': [10] * 6 + [2, 3, 4, 5, 6, 8, 9, 10, 12],
+                 'values': [10 ** n for n in range(5, -1, -1)] + _FRACTIONS,
+                 'beads': ['white'] * 6 + ['black'] * 9, 'tristate': True,
+                 'rod_color': '#404040'}),
+    ('cuisenaire', {'rods': 10, 'bottom': range(1, 11),
+                    'values': ['1/%d' % (n) for n in range(1, 11)],
+                    'beads': 'color', 'tristate': True, 'lozenge': True,
+                    'rod_color': '#404040'}),
+])
+
+
+def _per_rod(definition, key, default, rods):
+    ''' The value of key for each rod: a list, or one value for all '''
+    value = definition.get(key, default)
+    if isinstance(value, list):
+        if len(value) != rods:
+            raise ValueError('%s: %d entries for %d rods' %
+                             (key, len(value), rods))
+        return value
+    return [value] * rods
+
+
+def _value(value):
+    ''' A bead value: 0.1 in JSON means 1/10 '''
+    if isinstance(value, float):
+        return Fraction(repr(value))
+    return Fraction(value)
+
+
+class AbacusType():
+    ''' A definition compiled into one row per rod: (top beads, bottom
+    beads, top factor, bead value, bead style, tristate, rod color).
+    The rows (with lozenge) are the key for any cached layouts. '''
+
+    def __init__(self, name, definition):
+        unknown = [key for key in definition if key not in KEYS]
+        if unknown:
+            raise ValueError('%s: unknown keys %s' %
+                             (name, ', '.join(unknown)))
+        try:
+            self.name = name
+            self.num_rods = int(definition['rods'])
+            if self.num_rods < 1:
+                raise ValueError('rods: %d' % (self.num_rods))
+            self.top_factor = int(definition.get('factor', 1))
+            self.base = int(definition.get('base', 10))
+            self.rod_color = definition.get('rod_color')
+            self.lozenge = bool(definition.get('lozenge', False))
+            self.dots = bool(definition.get('dots', False))
+
+            rods = self.num_rods
+            top = [int(n) for n in _per_rod(definition, 'top', 0, rods)]
+            bottom = [int(n) for n in
+                      _per_rod(definition, 'bottom', None, rods)]
+            if min(top + bottom) < 0 or max(bottom) < 1:
+                raise ValueError('bead counts')
+            if 'values' in definition:
+                values = [_value(value) for value in
+                          _per_rod(definition, 'values', None, rods)]
+            else:
+                units = int(definition.get('units', rods - 1))
+                values = [Fraction(self.base) ** (units - i)
+                          for i in range(rods)]
+            beads = _per_rod(definition, 'beads', 'white', rods)
+            for style in beads:
+                if style not in BEAD_STYLES:
+                    raise ValueError('beads: %s' % (style))
+            tristate = [bool(value) for value in
+                        _per_rod(definition, 'tristate', False, rods)]
+        except (KeyError, TypeError, ValueError, ZeroDivisionError), e:
+            raise ValueError('%s: bad definition (%s)' % (name, e))
+
+        self.top_beads = max(top)
+        self.bot_beads = max(bottom)
+        self.rods = tuple(zip(top, bottom, [self.top_factor] * rods, values,
+                              beads, tristate, [self.rod_color] * rods))
+        self.key = (self.rods, self.lozenge)
+
+
+def load_definitions(path):
+    ''' Load abacus definitions from a JSON file ({name: definition, ...});
+    returns the compiled types in file order. Raises ValueError if the
+    file (or any definition in it) is bad. '''
+    with open(path) as f:
+        definitions = json.load(f, object_pairs_hook=OrderedDict)
+    if not isinstance(definitions, dict):
+        raise ValueError('%s: expected {name: definition, ...}' % (path))
+    return OrderedDict([(str(name), AbacusType(str(name), definition))
+                        for name, definition in definitions.iteritems()])
+
+
+# The built-in abaci
+TYPES = OrderedDict([(name, AbacusType(name, definition))
+                     for name, definition in DEFINITIONS.iteritems()])
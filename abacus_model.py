@@ -0,0 +1,751 @@
+# -*- coding: utf-8 -*-
+# Copyright 2010-13, Walter Bender
+
+# This file is part of the Abacus Activity.
+
+# The Abacus Activity is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# The Abacus Activity is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with the Abacus Activity.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+abacus_model.py is the numeric model of an abacus: the definition of
+each rod and how many of its beads are active. It does not use Gtk, so
+it can be used from scripts and tests. Values are exact: each rod's
+beads are worth a whole number of units, where a unit is the least
+common denominator of the bead values (e.g., 1/360 on the fraction
+abacus), so sums are integer arithmetic.
+
+Example usage:
+        # A three-rod suanpan: 2 beads above the bar, 5 below
+        model = AbacusModel()
+        for i in range(3):
+            model.define_rod(i, i * 7, 2, 5, 5, pow(10, 2 - i))
+
+        # Set the abacus to 123.
+        remainder = model.set_number(123)
+        print model.value()
+
+        # Views are notified of changes to the state of the beads.
+        def changed(rod, first, last):
+            print 'beads %d to %d on rod %d changed' % (first, last, rod)
+        model.connect(changed)
+
+        # Add 487 the way an operator would, one move at a time.
+        for move in model.moves(487):
+            model.play(move)
+
+'''
+
+from array import array
+from fractions import Fraction, gcd
+
+MAX_DENOMINATOR = 10 ** 9
+MAX_HISTORY = 1024  # changes to rods remembered for undo
+
+
+def _exact(value):
+    ''' Bead values are kept as fractions: a float (e.g., 1 / 3.) is taken
+    to be the closest simple fraction. '''
+    if isinstance(value, float):
+        return Fraction(value).limit_denominator(MAX_DENOMINATOR)
+    return Fraction(value)
+
+
+def _lcm(a, b):
+    return a * b / gcd(a, b)
+
+
+class AbacusHistory():
+    ''' A bounded undo/redo history of the changes to the rods of an
+    abacus. Each change is stored as three ints, (rod, old state, new
+    state), in a ring buffer; the first change of each action (e.g.,
+    setting a number) is stored with ~rod, so that actions are undone as
+    a whole. When the buffer is full, the oldest actions are forgotten.
+    '''
+
+    def __init__(self, size=MAX_HISTORY):
+        self.size = size
+        self._changes = array('i', [0]) * (3 * size)
+        self.clear()
+
+    def clear(self):
+        self._first = 0  # the oldest change
+        self._last = 0  # after the last change made
+        self._end = 0  # after the last change that can be redone
+
+    def can_undo(self):
+        return self._last > self._first
+
+    def can_redo(self):
+        return self._end > self._last
+
+    def record(self, changes):
+        ''' Remember an action: a list of (rod, old state, new state) '''
+        if len(changes) > self.size:  # too big to remember
+            self.clear()
+            return
+        for k in range(len(changes)):
+            rod, old, new = changes[k]
+            j = 3 * ((self._last + k) % self.size)
+            if k == 0:
+                rod = ~rod
+            self._changes[j:j + 3] = array('i', (rod, old, new))
+        self._last += len(changes)
+        self._end = self._last
+        # Forget the actions that have been (partly) overwritten.
+        if self._last - self._first > self.size:
+            first = self._last - self.size
+            while self._changes[3 * (first % self.size)] >= 0:
+                first += 1
+            self._first = first
+
+    def undo(self):
+        ''' The (rod, state) pairs that undo the last action (or []) '''
+        states = []
+        while self._last > self._first:
+            self._last -= 1
+            j = 3 * (self._last % self.size)
+            rod = self._changes[j]
+            states.append((max(rod, ~rod), self._changes[j + 1]))
+            if rod < 0:
+                break
+        return states
+
+    def redo(self):
+        ''' The (rod, state) pairs that redo the last action undone (or
+        []) '''
+        states = []
+        while self._last < self._end:
+            j = 3 * (self._last % self.size)
+            rod = self._changes[j]
+            if rod < 0 and states:
+                break
+            states.append((max(rod, ~rod), self._changes[j + 2]))
+            self._last += 1
+        return states
+
+
+class AbacusModel():
+    ''' The state of an abacus: each bead is inactive (0), active (1),
+    or, on a tristate rod, active below the center (-1).
+
+    Beads only move in blocks, so the state of a rod is three counts:
+    the active top beads (those closest to the bar), the bottom beads
+    moved up (those closest to the bar), and, if tristate, the bottom
+    beads moved down (those furthest from the bar). '''
+
+    def __init__(self, history=None):
+        # (first bead, top beads, bottom beads, top factor, bead value,
+        # top bead value, tristate) for each rod
+        self.definitions = []
+        self.unit = 1  # the denominator of the smallest bead value
+        self.weights = []  # (top bead, bottom bead) value in units
+        self.max_units = 0  # the maximum value of the abacus in units
+        self.top = array('i')
+        self.up = array('i')
+        self.down = array('i')
+        self.generation = 0  # incremented whenever a rod is (re)defined
+        self.history = history  # an AbacusHistory (or None)
+        self._listeners = []
+
+    def __len__(self):
+        ''' How many rods are there? '''
+        return len(self.definitions)
+
+    def connect(self, callback):
+        ''' callback(rod, first, last) is called whenever the state of
+        the beads first to last - 1 (on the rod) changes. '''
+        self._listeners.append(callback)
+
+    def disconnect(self, callback):
+        ''' Stop calling callback. '''
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _changed(self, i, first, last):
+        for callback in self._listeners:
+            callback(i, first, last)
+
+    def define_rod(self, i, first, top_beads, bot_beads, top_factor,
+                   bead_value, tristate=False):
+        ''' Define rod i, whose beads start at bead first; all of its beads
+        are inactive. Rods are defined in order: the definitions of any
+        rods after rod i are discarded. Redefining a rod as it was (e.g.,
+        when the abacus is redrawn) changes nothing. '''
+        bead_value = _exact(bead_value)
+        definition = (first, top_beads, bot_beads, top_factor, bead_value,
+                      top_factor * bead_value, tristate)
+        if i < len(self.definitions) and self.definitions[i] == definition:
+            return
+        self.generation += 1
+        if self.history is not None:
+            self.history.clear()
+        truncated = i < len(self.definitions)
+        del self.definitions[i:]
+        del self.weights[i:]
+        del self.top[i:]
+        del self.up[i:]
+        del self.down[i:]
+        self.definitions.append(definition)
+        self.top.append(0)
+        self.up.append(0)
+        self.down.append(0)
+        # Only recalculate every weight if the unit changes.
+        unit = _lcm(self.unit, bead_value.denominator)
+        if unit != self.unit or truncated:
+            self._reweigh()
+        else:
+            self.weights.append((int(top_factor * bead_value * unit),
+                                 int(bead_value * unit)))
+            self.max_units += top_beads * self.weights[i][0] + \
+                bot_beads * self.weights[i][1]
+
+    def truncate(self, n):
+        ''' Discard the definitions of any rods after the first n '''
+        if n >= len(self.definitions):
+            return
+        self.generation += 1
+        if self.history is not None:
+            self.history.clear()
+        del self.definitions[n:]
+        del self.top[n:]
+        del self.up[n:]
+        del self.down[n:]
+        self._reweigh()
+
+    def _reweigh(self):
+        ''' Recalculate the unit and the weights of every rod '''
+        self.unit = reduce(_lcm, [definition[4].denominator
+                                  for definition in self.definitions], 1)
+        self.weights = [(int(definition[5] * self.unit),
+                         int(definition[4] * self.unit))
+                        for definition in self.definitions]
+        self.max_units = sum([
+            self.definitions[j][1] * self.weights[j][0] +
+            self.definitions[j][2] * self.weights[j][1]
+            for j in range(len(self.definitions))])
+
+    def get_state(self, i, k):
+        ''' The state of bead k on rod i '''
+        top_beads, bot_beads = self.definitions[i][1:3]
+        if k < top_beads:
+            return int(k >= top_beads - self.top[i])
+        k -= top_beads
+        if k < self.up[i]:
+            return 1
+        if k >= bot_beads - self.down[i]:
+            return -1
+        return 0
+
+    def _block(self, i, top, up, down):
+        ''' The (one) block of beads on rod i that change state if its
+        counts become top, up, and down (or None) '''
+        first, top_beads, bot_beads = self.definitions[i][0:3]
+        changed = []
+        if top != self.top[i]:
+            changed += [top_beads - max(top, self.top[i]),
+                        top_beads - min(top, self.top[i])]
+        if up != self.up[i]:
+            changed += [top_beads + min(up, self.up[i]),
+                        top_beads + max(up, self.up[i])]
+        if down != self.down[i]:
+            changed += [top_beads + bot_beads - max(down, self.down[i]),
+                        top_beads + bot_beads - min(down, self.down[i])]
+        if not changed:
+            return None
+        return (first + min(changed), first + max(changed))
+
+    def _set(self, i, top, up, down):
+        ''' Change the counts on rod i and notify the views of the block
+        of beads that changed. Returns the block (or None). '''
+        blocks = self._write([(i, top, up, down)])
+        if not blocks:
+            return None
+        return blocks[0][1]
+
+    def _write(self, rods, record=True):
+        ''' Set the (rod, top, up, down) counts of rods in a single write
+        (remembering the change in the history); the views are then
+        notified of the blocks of beads that changed. '''
+        blocks = []
+        changes = []
+        for i, top, up, down in rods:
+            block = self._block(i, top, up, down)
+            if block is not None:
+                old = self._pack(i)
+                self.top[i] = top
+                self.up[i] = up
+                self.down[i] = down
+                changes.append((i, old, self._pack(i)))
+                blocks.append((i, block))
+        if record and changes and self.history is not None:
+            self.history.record(changes)
+        for i, block in blocks:
+            self._changed(i, block[0], block[1])
+        return blocks
+
+    def _pack(self, i):
+        ''' The counts on rod i as one int '''
+        radix = self.definitions[i][2] + 1
+        return (self.top[i] * radix + self.up[i]) * radix + self.down[i]
+
+    def _unpack(self, i, state):
+        radix = self.definitions[i][2] + 1
+        state, down = divmod(state, radix)
+        top, up = divmod(state, radix)
+        return (i, top, up, down)
+
+    def undo(self):
+        ''' Undo the last change to the abacus in a single write; returns
+        False if there is nothing to undo. '''
+        if self.history is None:
+            return False
+        states = self.history.undo()
+        self._write([self._unpack(i, state) for i, state in states],
+                    record=False)
+        return len(states) > 0
+
+    def redo(self):
+        ''' Redo the last change undone; returns False if there is nothing
+        to redo. '''
+        if self.history is None:
+            return False
+        states = self.history.redo()
+        self._write([self._unpack(i, state) for i, state in states],
+                    record=False)
+        return len(states) > 0
+
+    def move(self, i, k, direction):
+        ''' Move bead k on rod i up (direction < 0) or down (direction >
+        0), pushing along any beads in its way. Returns the block of beads
+        that moved (or None). '''
+        top_beads, bot_beads = self.definitions[i][1:3]
+        tristate = self.definitions[i][6]
+        state = self.get_state(i, k)
+        top, up, down = self.top[i], self.up[i], self.down[i]
+        if k < top_beads:
+            if direction > 0 and state == 0:  # toward the bar
+                top = top_beads - k
+            elif direction < 0 and state == 1:
+                top = top_beads - k - 1
+        else:
+            k -= top_beads
+            if direction < 0 and state == 0:  # toward the bar
+                up = k + 1
+            elif direction < 0 and state == -1:  # back to the center
+                down = bot_beads - k - 1
+            elif direction > 0 and state == 1:
+                up = k
+            elif direction > 0 and state == 0 and tristate:
+                down = bot_beads - k
+        return self._set(i, top, up, down)
+
+    def set_rod(self, i, top, up, down=0):
+        ''' Set the beads on rod i: the top beads closest to the bar, the up
+        bottom beads closest to the bar, and (if tristate) the down bottom
+        beads furthest from it are active. '''
+        self._set(i, *self._clamp(i, top, up, down))
+
+    def _clamp(self, i, top, up, down):
+        top_beads, bot_beads = self.definitions[i][1:3]
+        top = max(0, min(top, top_beads))
+        up = max(0, min(up, bot_beads))
+        if self.definitions[i][6]:
+            down = max(0, min(down, bot_beads - up))
+        else:
+            down = 0
+        return top, up, down
+
+    def reset(self, i=None):
+        ''' Clear rod i (or every rod). '''
+        if i is None:
+            self.set_counts([0] * len(self.definitions))
+        else:
+            self.set_rod(i, 0, 0)
+
+    def get_bead_count(self, i):
+        ''' Returns number of active bottom-bead equivalents on rod i '''
+        return self.top[i] * self.definitions[i][3] + \
+            self.up[i] - self.down[i]
+
+    def get_units(self, i):
+        ''' Returns the value of rod i in units '''
+        top_weight, bot_weight = self.weights[i]
+        return self.top[i] * top_weight + (self.up[i] - self.down[i]) * \
+            bot_weight
+
+    def get_value(self, i):
+        ''' Returns the (exact) numeric value of rod i '''
+        return Fraction(self.get_units(i), self.unit)
+
+    def get_max_value(self, i):
+        ''' Returns maximum numeric value for rod i '''
+        top_beads, bot_beads = self.definitions[i][1:3]
+        top_weight, bot_weight = self.weights[i]
+        return Fraction(top_beads * top_weight + bot_beads * bot_weight,
+                        self.unit)
+
+    def _split(self, i, count):
+        ''' The (top, up, down) counts for count bottom-bead equivalents on
+        rod i '''
+        top_beads, bot_beads, top_factor = self.definitions[i][1:4]
+        if count < 0:  # tristate beads moved down
+            return self._clamp(i, 0, 0, -count)
+        elif top_beads > 0:
+            top = min(top_beads, count / top_factor)
+            return self._clamp(i, top, count - top * top_factor, 0)
+        else:
+            return self._clamp(i, 0, count, 0)
+
+    def set_count(self, i, count):
+        ''' Set rod i to count bottom-bead equivalents '''
+        self._set(i, *self._split(i, count))
+
+    def set_counts(self, counts):
+        ''' Set every rod to its count of bottom-bead equivalents in a
+        single write; the views are then notified of the rods that
+        changed. '''
+        self._write([(i,) + self._split(i, counts[i])
+                     for i in range(len(counts))])
+
+    def to_units(self, number):
+        ''' Convert number (an int, Fraction, or float) to whole units,
+        rounding down (but forgiving floating-point error) '''
+        if isinstance(number, (int, long)):
+            return number * self.unit
+        if isinstance(number, float):
+            try:
+                numerator, denominator = number.as_integer_ratio()
+            except (OverflowError, ValueError):
+                raise ValueError('%s is not a number' % number)
+        else:
+            number = Fraction(number)
+            numerator, denominator = number.numerator, number.denominator
+        whole, part = divmod(numerator * self.unit, denominator)
+        if part * 10 ** 6 > denominator * (10 ** 6 - 1):
+            return whole + 1
+        return whole
+
+    def _layout(self):
+        ''' (top beads, bottom beads, top factor, top weight, bottom
+        weight) for each rod '''
+        return [self.definitions[i][1:4] + self.weights[i]
+                for i in range(len(self.definitions))]
+
+    def _decompose(self, number, layout):
+        units = self.to_units(number)
+        if units < 0 or units > self.max_units:
+            raise ValueError('%s is not between 0 and %s' %
+                             (number, self.max_value()))
+        counts = []
+        for top_beads, bot_beads, top_factor, top_weight, bot_weight \
+                in layout:
+            top = min(top_beads, units // top_weight)
+            units -= top * top_weight
+            bot = min(bot_beads, units // bot_weight)
+            units -= bot * bot_weight
+            counts.append(top * top_factor + bot)
+        return counts, units
+
+    def _fine(self, number):
+        ''' The part of number that is finer than a unit (forgiving
+        floating-point error, as in to_units) '''
+        fine = Fraction(number) - Fraction(self.to_units(number), self.unit)
+        if fine * self.unit * 10 ** 6 < 1:
+            return 0
+        return fine
+
+    def decompose(self, number):
+        ''' The count of bottom-bead equivalents on each rod that comes
+        closest to number (without exceeding it), and the remainder (the
+        part of number that is finer than the smallest bead). Raises
+        ValueError if number is negative or too big for the abacus. '''
+        counts, units = self._decompose(number, self._layout())
+        return counts, Fraction(units, self.unit) + self._fine(number)
+
+    def decompose_many(self, numbers):
+        ''' Decompose a sequence of numbers: returns the counts (one row
+        per number) and the remainders. A NumPy array of numbers is
+        decomposed with array arithmetic, one rod at a time. Raises
+        ValueError if any number is out of range. '''
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is None or not isinstance(numbers, numpy.ndarray) or \
+                self.max_units >= 2 ** 62:
+            layout = self._layout()
+            counts = []
+            remainders = []
+            for j in range(len(numbers)):
+                try:
+                    count, units = self._decompose(numbers[j], layout)
+                except ValueError, e:
+                    raise ValueError('number %d: %s' % (j, e))
+                counts.append(count)
+                remainders.append(Fraction(units, self.unit) +
+                                  self._fine(numbers[j]))
+            return counts, remainders
+
+        if numbers.dtype.kind in 'iu':
+            whole, part = numbers, None
+        else:
+            finite = numpy.isfinite(numbers)
+            if not finite.all():
+                raise ValueError('number %d: %s is not a number' % (
+                    numpy.flatnonzero(~finite)[0],
+                    numbers[~finite][0]))
+            whole = numpy.floor(numbers)
+            part = numbers - whole  # (exact)
+        # Check the whole part before it is converted to int64 (where it
+        # could overflow); a number just below 0 may round up to 0.
+        invalid = (whole < -1) | (whole > self.max_units // self.unit)
+        if not invalid.any():
+            units = whole.astype(numpy.int64) * self.unit
+            if part is not None:  # forgive floating-point error
+                units += numpy.floor(part * self.unit + 1e-6).astype(
+                    numpy.int64)
+            invalid = (units < 0) | (units > self.max_units)
+        if invalid.any():
+            j = numpy.flatnonzero(invalid)[0]
+            raise ValueError('number %d: %s is not between 0 and %s' %
+                             (j, numbers[j], self.max_value()))
+        counts = numpy.empty((len(units), len(self.definitions)),
+                             numpy.int64)
+        for i in range(len(self.definitions)):
+            top_beads, bot_beads, top_factor = self.definitions[i][1:4]
+            top_weight, bot_weight = self.weights[i]
+            top = numpy.minimum(units // top_weight, top_beads)
+            units -= top * top_weight
+            bot = numpy.minimum(units // bot_weight, bot_beads)
+            units -= bot * bot_weight
+            counts[:, i] = top * top_factor + bot
+        # The remainders are exact, as from decompose.
+        if part is None:
+            return counts, [Fraction(int(units[j]), self.unit)
+                            for j in range(len(units))]
+        return counts, [Fraction(int(units[j]), self.unit) +
+                        self._fine(float(numbers[j]))
+                        for j in range(len(units))]
+
+    def set_number(self, number):
+        ''' Set the abacus to a value equal to number (see decompose) in a
+        single write; return any remainder '''
+        counts, remainder = self.decompose(number)
+        self.set_counts(counts)
+        return remainder
+
+    def get_units_total(self):
+        ''' The sum of the values of the rods, in units '''
+        return sum([self.get_units(i) for i in range(len(self.definitions))])
+
+    def value(self):
+        ''' The (exact) sum of the values of the rods '''
+        return Fraction(self.get_units_total(), self.unit)
+
+    def max_value(self):
+        ''' Maximum value possible on the abacus '''
+        return Fraction(self.max_units, self.unit)
+
+    def get_rod_values(self):
+        ''' The value of each rod '''
+        return [self.get_value(i) for i in range(len(self.definitions))]
+
+    def moves(self, number, subtract=False, counts=None):
+        ''' The bead moves an operator makes to add number to (or subtract
+        it from) the abacus: the rods are worked from the left, carrying
+        to (or borrowing from) the rod on the left with complements, e.g.,
+        adding 1 to 4 on a soroban is +5 -4. Each move is (rod, (first,
+        last), direction): beads first to last - 1 on the rod move up
+        (direction < 0) or down (direction > 0) together. Where the rods
+        cannot carry (e.g., Cuisenaire rods), each rod is simply set to
+        its part of the result.
+
+        The moves start from the state of the beads (or from counts, as
+        returned by decompose) when moves is called: the number is
+        checked, and how it is to be worked out is chosen, before any
+        move is returned, so that nothing is left half done. The moves
+        are then generated as they are needed (an iterator), so many
+        problems can be streamed without keeping their moves; the abacus
+        is not changed (see play). Raises ValueError if number cannot be
+        added (or subtracted) exactly. '''
+        if counts is None:
+            if [down for down in self.down if down != 0]:
+                raise ValueError('cannot work with beads moved down')
+            state = [(self.top[i], self.up[i]) for i in range(len(self))]
+        else:
+            if min(counts) < 0:
+                raise ValueError('cannot work with beads moved down')
+            state = [self._split(i, counts[i])[0:2]
+                     for i in range(len(counts))]
+        number_units = self.to_units(number)
+        if self._fine(number) != 0:
+            raise ValueError('%s is finer than the smallest bead' % number)
+        units = sum([state[i][0] * self.weights[i][0] +
+                     state[i][1] * self.weights[i][1]
+                     for i in range(len(state))])
+        if subtract:
+            if number_units > units:
+                raise ValueError('cannot subtract %s from %s' %
+                                 (number, Fraction(units, self.unit)))
+            units -= number_units
+        else:
+            if number_units + units > self.max_units:
+                raise ValueError('cannot add %s to %s' %
+                                 (number, Fraction(units, self.unit)))
+            units += number_units
+        # Work the beads of number into the rods (if they can be).
+        operand, remainder = self._decompose(
+            Fraction(number_units, self.unit), self._layout())
+        if remainder == 0:
+            if subtract:
+                operand = [-count for count in operand]
+            if self._carries() or self._workable(operand, state):
+                return self._moves(operand, state)
+        counts, remainder = self._decompose(Fraction(units, self.unit),
+                                            self._layout())
+        if remainder != 0:
+            raise ValueError('%s cannot be set exactly' %
+                             (Fraction(units, self.unit)))
+        return self._set_moves(counts, state)
+
+    def _carries(self):
+        ''' Whether every rod carries to the rod on its left, in which case
+        any number in range can be worked into the rods '''
+        return len([i for i in range(1, len(self.definitions))
+                    if self._radix(i) is None]) == 0
+
+    def _workable(self, operand, state):
+        ''' Whether operand can be worked into the rods (trying it out on
+        copies, without keeping the moves) '''
+        try:
+            for move in self._moves(list(operand), list(state)):
+                pass
+        except ValueError:
+            return False
+        return True
+
+    def _set_moves(self, counts, state):
+        ''' The moves that set each rod to its count '''
+        for i in range(len(counts)):
+            for move in self._shift(i, counts[i], state):
+                yield move
+
+    def _moves(self, operand, state):
+        for i in range(len(operand)):
+            # If the rods to the left are full (or empty), work part of
+            # the count on the next rod.
+            count = operand[i]
+            step = cmp(count, 0)
+            while count != 0 and i + 1 < len(operand) and \
+                    self._radix(i + 1) is not None and \
+                    not self._fits(i, count, state):
+                count -= step
+                operand[i + 1] += step * self._radix(i + 1)
+            if count != 0:
+                for move in self._add(i, count, state):
+                    yield move
+
+    def _radix(self, i):
+        ''' How many beads on rod i are worth one bead on the rod to its
+        left (or None) '''
+        if i == 0 or self.weights[i - 1][1] % self.weights[i][1] != 0:
+            return None
+        return self.weights[i - 1][1] / self.weights[i][1]
+
+    def _capacity(self, i):
+        top_beads, bot_beads, top_factor = self.definitions[i][1:4]
+        return top_beads * top_factor + bot_beads
+
+    def _carry(self, i, total, state):
+        ''' How much to carry to (or, if negative, borrow from) the rod to
+        the left of rod i if it would otherwise be set to total: rods
+        carry whenever they reach the radix, unless they have beads to
+        spare (e.g., on a suanpan) and the rods to the left are full. '''
+        radix = self._radix(i)
+        if radix is None:
+            return 0
+        carry = total // radix
+        if carry > 0 and total <= self._capacity(i) and \
+                not self._fits(i - 1, carry, state):
+            return 0
+        return carry
+
+    def _fits(self, i, count, state):
+        ''' Whether count can be added to rod i (carrying as needed) '''
+        total = state[i][0] * self.definitions[i][3] + state[i][1] + count
+        carry = self._carry(i, total, state)
+        total -= carry * (self._radix(i) or 0)
+        return 0 <= total <= self._capacity(i) and \
+            (carry == 0 or self._fits(i - 1, carry, state))
+
+    def _add(self, i, count, state):
+        ''' The moves that add count (or subtract -count) bottom-bead
+        equivalents to rod i, carrying (or borrowing) first '''
+        total = state[i][0] * self.definitions[i][3] + state[i][1] + count
+        carry = self._carry(i, total, state)
+        if carry != 0:
+            total -= carry * self._radix(i)
+            for move in self._add(i - 1, carry, state):
+                yield move
+        if total < 0 or total > self._capacity(i):
+            raise ValueError('cannot carry from rod %d' % (i))
+        for move in self._shift(i, total, state):
+            yield move
+
+    def _shift(self, i, count, state):
+        ''' The moves that set rod i to count, moving as few beads as
+        possible; the moves that go the same way as the value of the rod
+        are made first. '''
+        top_beads, bot_beads, top_factor = self.definitions[i][1:4]
+        top, up = state[i]
+        best = None
+        for new_top in range(top_beads, -1, -1):
+            new_up = count - new_top * top_factor
+            if 0 <= new_up <= bot_beads:
+                cost = abs(new_top - top) + abs(new_up - up)
+                if best is None or cost < best[0]:
+                    best = (cost, new_top, new_up)
+        if best is None:
+            raise ValueError('rod %d cannot hold %d' % (i, count))
+        new_top, new_up = best[1:]
+        state[i] = (new_top, new_up)
+
+        gains = []  # (move, whether it adds to the rod)
+        if new_top > top:
+            gains.append(((i, (top_beads - new_top, top_beads - top), 1),
+                          True))
+        elif new_top < top:
+            gains.append(((i, (top_beads - top, top_beads - new_top), -1),
+                          False))
+        if new_up > up:
+            gains.append(((i, (top_beads + up, top_beads + new_up), -1),
+                          True))
+        elif new_up < up:
+            gains.append(((i, (top_beads + new_up, top_beads + up), 1),
+                          False))
+        increase = count > top * top_factor + up
+        for move, gain in gains:
+            if gain == increase:
+                yield move
+        for move, gain in gains:
+            if gain != increase:
+                yield move
+
+    def play(self, move):
+        ''' Make a move (see moves); returns the block of beads that
+        moved '''
+        i, (first, last), direction = move
+        if direction > 0:
+            return self.move(i, first, direction)
+        return self.move(i, last - 1, direction)
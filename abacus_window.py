@@ -17,10 +17,20 @@
 # You should have received a copy of the GNU General Public License
 # along with the Abacus Activity.  If not, see <http://www.gnu.org/licenses/>.
 
-from gi.repository import Gdk, GdkPixbuf
-from math import floor, ceil
+from gi.repository import Gdk, GdkPixbuf, GObject
+import cairo
+from math import sqrt, sin, cos, atan2, radians, pi
+from collections import OrderedDict
+from fractions import Fraction
 
 import locale
+import os
+import sys
+import time
+import hashlib
+import mmap
+import struct
+import tempfile
 
 import traceback
 import logging
@@ -32,7 +42,11 @@ try:
 except ImportError:
     GRID_CELL_SIZE = 0
 
-from sprites import Sprites, Sprite
+from sprites import Sprites, Sprite, pixbuf_to_surface
+from abacus_model import AbacusModel, AbacusHistory
+from abacus_definitions import AbacusType, TYPES
+from fraction_labels import dec2frac
+from profiling import STARTUP, PROFILER
 
 INSTANCE = 0
 CLASS = 1
@@ -40,6 +54,8 @@ MAX_RODS = 18
 MAX_TOP = 4
 MAX_BOT = 14
 MAX_BEADS = MAX_RODS * (MAX_TOP + MAX_BOT)
+VIRTUAL_RODS = 100  # rods on a virtual abacus...
+VISIBLE_RODS = 15  # ...of which only these have sprites
 BEAD_WIDTH = 40
 BEAD_HEIGHT = 30
 BEAD_OFFSET = 10
@@ -61,94 +77,285 @@ COLORS = ('#FFFFFF', '#FF0000', '#88FF00', '#FF00FF', '#FFFF00',
 LABELS = ('#000000', '#FFFFFF', '#000000', '#FFFFFF', '#000000',
           '#000000', '#FFFFFF', '#FFFFFF', '#000000', '#000000')
 
-WHITE_BEADS = []
-COLOR_BEADS = []
-BLACK_BEAD = None
-ROD_BEADS = []
-
-
-def make_bead_pixbufs(scale, bead_scale=1.0):
-    global WHITE_BEADS
-    global COLOR_BEADS
-    global BLACK_BEAD
-    global ROD_BEADS
-    for i in range(MAX_FADE_LEVEL + 1):
-        fade = _calc_fade('#FFFFFF', '#FFFF00', i, MAX_FADE_LEVEL)
-        WHITE_BEADS.append(_svg_str_to_pixbuf(
-            _svg_header(BEAD_WIDTH, BEAD_HEIGHT, scale,
-                        stretch=bead_scale) +
-            _svg_bead(fade, '#000000', stretch=bead_scale) +
-            _svg_footer()))
-
-    fade = _calc_fade('#FFFFFF', '#FFFFFF', i, MAX_FADE_LEVEL)
-    WHITE_BEADS.append(_svg_str_to_pixbuf(
-        _svg_header(BEAD_WIDTH, BEAD_HEIGHT, scale,
-                    stretch=bead_scale) +
-        _svg_bead(fade, '#000000', stretch=bead_scale) +
-        _svg_footer()))
-
-    BLACK_BEAD = _svg_str_to_pixbuf(
-        _svg_header(BEAD_WIDTH, BEAD_HEIGHT, scale,
-                    stretch=bead_scale) +
-        _svg_bead('#000000', '#000000', stretch=bead_scale) +
-        _svg_footer())
-
-    for i in range(len(COLORS)):
-        COLOR_BEADS.append(_svg_str_to_pixbuf(
-            _svg_header(BEAD_WIDTH, BEAD_HEIGHT, scale,
-                        stretch=bead_scale) +
-            _svg_bead(COLORS[i], '#000000', stretch=bead_scale) +
-            _svg_footer()))
-        rod_scale = 10.0 / (i + 1)
-        ROD_BEADS.append(_svg_str_to_pixbuf(
-            _svg_header(BEAD_WIDTH, BEAD_HEIGHT, scale,
-                        stretch=rod_scale) +
-            _svg_bead(COLORS[i], '#000000', stretch=rod_scale) +
-            _svg_footer()))
-
-
-def dec2frac(d):
-    ''' Convert float to its approximate fractional representation. '''
-
-    '''
-    This code was translated to Python from the answers at
-    http://stackoverflow.com/questions/95727/how-to-convert-floats-to-human-\
-readable-fractions/681534#681534
-
-    For example:
-    >>> 3./5
-    0.59999999999999998
-
-    >>> dec2frac(3./5)
-    "3/5"
-
-    '''
-
-    if d > 1:
-        return '%s' % d
-    df = 1.0
-    top = 1
-    bot = 1
-
-    while abs(df - d) > 0.00000001:
-        if df < d:
-            top += 1
-        else:
-            bot += 1
-            top = int(d * bot)
-        df = float(top) / bot
+MAX_CACHED_ASSETS = 128
+MAX_CACHED_FILES = 256  # assets kept on disk between launches...
+MAX_CACHED_FILE_SIZE = 256 * 1024  # ...if their pixels fit in this
+ASSET_FORMAT = 1  # change to discard the assets kept on disk
+MAX_CACHED_LAYOUTS = 32
+PREWARM_BUDGET = 0.02  # seconds per idle slice spent building modes
+OVERLAY_INTERVAL = 500  # ms between updates of the profiling overlay
+OVERLAY_LINE = 15  # height of a line of the overlay
+# Draw artwork with Cairo paths; set to False to fall back to SVG/librsvg
+USE_CAIRO_ARTWORK = True
+
+
+class AssetCache():
+    ''' Rasterized artwork keyed by (shape, fill, stroke, stretch, scale).
+    Each asset is built once and its Cairo surface is then shared by every
+    sprite that uses it; the least recently used assets are evicted when
+    the cache is full or the scale changes.
+
+    Given a directory (see set_path), small assets are also kept there
+    between launches, in files named by a hash of their key, and are
+    mapped back into memory rather than rasterized again. '''
+
+    def __init__(self, size=MAX_CACHED_ASSETS, path=None):
+        self._size = size
+        self._scale = None
+        self._assets = OrderedDict()
+        self._path = None
+        if path is not None:
+            self.set_path(path)
+
+    def get(self, shape, fill, stroke, stretch=1.0, scale=1.0):
+        ''' Return the asset, building it if it is not in the cache. '''
+        key = (shape, fill, stroke, stretch, scale)
+        asset = self._assets.pop(key, None)
+        if asset is None:
+            asset = self._load(key)
+            if asset is None:
+                asset = _build_asset(shape, fill, stroke, stretch, scale)
+                self._store(key, asset)
+            while len(self._assets) >= self._size:
+                self._assets.popitem(last=False)
+        self._assets[key] = asset
+        return asset
+
+    def set_path(self, path):
+        ''' Keep assets in the directory path (or, if path is None, only
+        in memory). '''
+        if path is not None and not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError, e:
+                _logger.debug('cannot keep assets in %s: %s', path, e)
+                path = None
+        self._path = path
+
+    def _file(self, key):
+        ''' The file of an asset: a hash of everything its pixels depend
+        on, so a change of scale or colors is a different file. '''
+        name = hashlib.sha1(repr((ASSET_FORMAT, sys.byteorder,
+                                  USE_CAIRO_ARTWORK, key))).hexdigest()
+        return os.path.join(self._path, name + '.argb')
+
+    def _load(self, key):
+        ''' Map an asset from its file (ARGB32 pixels, followed by the
+        width, height, and stride), if there is one. '''
+        if self._path is None:
+            return None
+        path = self._file(key)
+        try:
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (IOError, OSError, ValueError):  # not cached (or empty)
+            return None
+        try:
+            size = struct.calcsize('<iii')
+            width, height, stride = struct.unpack('<iii', data[-size:])
+            if len(data) != stride * height + size:
+                raise ValueError('%d bytes' % (len(data)))
+            surface = cairo.ImageSurface.create_for_data(
+                data, cairo.FORMAT_ARGB32, width, height, stride)
+            os.utime(path, None)  # recently used (see _prune)
+        except (OSError, ValueError, struct.error, cairo.Error), e:
+            _logger.debug('cannot load asset %s: %s', path, e)
+            return None
+        return surface
+
+    def _store(self, key, surface):
+        ''' Write a (small) asset to its file. '''
+        if self._path is None or \
+                not isinstance(surface, cairo.ImageSurface) or \
+                surface.get_stride() * surface.get_height() > \
+                MAX_CACHED_FILE_SIZE:
+            return
+        path = self._file(key)
+        tmp = '%s.%d' % (path, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(surface.get_data())
+                f.write(struct.pack('<iii', surface.get_width(),
+                                    surface.get_height(),
+                                    surface.get_stride()))
+            os.rename(tmp, path)
+            self._prune()
+        except (IOError, OSError), e:
+            _logger.debug('cannot store asset %s: %s', path, e)
+
+    def _prune(self):
+        ''' Remove the least recently used files beyond MAX_CACHED_FILES '''
+        files = [os.path.join(self._path, name)
+                 for name in os.listdir(self._path) if name.endswith('.argb')]
+        if len(files) <= MAX_CACHED_FILES:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - MAX_CACHED_FILES]:
+            os.remove(path)
+
+    def set_scale(self, scale):
+        ''' Evict (in LRU order) the assets rasterized at other scales. '''
+        if scale == self._scale:
+            return
+        self._scale = scale
+        for key in list(self._assets.keys()):
+            if key[4] != scale:
+                del self._assets[key]
+
+    def __len__(self):
+        ''' How many assets are cached? '''
+        return len(self._assets)
+
+
+ASSETS = AssetCache()
+
+
+def _build_asset(shape, fill, stroke, stretch, scale):
+    ''' Rasterize a shape: 'bead', 'dot', 'mark', ('rect', w, h), or
+    ('frame', w, h) '''
+    if USE_CAIRO_ARTWORK:
+        return _cairo_asset(shape, fill, stroke, stretch, scale)
+    return _svg_asset(shape, fill, stroke, stretch, scale)
+
+
+def _asset_size(shape):
+    ''' Unscaled width and height of a shape '''
+    if shape == 'bead':
+        return BEAD_WIDTH, BEAD_HEIGHT
+    elif shape == 'dot':
+        return 10, 10
+    elif shape == 'mark':
+        return 20, 15
+    elif shape[0] in ['rect', 'frame']:
+        return shape[1], shape[2]
+    raise ValueError('unknown shape %s' % str(shape))
+
+
+def _white_bead(fade_level, scale):
+    ''' A white bead, faded toward yellow by fade_level '''
+    fade = _calc_fade('#FFFFFF', '#FFFF00', fade_level, MAX_FADE_LEVEL)
+    return ASSETS.get('bead', fade, '#000000', scale=scale)
+
+
+def _black_bead(scale):
+    ''' A black bead (used to mark the middle of a Schety rod) '''
+    return ASSETS.get('bead', '#000000', '#000000', scale=scale)
+
+
+def _color_bead(i, scale):
+    ''' A bead in the ith color '''
+    return ASSETS.get('bead', COLORS[i], '#000000', scale=scale)
+
+
+def _rod_bead(i, scale):
+    ''' A colored bead elongated to fill 1/(i + 1) of a Cuisenaire rod '''
+    return ASSETS.get('bead', COLORS[i], '#000000', stretch=10.0 / (i + 1),
+                      scale=scale)
+
+
+def _bead_image(style, i, lozenge, scale):
+    ''' The (unfaded) bead for the ith rod of an abacus, by bead style '''
+    if lozenge:
+        return _rod_bead(i, scale)
+    elif style == 'color':
+        return _color_bead(i, scale)
+    elif style == 'black':
+        return _black_bead(scale)
+    return _white_bead(0, scale)
+
+
+# (abacus type key, scale) -> layout
+_layouts = OrderedDict()
+
+
+def _layout(abacus_type, scale):
+    ''' The (x, y, displacement) of each bead on each rod of an abacus,
+    relative to the top of the rod: computed once per type and scale, so
+    drawing an abacus is a walk through the table. '''
+    key = (abacus_type.key, scale)
+    layout = _layouts.pop(key, None)
+    if layout is None:
+        layout = _compile_layout(abacus_type, scale)
+        while len(_layouts) >= MAX_CACHED_LAYOUTS:
+            _layouts.popitem(last=False)
+    _layouts[key] = layout
+    return layout
+
+
+def _compile_layout(abacus_type, scale):
+    x = (BEAD_WIDTH - BEAD_OFFSET) * scale / 4 - \
+        (BEAD_WIDTH + 5) * scale / 2
+    # number of beads that could fit might not match number of beads
+    # (e.g., Schety)
+    bot_size = abacus_type.bot_beads
+    lozenge = abacus_type.lozenge
+    layout = []
+    for i, row in enumerate(abacus_type.rods):
+        top_beads, bot_beads, tristate = row[0], row[1], row[5]
+        # how far each bead moves
+        beads = [(x, j * BEAD_HEIGHT * scale, 2 * BEAD_HEIGHT * scale)
+                 for j in range(top_beads)]
+        if lozenge:  # Lozenged-shaped beads need to be spaced out more
+            spacing = max(0, _rod_bead(i, scale).get_height() -
+                          BEAD_HEIGHT * scale)
+        for j in range(bot_beads):
+            displacement = 2 * BEAD_HEIGHT * scale
+            if top_beads > 0:
+                y = (top_beads + 5 + j) * BEAD_HEIGHT * scale
+            else:
+                y = (2 + j) * BEAD_HEIGHT * scale
+            # short row
+            if not lozenge and bot_beads < bot_size:
+                offset = (bot_size - bot_beads) * BEAD_HEIGHT * scale
+                y += offset
+                displacement += offset
+            # center tristate beads vertically on the rod
+            if tristate:
+                if lozenge:
+                    offset = BEAD_HEIGHT * scale
+                else:
+                    offset = (bot_size - bot_beads + 2) * BEAD_HEIGHT * \
+                        scale / 2
+                y -= offset
+                displacement -= offset
+            if lozenge:
+                y += j * spacing
+            beads.append((x, y, displacement))
+        layout.append(tuple(beads))
+    return tuple(layout)
 
-    if bot == 1:
-        return '%s' % top
-    elif top == 0:
-        return ''
-    return '%s/%s' % (top, bot)
 
 #
 # Utilities for generating artwork as SVG
 #
 
 
+def _svg_asset(shape, fill, stroke, stretch, scale):
+    ''' Rasterize a shape by way of SVG and librsvg '''
+    return pixbuf_to_surface(_svg_str_to_pixbuf(
+        _svg_document(shape, fill, stroke, stretch, scale)))
+
+
+def _svg_document(shape, fill, stroke, stretch, scale):
+    ''' The SVG of a shape (see _build_asset) '''
+    w, h = _asset_size(shape)
+    if shape == 'bead':
+        svg = _svg_bead(fill, stroke, stretch=stretch)
+    elif shape == 'dot':
+        svg = _svg_circle(5, 5, 5, fill, stroke)
+    elif shape == 'mark':
+        svg = _svg_indicator(fill, stroke)
+    elif shape[0] == 'rect':
+        svg = _svg_rect(w, h, 0, 0, 0, 0, fill, stroke)
+    else:  # frame
+        svg = _svg_rect(w, h, FRAME_STROKE_WIDTH / 2, FRAME_STROKE_WIDTH / 2,
+                        0, 0, stroke, stroke) + \
+            _svg_rect(w - (FRAME_STROKE_WIDTH * 2),
+                      h - (FRAME_STROKE_WIDTH * 2), 0, 0,
+                      FRAME_STROKE_WIDTH, FRAME_STROKE_WIDTH, fill, stroke)
+    return _svg_header(w, h, scale, stretch=stretch) + svg + _svg_footer()
+
+
 def _svg_str_to_pixbuf(svg_string):
     ''' Load pixbuf from SVG string '''
     pl = GdkPixbuf.PixbufLoader.new_with_type('svg')
@@ -181,11 +388,12 @@ def _svg_rect(w, h, rx, ry, x, y, fill, stroke):
     return svg_string
 
 
-def _svg_indicator():
+def _svg_indicator(fill='#ff0000', stroke='#ff0000'):
     ''' Returns a wedge-shaped indicator as SVG '''
     svg_string = '%s %s' % ('<path d="m1.5 1.5 L 18.5 1.5 L 10 13.5 L 1.5',
                             '1.5 z"\n')
-    svg_string += _svg_style('fill:#ff0000;stroke:#ff0000;stroke-width:3.0;')
+    svg_string += _svg_style('fill:%s;stroke:%s;stroke-width:3.0;' %
+                             (fill, stroke))
     return svg_string
 
 
@@ -230,6 +438,145 @@ def _svg_style(extras=''):
     return '%s%s%s' % ('style="', extras, '"/>\n')
 
 
+#
+# Utilities for generating artwork directly with Cairo
+# (the same shapes as the SVG utilities, without the parsing)
+#
+
+
+def _cairo_asset(shape, fill, stroke, stretch, scale):
+    ''' Rasterize a shape by drawing Cairo paths '''
+    w, h = _asset_size(shape)
+    # Match the pixel dimensions librsvg gives the equivalent SVG.
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                 max(1, int(w * scale + 0.5)),
+                                 max(1, int(h * scale * stretch + 0.5)))
+    cr = cairo.Context(surface)
+    cr.scale(scale, scale)
+    cr.set_miter_limit(4)  # the SVG default
+    if shape == 'bead':
+        _cairo_bead(cr, stretch)
+        _cairo_paint(cr, fill, stroke, 1.5)
+    elif shape == 'dot':
+        cr.arc(5, 5, 5, 0, 2 * pi)
+        _cairo_paint(cr, fill, stroke)
+    elif shape == 'mark':
+        _cairo_indicator(cr)
+        _cairo_paint(cr, fill, stroke, 3.0)
+    elif shape[0] == 'rect':
+        cr.rectangle(0, 0, w, h)
+        _cairo_paint(cr, fill, stroke)
+    else:  # frame
+        _cairo_rect(cr, w, h, FRAME_STROKE_WIDTH / 2, FRAME_STROKE_WIDTH / 2,
+                    0, 0)
+        _cairo_paint(cr, stroke, stroke)
+        cr.rectangle(FRAME_STROKE_WIDTH, FRAME_STROKE_WIDTH,
+                     w - (FRAME_STROKE_WIDTH * 2),
+                     h - (FRAME_STROKE_WIDTH * 2))
+        _cairo_paint(cr, fill, stroke)
+    surface.flush()
+    return surface
+
+
+def _cairo_paint(cr, fill, stroke, stroke_width=1.0):
+    ''' Fill and then stroke the current path (SVG painting order) '''
+    if fill != 'none':
+        cr.set_source_rgb(*_hex_to_rgb(fill))
+        cr.fill_preserve()
+    if stroke != 'none':
+        cr.set_source_rgb(*_hex_to_rgb(stroke))
+        cr.set_line_width(stroke_width)
+        cr.stroke_preserve()
+    cr.new_path()
+
+
+def _cairo_rect(cr, w, h, rx, ry, x, y):
+    ''' Add a rectangle with elliptical corners to the path '''
+    rx = min(rx, w / 2.0)
+    ry = min(ry, h / 2.0)
+    if rx <= 0 or ry <= 0:
+        cr.rectangle(x, y, w, h)
+        return
+    corners = [(x + w - rx, y + ry, -pi / 2), (x + w - rx, y + h - ry, 0),
+               (x + rx, y + h - ry, pi / 2), (x + rx, y + ry, pi)]
+    cr.new_sub_path()
+    for cx, cy, angle in corners:
+        cr.save()
+        cr.translate(cx, cy)
+        cr.scale(rx, ry)
+        cr.arc(0, 0, 1, angle, angle + pi / 2)
+        cr.restore()
+    cr.close_path()
+
+
+def _cairo_svg_arc(cr, x1, y1, rx, ry, phi, large_arc, sweep, x2, y2):
+    ''' Add an SVG elliptical arc from (x1, y1) to (x2, y2) to the path,
+    converting from endpoint to center parameterization (SVG 1.1, F.6.5) '''
+    phi = radians(phi)
+    cos_phi = cos(phi)
+    sin_phi = sin(phi)
+    dx2 = (x1 - x2) / 2.0
+    dy2 = (y1 - y2) / 2.0
+    x1p = cos_phi * dx2 + sin_phi * dy2
+    y1p = -sin_phi * dx2 + cos_phi * dy2
+    # Radii too small to span the endpoints are scaled up.
+    radii = (x1p * x1p) / (rx * rx) + (y1p * y1p) / (ry * ry)
+    if radii > 1:
+        rx *= sqrt(radii)
+        ry *= sqrt(radii)
+    numerator = rx * rx * ry * ry - rx * rx * y1p * y1p - \
+        ry * ry * x1p * x1p
+    denominator = rx * rx * y1p * y1p + ry * ry * x1p * x1p
+    coef = sqrt(max(0, numerator / denominator))
+    if large_arc == sweep:
+        coef = -coef
+    cxp = coef * rx * y1p / ry
+    cyp = -coef * ry * x1p / rx
+    cx = cos_phi * cxp - sin_phi * cyp + (x1 + x2) / 2.0
+    cy = sin_phi * cxp + cos_phi * cyp + (y1 + y2) / 2.0
+    theta1 = atan2((y1p - cyp) / ry, (x1p - cxp) / rx)
+    theta2 = atan2((-y1p - cyp) / ry, (-x1p - cxp) / rx)
+    cr.save()
+    cr.translate(cx, cy)
+    cr.rotate(phi)
+    cr.scale(rx, ry)
+    if sweep:
+        cr.arc(0, 0, 1, theta1, theta2)
+    else:
+        cr.arc_negative(0, 0, 1, theta1, theta2)
+    cr.restore()
+
+
+def _cairo_bead(cr, stretch=1.0):
+    ''' Add the bead outline used by _svg_bead to the path '''
+    h = 15 + 30 * (stretch - 1.0)
+    h2 = 30 * stretch - 1.5
+    cr.move_to(1.5, 15)
+    _cairo_svg_arc(cr, 1.5, 15, 15, 13.5, 90, 0, 1, 15, 1.5)
+    cr.line_to(25, 1.5)
+    _cairo_svg_arc(cr, 25, 1.5, 15, 13.5, 90, 0, 1, 38.5, 15)
+    cr.line_to(38.5, h)
+    _cairo_svg_arc(cr, 38.5, h, 15, 13.5, 90, 0, 1, 25, h2)
+    cr.line_to(15, h2)
+    _cairo_svg_arc(cr, 15, h2, 15, 13.5, 90, 0, 1, 1.5, h)
+    cr.close_path()
+
+
+def _cairo_indicator(cr):
+    ''' Add the wedge used by _svg_indicator to the path '''
+    cr.move_to(1.5, 1.5)
+    cr.line_to(18.5, 1.5)
+    cr.line_to(10, 13.5)
+    cr.close_path()
+
+
+def _hex_to_rgb(color):
+    ''' Convert from '#RRGGBB' to floats '''
+    return (int(color[1:3], 16) / 255.,
+            int(color[3:5], 16) / 255.,
+            int(color[5:7], 16) / 255.)
+
+
 def _calc_fade(bead_color, fade_color, i, n):
     ''' Fade from bead color to fade color '''
     r = i * float.fromhex('0x' + fade_color[1:3]) / n + \
@@ -246,13 +593,17 @@ class Bead():
 
     def __init__(self):
         self.spr = None
-        self.state = 0
+        self.model = None  # the bead state is kept in the model
+        self.rod = 0  # of the bead in the model
+        self.index = 0  # of the bead on its rod
+        self.home = (0, 0)  # position of an inactive bead
+        self.top = False
         self.fade_level = 0
         self.value = 0
         self.offset = 0
 
     def update(self, sprites, pixbuf, offset, value, max_fade=MAX_FADE_LEVEL,
-               tristate=False):
+               tristate=False, model=None, rod=0, index=0, top=False):
         ''' We store a sprite, an offset, and a value for each bead. '''
         if self.spr is None:
             self.spr = Sprite(sprites, 0, 0, pixbuf)
@@ -261,17 +612,24 @@ class Bead():
         self.spr.set_label('')
         self.spr.set_label_color('black')
         self.offset = offset
+        self.set_value(value, rod)
+        self.model = model
+        self.index = index
+        self.top = top  # top beads move down when activated
+        self.spr.type = 'bead'
+        self.fade_level = 0  # Used for changing color.
+        self.max_fade_level = max_fade
+        self.tristate = tristate  # Beads can be +/- or off.
+
+    def set_value(self, value, rod):
+        ''' The bead is worth value on rod (of the model). '''
         # Decimals will be converted to fractions;
         # and we want to avoid decimal points in our whole numbers.
         if value < 1:
             self.value = value
         else:
             self.value = int(value)
-        self.state = 0
-        self.spr.type = 'bead'
-        self.fade_level = 0  # Used for changing color.
-        self.max_fade_level = max_fade
-        self.tristate = tristate  # Beads can be +/- or off.
+        self.rod = rod
 
     def hide(self):
         ''' Hide the sprite associated with the bead. '''
@@ -283,41 +641,34 @@ class Bead():
         if self.spr is not None:
             self.spr.set_layer(BEAD_LAYER)
 
-    def move(self, offset, move_the_bead=True):
-        ''' Generic move method: sets state and level. '''
+    def place(self):
+        ''' Position (and label) the bead according to its state. '''
         if self.spr is None:
             return
-        if move_the_bead:
-            self.spr.move_relative((0, offset))
-        if not self.tristate:
-            self.state = 1 - self.state
-        elif self.state == 1:  # moving bead back to center
-            self.state = 0
-        elif self.state == -1:  # moving bead back to center
-            self.state = 0
-        else:  # bead is in the center
-            if offset > 0:  # moving bead down to bottom
-                self.state = -1
-            else:  # moving bead up to top
-                self.state = 1
-        self.set_fade_level(self.max_fade_level)
+        x, y = self.home
+        if self.top:
+            y += self.get_state() * int(self.offset)
+        else:
+            y -= self.get_state() * int(self.offset)
+        self.spr.move((x, y))
         self.update_label()
 
-    def move_up(self):
-        ''' Move a bead up as far as it will go. '''
-        self.move(-self.offset)
-
-    def move_down(self):
-        ''' Move a bead down as far as it will go. '''
-        self.move(self.offset)
+    def moved(self):
+        ''' The state changed: reposition the bead and set level. '''
+        if self.spr is None:
+            return
+        self.set_fade_level(self.max_fade_level)
+        self.place()
 
     def get_value(self):
         ''' Return a value based upon bead state. '''
-        return self.state * self.value
+        return self.get_state() * self.value
 
     def get_state(self):
         ''' Is the bead active? '''
-        return self.state
+        if self.model is None:
+            return 0
+        return self.model.get_state(self.rod, self.index)
 
     def set_color(self, color):
         ''' Set the color of the bead. '''
@@ -346,13 +697,13 @@ class Bead():
         if self.spr is None:
             return
         value = self.get_value()
-        if self.state == 1 and value < 10000 and value > 0.05:
+        if self.get_state() == 1 and value < 10000 and value > 0.05:
             value = self.get_value()
             if value < 1:
                 self.spr.set_label(dec2frac(value))
             else:
                 self.spr.set_label(int(value))
-        elif self.state == -1 and value > -10000 and value < -0.05:
+        elif self.get_state() == -1 and value > -10000 and value < -0.05:
             value = self.get_value()
             if value > -1:
                 self.spr.set_label('–' + dec2frac(-value))
@@ -369,25 +720,34 @@ class Rod():
         ''' We store a sprite for each rod and allocate its beads. '''
         self.spr = None
         self.label = None
+        self.composite = None
+        self.model = None
+        self.rod = 0
         self.beads = beads
+        self.signature = None  # what the rod was drawn as (see _draw_rods)
 
     def update(self, sprites, color, frame_height, i, x, y, scale,
-               bead_count, bead_color, cuisenaire=False):
+               bead_count, bead_color, cuisenaire=False, model=None,
+               rod=None):
+        ''' The rod (in position i) is a view of a rod in the model: by
+        default, rod i. '''
         self._bead_count = bead_count
         self.sprites = sprites
+        self.model = model
+        if rod is None:
+            self.rod = i
+        else:
+            self.rod = rod
 
-        rod = _svg_header(10, frame_height - (FRAME_STROKE_WIDTH * 2),
-                          scale) + \
-            _svg_rect(10, frame_height - (FRAME_STROKE_WIDTH * 2),
-                      0, 0, 0, 0, color, '#404040') + \
-            _svg_footer()
+        rod = ASSETS.get(('rect', 10, frame_height - (FRAME_STROKE_WIDTH * 2)),
+                         color, '#404040', scale=scale)
 
         self.index = i
         self.scale = scale
         if self.spr is None:
-            self.spr = Sprite(sprites, x, y, _svg_str_to_pixbuf(rod))
+            self.spr = Sprite(sprites, x, y, rod)
         else:
-            self.spr.set_image(_svg_str_to_pixbuf(rod))
+            self.spr.set_image(rod)
             self.spr.move((x, y))
 
         self.spr.type = 'frame'
@@ -397,233 +757,125 @@ class Rod():
             self.lozenge = True
 
         bo = (BEAD_WIDTH - BEAD_OFFSET) * self.scale / 2
+        label = ASSETS.get(('rect', BEAD_WIDTH, BEAD_HEIGHT), 'none', 'none',
+                           scale=self.scale)
         if self.label is None:
-            self.label = Sprite(
-                self.sprites, x - bo, y + self.spr.rect[3],
-                _svg_str_to_pixbuf(
-                    _svg_header(BEAD_WIDTH, BEAD_HEIGHT, self.scale,
-                                stretch=1.0) +
-                    _svg_rect(BEAD_WIDTH, BEAD_HEIGHT, 0, 0, 0, 0,
-                              'none', 'none') +
-                    _svg_footer()))
-        else:
+            self.label = Sprite(self.sprites, x - bo, y + self.spr.rect[3],
+                                label)
+        else:  # (which may have been drawn at another scale)
+            self.label.set_image(label)
             self.label.move((x - bo, y + self.spr.rect[3]))
         self.label.type = 'frame'
         self.label.set_label_color('white')
         self.label.set_layer(MARK_LAYER)
 
-    def allocate_beads(self, top_beads, bot_beads, top_factor,
-                       bead_value, bot_size, color=False, middle_black=False,
-                       all_black=False, tristate=False):
-        ''' Beads get allocated per rod '''
-        global WHITE_BEADS
-        global COLOR_BEADS
-        global BLACK_BEAD
-        global ROD_BEADS
-
+        # The beads and label are drawn from a cached composite, which is
+        # only re-rendered when they change (see allocate_beads).
+        if self.composite is None:
+            self.composite = Sprite(self.sprites, x, y, rod)
+        self.composite.type = 'frame'
+
+    def allocate_beads(self, row, layout):
+        ''' Beads get allocated per rod: row is the definition of the rod
+        (see AbacusType) and layout the position of each of its beads
+        (see _layout). '''
+        top_beads, bot_beads, top_factor, bead_value, style, tristate = \
+            row[:6]
         self.top_beads = top_beads  # number of beads above the bar
         self.bot_beads = bot_beads  # number of beads below the bar
-        # number of beads that could fit might not match number of beads
-        # (e.g., Schety)
-        self.bot_size = bot_size
         # top bead value == bead value * top factor
         self.top_factor = top_factor
-        self.fade = False
-
-        x = self.spr.rect[0]
-        y = self.spr.rect[1]
-        bo = (BEAD_WIDTH - BEAD_OFFSET) * self.scale / 4
-        ro = (BEAD_WIDTH + 5) * self.scale / 2
-
-        # how far this bead moves
-        bead_displacement = 2 * BEAD_HEIGHT * self.scale
-
-        if self.lozenge:
-            bead_color = ROD_BEADS[self.index]
-        elif color:
-            bead_color = COLOR_BEADS[self.index]
-        elif all_black:
-            bead_color = BLACK_BEAD
-        elif middle_black:  # special patterning for Schety
-            if bot_beads == self.bot_size:
-                middle = [4, 5]
-            else:
-                middle = [1, 2]
-        else:
-            bead_color = WHITE_BEADS[0]
-            self.fade = True
+        self.fade = style == 'white' and not self.lozenge
+
+        bead_color = _bead_image(style, self.index, self.lozenge, self.scale)
+        # special patterning for Schety: black beads in the middle
+        middle = []
+        if style == 'middle':
+            middle = [top_beads + bot_beads / 2 - 1,
+                      top_beads + bot_beads / 2]
 
         if self.fade:
             max_fade_level = MAX_FADE_LEVEL
         else:
             max_fade_level = 0
 
-        for i in range(top_beads):
-            self.beads[i + self._bead_count].update(
-                self.sprites, bead_color, bead_displacement,
-                top_factor * bead_value, max_fade=max_fade_level)
-            self.beads[i + self._bead_count].spr.move(
-                (x - ro + bo, y + i * BEAD_HEIGHT * self.scale))
-
-        for i in range(bot_beads):
-            displacement = bead_displacement
-            if top_beads > 0:
-                yy = y + (top_beads + 5 + i) * BEAD_HEIGHT * self.scale
+        x, y = self.spr.rect[0:2]
+        for i in range(top_beads + bot_beads):
+            bead = self.beads[i + self._bead_count]
+            bx, by, displacement = layout[i]
+            top = i < top_beads
+            if top:
+                value = top_factor * bead_value
             else:
-                yy = y + (2 + i) * BEAD_HEIGHT * self.scale
-
-            if all_black:
-                bead_color = BLACK_BEAD
-            elif middle_black:
-                if i in middle:
-                    bead_color = BLACK_BEAD
-                else:
-                    bead_color = WHITE_BEADS[0]
-            elif not color:
-                bead_color = WHITE_BEADS[0]
-
-            # short row
-            if not self.lozenge and (self.bot_beads < self.bot_size):
-                offset = (self.bot_size - self.bot_beads) * BEAD_HEIGHT * \
-                    self.scale
-                yy += offset
-                displacement += offset
-            # center tristate beads vertically on the rod
-            if tristate:
-                if self.lozenge:
-                    offset = BEAD_HEIGHT * self.scale
-                else:
-                    offset = (self.bot_size - self.bot_beads + 2) * \
-                        BEAD_HEIGHT * self.scale / 2
-                yy -= offset
-                displacement -= offset
-            self.beads[i + self._bead_count + top_beads].update(
-                self.sprites, bead_color, displacement,
-                bead_value, tristate=tristate, max_fade=max_fade_level)
-            self.beads[i + self._bead_count + top_beads].spr.move(
-                (x - ro + bo, yy))
-
-            if bead_color == BLACK_BEAD:
-                self.beads[i + self._bead_count + top_beads].set_label_color(
-                    '#ffffff')
-
-            # Lozenged-shaped beads need to be spaced out more
-            j = i + self._bead_count + top_beads
-            if self.beads[j].spr.rect[3] > BEAD_HEIGHT * self.scale:
-                self.beads[j].spr.move_relative(
-                    (0, i * (self.beads[j].spr.rect[3] -
-                             (BEAD_HEIGHT * self.scale))))
-
-        # self._bead_count -= (self.top_beads + self.bot_beads)
-        if color:
-            for i in range(self.top_beads + self.bot_beads):
-                self.beads[i + self._bead_count].set_label_color(
-                    LABELS[self.index])
-
-    def hide(self):
-        if self.spr is None:
-            return
-        for i in range(self.top_beads + self.bot_beads):
-            self.beads[i + self._bead_count].hide()
-        self.spr.hide()
-        self.label.hide()
+                value = bead_value
+            if i in middle:
+                color = _black_bead(self.scale)
+            else:
+                color = bead_color
+            bead.update(self.sprites, color, displacement, value,
+                        tristate=tristate and not top,
+                        max_fade=max_fade_level, model=self.model,
+                        rod=self.rod, index=i, top=top)
+            bead.spr.move((x + bx, y + by))
+            if style == 'black' or i in middle:
+                bead.set_label_color('#ffffff')
+            elif style == 'color':
+                bead.set_label_color(LABELS[self.index])
+
+        # The beads may already be active.
+        for bead in self.get_beads():
+            bead.home = bead.spr.get_xy()
+            bead.place()
+        self.update_label()
 
-    def show(self):
-        if self.spr is None:
+        self.composite.set_composite(
+            [bead.spr for bead in self.get_beads()] + [self.label])
+
+    def move(self, x, y, rod, bead_value):
+        ''' Move the rod, as it was drawn, to (x, y), as a view of rod
+        in the model (whose beads are worth bead_value): its label too,
+        and the home of each of its beads (which the caller places) '''
+        self.rod = rod
+        for i, bead in enumerate(self.get_beads()):
+            if i < self.top_beads:
+                bead.set_value(self.top_factor * bead_value, rod)
+            else:
+                bead.set_value(bead_value, rod)
+        dx = int(x) - self.spr.rect[0]
+        dy = int(y) - self.spr.rect[1]
+        if dx == 0 and dy == 0:
             return
-        for i in range(self.top_beads + self.bot_beads):
-            self.beads[i + self._bead_count].show()
-        self.spr.set_layer(ROD_LAYER)
-        self.label.set_layer(MARK_LAYER)
-
-    def get_max_value(self):
-        ''' Returns maximum numeric value for this rod '''
-        if self.spr is None:
-            return 0
-        max = 0
-        for i in range(self.top_beads + self.bot_beads):
-            max += self.beads[i + self._bead_count].value
-        return max
-
-    def get_value(self):
-        if self.spr is None:
-            return 0
-        sum = 0
-        for i in range(self.top_beads + self.bot_beads):
-            sum += self.beads[i + self._bead_count].get_value()
-        return sum
+        self.spr.move((x, y))
+        self.label.move_relative((dx, dy))
+        for bead in self.get_beads():
+            bead.home = (bead.home[0] + dx, bead.home[1] + dy)
+
+    def get_beads(self):
+        ''' Returns the beads allocated to this rod '''
+        return self.beads[self._bead_count:
+                          self._bead_count + self.top_beads + self.bot_beads]
+
+    def beads_changed(self, first, last):
+        ''' The model changed the state of beads first to last - 1 '''
+        offset = self._bead_count - self.model.definitions[self.rod][0]
+        for j in range(first, last):
+            self.beads[j + offset].moved()
 
     def get_bead_count(self):
         ''' Returns number of active bottom-bead equivalents on this rod'''
         if self.spr is None:
             return 0
-        count = 0
-        for i in range(self.top_beads + self.bot_beads):
-            if self.beads[i + self._bead_count].get_state() == 1:
-                if i < self.top_beads:
-                    count += self.top_factor
-                else:
-                    count += 1
-            if self.beads[i + self._bead_count].get_state() == -1:
-                count -= 1
-        return count
+        return self.model.get_bead_count(self.rod)
 
-    def set_number(self, number):
-        ''' Try to set a value equal to number; return any remainder '''
-        if self.spr is None:
-            return 0
-        count = 0
-        for i in range(self.top_beads + self.bot_beads):
-            if number >= self.beads[i + self._bead_count].value:
-                number -= self.beads[i + self._bead_count].value
-                if i < self.top_beads:
-                    count += self.top_factor
-                else:
-                    count += 1
-        self.set_value(count)
-        return number
-
-    def set_value(self, value):
-        ''' Move beads to represent a numeric value '''
-        if self.spr is None:
-            return
-        if self.top_beads > 0:
-            bot = value % self.top_factor
-            top = (value - bot) / self.top_factor
-        else:
-            bot = value
-            top = 0
-        self.reset()
-        # Set the top.
-        for i in range(top):
-            self.beads[self._bead_count + self.top_beads - i - 1].move_down()
-        # Set the bottom
-        for i in range(bot):
-            self.beads[self._bead_count + self.top_beads + i].move_up()
-
-        if value > 0:
-            self.set_label(self.get_bead_count())
-        else:
-            self.label.set_label('')
-
-    def reset(self):
+    def clear_fade(self):
+        ''' Restore the color of any faded beads '''
         if self.spr is None:
             return
-        # Clear the top.
-        for i in range(self.top_beads):
-            if self.beads[i + self._bead_count].get_state() == 1:
-                self.beads[i].move_up()
-        # Clear the bottom.
-        for i in range(self.bot_beads):
-            if self.beads[self.top_beads + i + self._bead_count].get_state() \
-               == 1:
-                self.beads[self.top_beads + i + self._bead_count].move_down()
-        # Fade beads
         for i in range(self.top_beads + self.bot_beads):
             if self.beads[self._bead_count + i].fade_level > 0:
                 self.beads[self._bead_count + i].fade_level = 0
-                self.beads[self._bead_count + i].set_color(WHITE_BEADS[0])
-        self.label.set_label('')
+                self.beads[self._bead_count + i].set_color(
+                    _white_bead(0, self.scale))
 
     def fade_colors(self):
         ''' Reduce the saturation level of every bead. '''
@@ -633,8 +885,8 @@ class Rod():
             for i in range(self.top_beads + self.bot_beads):
                 j = self._bead_count + i
                 if self.beads[j].get_fade_level() > 0:
-                    self.beads[j].set_color(
-                        WHITE_BEADS[self.beads[j].get_fade_level() - 1])
+                    self.beads[j].set_color(_white_bead(
+                        self.beads[j].get_fade_level() - 1, self.scale))
                     self.beads[j].set_fade_level(
                         self.beads[j].get_fade_level() - 1)
 
@@ -651,72 +903,29 @@ class Rod():
         if i == -1:
             return False
 
-        if self.fade and self.beads[self._bead_count + i].max_fade_level > 0:
-            self.beads[self._bead_count + i].set_color(WHITE_BEADS[3])
-        if i < self.top_beads:
-            if dy > 0 and self.beads[self._bead_count + i].get_state() == 0:
-                self.beads[self._bead_count + i].move_down()
-                # Make sure beads below this bead are also moved.
-                for ii in range(self.top_beads - i):
-                    if self.beads[self._bead_count + i + ii].state == 0:
-                        if self.fade and \
-                           self.beads[self._bead_count + i].max_fade_level > 0:
-                            self.beads[self._bead_count + i + ii].set_color(
-                                WHITE_BEADS[3])
-                        self.beads[self._bead_count + i + ii].move_down()
-            elif dy < 0 and self.beads[self._bead_count + i].state == 1:
-                self.beads[self._bead_count + i].move_up()
-                # Make sure beads above this bead are also moved.
-                for ii in range(i + 1):
-                    if self.beads[self._bead_count + i - ii].state == 1:
-                        if self.fade and \
-                           self.beads[self._bead_count + i].max_fade_level > 0:
-                            self.beads[self._bead_count + i - ii].set_color(
-                                WHITE_BEADS[3])
-                        self.beads[self._bead_count + i - ii].move_up()
-        else:
-            if dy < 0 and self.beads[self._bead_count + i].state == 0:
-                self.beads[self._bead_count + i].move_up()
-                # Make sure beads above this bead are also moved.
-                for ii in range(i - self.top_beads + 1):
-                    if self.beads[self._bead_count + i - ii].state == 0:
-                        if self.fade and \
-                           self.beads[self._bead_count + i].max_fade_level > 0:
-                            self.beads[self._bead_count + i - ii].set_color(
-                                WHITE_BEADS[3])
-                        self.beads[self._bead_count + i - ii].move_up()
-            elif dy < 0 and self.beads[self._bead_count + i].state == -1:
-                self.beads[self._bead_count + i].move_up()
-                for ii in range(i - self.top_beads + 1):
-                    if self.beads[self._bead_count + i - ii].state == -1:
-                        if self.fade and \
-                           self.beads[self._bead_count + i].max_fade_level > 0:
-                            self.beads[self._bead_count + i - ii].set_color(
-                                WHITE_BEADS[3])
-                        self.beads[self._bead_count + i - ii].move_up()
-            elif dy > 0 and self.beads[self._bead_count + i].state == 1:
-                self.beads[self._bead_count + i].move_down()
-                # Make sure beads below this bead are also moved.
-                for ii in range(self.top_beads + self.bot_beads - i):
-                    if self.beads[self._bead_count + i + ii].state == 1:
-                        if self.fade and \
-                           self.beads[self._bead_count + i].max_fade_level > 0:
-                            self.beads[self._bead_count + i + ii].set_color(
-                                WHITE_BEADS[3])
-                        self.beads[self._bead_count + i + ii].move_down()
-            elif dy > 0 and self.beads[self._bead_count + i].state == 0 and \
-                    self.beads[self._bead_count + i].tristate:
-                self.beads[self._bead_count + i].move_down()
-                # Make sure beads below this bead are also moved.
-                for ii in range(self.top_beads + self.bot_beads - i):
-                    if self.beads[self._bead_count + i + ii].state == 0:
-                        if self.fade and \
-                           self.beads[self._bead_count + i].max_fade_level > 0:
-                            self.beads[self._bead_count + i + ii].set_color(
-                                WHITE_BEADS[3])
-                        self.beads[self._bead_count + i + ii].move_down()
+        fade = self.fade and \
+            self.beads[self._bead_count + i].max_fade_level > 0
+        if fade:
+            self.beads[self._bead_count + i].set_color(
+                _white_bead(MAX_FADE_LEVEL, self.scale))
+        # The bead, and any beads it pushes, move in one transition.
+        moved = self.model.move(self.rod, i, dy)
+        if fade and moved is not None:
+            offset = self._bead_count - self.model.definitions[self.rod][0]
+            for j in range(moved[0] + offset, moved[1] + offset):
+                self.beads[j].set_color(
+                    _white_bead(MAX_FADE_LEVEL, self.scale))
 
         self.set_label(self.get_bead_count())
+        return True
+
+    def update_label(self):
+        ''' Label the rod with its count (blank if there is none) '''
+        count = self.get_bead_count()
+        if count != 0:
+            self.set_label(count)
+        elif self.label is not None:
+            self.label.set_label('')
 
     def set_label(self, n):
         ''' Different abaci use different labeling schemes. '''
@@ -737,8 +946,11 @@ class Rod():
 class Abacus():
     ''' The Abacus class is used to define the user interaction. '''
 
-    def __init__(self, canvas, parent=None):
-        ''' Initialize the canvas and set up the callbacks. '''
+    def __init__(self, canvas, parent=None, width=None, height=None,
+                 scale=None):
+        ''' Initialize the canvas and set up the callbacks. With no
+        canvas, the abacus is headless: it is sized by width, height,
+        and scale, and can only be rendered with export. '''
         self.activity = parent
 
         if parent is None:  # Starting from command line
@@ -751,21 +963,34 @@ class Abacus():
             self.bead_colors = parent.bead_colors
             parent.show_all()
 
-        self.canvas.set_can_focus(True)
-        self.canvas.add_events(Gdk.EventMask.BUTTON_PRESS_MASK)
-        self.canvas.add_events(Gdk.EventMask.BUTTON_RELEASE_MASK)
-        self.canvas.add_events(Gdk.EventMask.POINTER_MOTION_MASK)
-        self.canvas.connect('draw', self.__draw_cb)
-        self.canvas.connect('button-press-event', self._button_press_cb)
-        self.canvas.connect('button-release-event', self._button_release_cb)
-        self.canvas.connect('motion-notify-event', self._mouse_move_cb)
-        self.canvas.connect('key_press_event', self._keypress_cb)
-        Gdk.Screen.get_default().connect('size-changed', self._configure_cb)
-        self.width = Gdk.Screen.width()
-        self.height = Gdk.Screen.height() - GRID_CELL_SIZE
-        self.sprites = Sprites(self.canvas)
+        if self.canvas is None:
+            self.width = width or 1200
+            self.height = height or 900
+            if scale is not None:
+                self.scale = scale
+            elif self.width > self.height:
+                self.scale = 1.33 * self.height / 900.0
+            else:
+                self.scale = 1.33 * self.width / 1200.0
+            self.sprites = Sprites()
+        else:
+            self.canvas.set_can_focus(True)
+            self.canvas.add_events(Gdk.EventMask.BUTTON_PRESS_MASK)
+            self.canvas.add_events(Gdk.EventMask.BUTTON_RELEASE_MASK)
+            self.canvas.add_events(Gdk.EventMask.POINTER_MOTION_MASK)
+            self.canvas.connect('draw', self.__draw_cb)
+            self.canvas.connect('button-press-event', self._button_press_cb)
+            self.canvas.connect('button-release-event',
+                                self._button_release_cb)
+            self.canvas.connect('motion-notify-event', self._mouse_move_cb)
+            self.canvas.connect('key_press_event', self._keypress_cb)
+            self.canvas.add_events(Gdk.EventMask.SCROLL_MASK)
+            self.canvas.connect('scroll-event', self._scroll_cb)
+            Gdk.Screen.get_default().connect('size-changed',
+                                             self._configure_cb)
+            self._measure()
+            self.sprites = Sprites(self.canvas)
         self.sprites.set_delay(True)
-        self.scale = 1.33 * Gdk.Screen.height() / 900.0
         self.dragpos = 0
         self.press = None
         self.last = None
@@ -778,64 +1003,78 @@ class Abacus():
         if self.decimal_point == '' or self.decimal_point is None:
             self.decimal_point = '.'
 
-        size = max(self.width, self.height)
-        background_svg = _svg_header(size, size, 1.0) + \
-            _svg_rect(size, size, 0, 0, 0, 0, '#FFFFFF', '#FFFFFF') + \
-            _svg_footer()
-        background = Sprite(self.sprites, 0, 0,
-                            _svg_str_to_pixbuf(background_svg))
-        background.set_layer(1)
-
-        # Only generate bead pixbufs once
-        make_bead_pixbufs(self.scale)
-
-        self.decimal = None
-        self.soroban = None
-        self.suanpan = None
-        self.nepohualtzintzin = None
-        self.hexadecimal = None
-        self.binary = None
-        self.russian = None
-        self.fraction = None
-        self.caacupe = None
-        self.cuisenaire = None
+        STARTUP.begin('background')
+        # Under Sugar, rasterized artwork is kept between launches.
+        if self.sugar:
+            ASSETS.set_path(os.path.join(parent.get_activity_root(), 'data',
+                                         'assets'))
+
+        # Bead (and other) artwork is rasterized on demand and cached
+        ASSETS.set_scale(self.scale)
+        self.background = None
+        self._draw_background()
+        STARTUP.end()
+
         self.custom = None
+        self.virtual = None
 
         # name: [INSTANCE, CLASS]
-        self.mode_dict = {'decimal': [self.decimal, Decimal],
-                          'soroban': [self.soroban, Soroban],
-                          'suanpan': [self.suanpan, Suanpan],
-                          'nepohualtzintzin': [self.nepohualtzintzin,
-                                               Nepohualtzintzin],
-                          'hexadecimal': [self.hexadecimal, Hexadecimal],
-                          'binary': [self.binary, Binary],
-                          'schety': [self.russian, Schety],
-                          'fraction': [self.fraction, Fractions],
-                          'caacupe': [self.caacupe, Caacupe],
-                          'cuisenaire': [self.cuisenaire, Cuisenaire],
-                          'custom': [self.custom, Custom]
-                          }
+        self.mode_dict = {'custom': [self.custom, Custom],
+                          'virtual': [self.virtual, Virtual]}
+        # The abaci defined as data (see abacus_definitions)
+        self.types = OrderedDict()
+        self.add_types(TYPES)
 
+        STARTUP.begin('caches')
         self.bead_cache = []
         for i in range(MAX_BEADS):
             self.bead_cache.append(Bead())
 
+        # No abacus has more than MAX_RODS rods (see add_types).
         self.rod_cache = []
-        for i in range(MAX_BEADS):
+        for i in range(MAX_RODS):
             self.rod_cache.append(Rod(self.bead_cache))
+        STARTUP.end()
+
+        # How long (in seconds) each mode took to build
+        self.build_times = {}
+        self._prewarm_queue = None  # modes to build once we are drawn
+        self._prewarm_steps = None  # (see AbacusGeneric.warm)
 
-        self.suanpan = Suanpan(self, self.bead_colors)
+        STARTUP.begin('suanpan')
+        self.suanpan = self._build('suanpan')
         self.mode = self.suanpan
         self.mode.show()
-        self._configure_cb(None)
+        STARTUP.end()
+        if self.canvas is not None:
+            self._configure_cb(None)
 
-    def _configure_cb(self, event):
+    def _measure(self):
+        ''' Size the abacus to the screen '''
         self.width = Gdk.Screen.width()
         self.height = Gdk.Screen.height() - GRID_CELL_SIZE
         if self.width > self.height:
             self.scale = 1.33 * Gdk.Screen.height() / 900.0
         else:
             self.scale = 1.33 * Gdk.Screen.width() / 1200.0
+
+    def _draw_background(self):
+        ''' Cover the window in white (with an asset at the current scale,
+        which is not evicted by set_scale) '''
+        size = int(max(self.width, self.height) / self.scale) + 1
+        image = ASSETS.get(('rect', size, size), '#FFFFFF', '#FFFFFF',
+                           scale=self.scale)
+        if self.background is None:
+            self.background = Sprite(self.sprites, 0, 0, image)
+            self.background.set_layer(1)
+        else:
+            self.background.set_image(image)
+
+    def _configure_cb(self, event):
+        size = (self.width, self.height, self.scale)
+        self._measure()
+        if (self.width, self.height, self.scale) != size:
+            self._resize()
         if self.sugar:
             if Gdk.Screen.width() / 14 < style.GRID_CELL_SIZE:
                 for sep in self.activity.sep:
@@ -847,24 +1086,160 @@ class Abacus():
                     sep.props.draw = True
         self.canvas.set_size_request(self.width, self.height)
 
+    def _resize(self):
+        ''' Rasterize the artwork in view again, at the new size and scale
+        (the other abaci are when they are next selected, see
+        AbacusGeneric.redraw). '''
+        ASSETS.set_scale(self.scale)
+        self._draw_background()
+        self.mode.show(reset=True)
+        self.mode.label(self.generate_label())
+
     def select_abacus(self, abacus):
         if self.mode == self.mode_dict[abacus][INSTANCE]:
             _logger.debug('abacus_window: %s already select' % abacus)
             return
+        if abacus == 'custom' and self.mode_dict[abacus][INSTANCE] is None:
+            self.select_custom()  # (with the default parameters)
+            return
+        if abacus == 'virtual' and self.mode_dict[abacus][INSTANCE] is None:
+            self.select_virtual()  # (with VIRTUAL_RODS rods)
+            return
         self.mode.hide()
 
         _logger.debug('abacus_window: selecting %s' % abacus)
         if self.mode_dict[abacus][INSTANCE] is None:
             _logger.debug('creating new instance')
-            self.mode_dict[abacus][INSTANCE] = \
-                self.mode_dict[abacus][CLASS](self, self.bead_colors)
+            self._build(abacus)
         else:
             _logger.debug('restoring old instance')
-            self.mode_dict[abacus][INSTANCE].draw_rods_and_beads()
+            self.mode_dict[abacus][INSTANCE].redraw()
         self.mode = self.mode_dict[abacus][INSTANCE]
         self.mode.show()
         self.mode.label(self.generate_label())
 
+    def select_custom(self, **parameters):
+        ''' Select the custom abacus, made from parameters (see
+        Custom.set_custom_parameters); raises ValueError (leaving the
+        abacus as it was) if they do not make an abacus. '''
+        if self.mode is self.custom:  # (hiding any rods no longer needed)
+            self.custom.change_custom_parameters(**parameters)
+            self.mode.label(self.generate_label())
+            return
+        # The custom abacus is made once, and then reused.
+        if self.custom is None:
+            self.custom = Custom(self, self.bead_colors)
+        self.custom.set_custom_parameters(**parameters)
+        self.mode.hide()
+        self.custom.create()
+        self.custom.show()
+        self.mode = self.custom
+        self.mode_dict['custom'][INSTANCE] = self.custom
+        self.mode.label(self.generate_label())
+
+    def select_virtual(self, rods=VIRTUAL_RODS):
+        ''' Select the virtual abacus, with rods rods (of which
+        VISIBLE_RODS are in view at a time); raises ValueError (leaving the
+        abacus as it was) if rods is not a positive number. '''
+        if rods < 1:
+            raise ValueError('virtual: rods: %d' % (rods))
+        if self.virtual is not None and self.virtual.model_rods == rods:
+            self.select_abacus('virtual')
+            return
+        self.mode.hide()
+        # The virtual abacus is made once, and then reused.
+        if self.virtual is None:
+            self.virtual = Virtual(self, self.bead_colors, rods=rods)
+        else:
+            self.virtual.set_parameters(rods)
+            self.virtual.create()
+        self.virtual.show()
+        self.mode = self.virtual
+        self.mode_dict['virtual'][INSTANCE] = self.virtual
+        self.mode.label(self.generate_label())
+
+    def _build(self, abacus, draw_rods=True):
+        ''' Create the instance of an abacus mode, timing how long it
+        takes (see build_times); its rods are only drawn if draw_rods
+        (which must be True for custom and virtual modes). '''
+        start = time.time()
+        if draw_rods:
+            instance = self.mode_dict[abacus][CLASS](self, self.bead_colors,
+                                                     name=abacus)
+        else:
+            instance = self.mode_dict[abacus][CLASS](self, self.bead_colors)
+            instance.set_type(self.types[abacus])
+            instance.create(draw_rods=False)
+        self.mode_dict[abacus][INSTANCE] = instance
+        self.build_times[abacus] = time.time() - start
+        _logger.debug('built %s in %.1f ms', abacus,
+                      self.build_times[abacus] * 1000)
+        return instance
+
+    def add_types(self, types):
+        ''' Add abacus types (name: AbacusType), e.g., as loaded from a
+        JSON file by load_definitions '''
+        for name, abacus_type in types.iteritems():
+            if abacus_type.num_rods > MAX_RODS or \
+                    abacus_type.top_beads + abacus_type.bot_beads > \
+                    MAX_TOP + MAX_BOT:
+                raise ValueError('%s: too big for the abacus' % (name))
+            if name in self.mode_dict and \
+                    (self.mode_dict[name][CLASS] is not AbacusGeneric or
+                     self.mode_dict[name][INSTANCE] is not None):
+                raise ValueError('%s is already in use' % (name))
+        for name, abacus_type in types.iteritems():
+            self.types[name] = abacus_type
+            self.mode_dict[name] = [None, AbacusGeneric]
+
+    def prewarm(self, budget=PREWARM_BUDGET):
+        ''' Build the modes that have not been selected yet in the
+        background, so that selecting one is quick: modes are built, and
+        their artwork made a rod at a time, while the UI is idle, in
+        slices of about budget seconds. '''
+        self._prewarm_queue = [abacus for abacus in sorted(self.mode_dict)
+                               if self.mode_dict[abacus][INSTANCE] is None
+                               and abacus not in ['custom', 'virtual']]
+        GObject.idle_add(self._prewarm_cb, budget)
+
+    def _prewarm_cb(self, budget):
+        ''' Build modes for up to budget seconds (taking at least one
+        step); return True if there are more to build. '''
+        start = time.time()
+        # Nothing made here is shown, so no redraw is queued for it.
+        delay = self.sprites.get_delay()
+        self.sprites.set_delay(True)
+        try:
+            while self._prewarm_step() and time.time() - start < budget:
+                pass
+        finally:
+            self.sprites.set_delay(delay)
+        return len(self._prewarm_queue) > 0 or \
+            self._prewarm_steps is not None
+
+    def _prewarm_step(self):
+        ''' Build the next mode, or make the artwork of the next of its
+        rods; return False if there is nothing left to do. '''
+        while self._prewarm_steps is None:
+            if not self._prewarm_queue:
+                return False
+            abacus = self._prewarm_queue.pop(0)
+            if self.mode_dict[abacus][INSTANCE] is not None:
+                continue
+            # The rods (and beads) are shared by every mode, so they are
+            # left to the current mode: only the sprites of its own are
+            # made, and hidden before the next paint.
+            instance = self._build(abacus, draw_rods=False)
+            self.sprites.hide_sprites(
+                [instance.frame, instance.bar, instance.label_bar,
+                 instance.mark] + instance.dots)
+            self._prewarm_steps = instance.warm()
+        try:
+            next(self._prewarm_steps)
+        except StopIteration:
+            self._prewarm_steps = None
+        return True
+
     def _button_press_cb(self, win, event):
         ''' Callback to handle the button presses '''
         win.grab_focus()
@@ -924,12 +1299,87 @@ class Abacus():
     def _keypress_cb(self, area, event):
         ''' Keypress: moving the slides with the arrow keys '''
         k = Gdk.keyval_name(event.keyval)
-        if k in ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'period',
+        control = event.state & Gdk.ModifierType.CONTROL_MASK
+        if control and k == 'z':
+            self.undo()
+        elif control and k in ['y', 'Z']:
+            self.redo()
+        elif k in ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'period',
                  'minus', 'Return', 'BackSpace', 'comma']:
             if self.last == self.mode.label_bar:
                 self._process_numeric_input(self.last, k)
         elif k == 'r':
             self.mode.reset_abacus()
+        elif k == 'Left':
+            self.mode.scroll(-1)
+        elif k == 'Right':
+            self.mode.scroll(1)
+        elif k == 'F12':
+            self.toggle_profiling()
+        return True
+
+    def toggle_profiling(self):
+        ''' Start timing the hot paths (with their statistics shown over
+        the abacus); or stop, and write the timings as a Chrome trace. '''
+        if not PROFILER.enabled:
+            PROFILER.clear()
+            PROFILER.enable()
+            if self.canvas is not None:
+                GObject.timeout_add(OVERLAY_INTERVAL, self._overlay_cb)
+            return
+        PROFILER.disable()
+        self._overlay_cb()  # erase it
+        if self.sugar:
+            path = os.path.join(self.activity.get_activity_root(), 'data')
+        else:
+            path = tempfile.gettempdir()
+        path = os.path.join(path, 'abacus-trace-%d.json' % (time.time()))
+        try:
+            PROFILER.dump_chrome_trace(path)
+            _logger.info('profile written to %s', path)
+        except IOError, e:
+            _logger.error('cannot write profile to %s: %s', path, e)
+
+    def _overlay_area(self):
+        ''' The statistics are shown in the lower left corner. '''
+        h = (len(PROFILER.counts) + 1) * OVERLAY_LINE + 10
+        return (10, self.height - h - 10, 560, h)
+
+    def _overlay_cb(self):
+        ''' Redraw the overlay (as long as we are profiling) '''
+        if self.canvas is not None:
+            self.canvas.queue_draw_area(*self._overlay_area())
+        return PROFILER.enabled
+
+    def _overlay_only(self, cr):
+        ''' Is just the overlay to be redrawn (see _overlay_cb)? '''
+        x1, y1, x2, y2 = cr.clip_extents()
+        x, y, w, h = self._overlay_area()
+        return x1 >= x and y1 >= y and x2 <= x + w and y2 <= y + h
+
+    def _draw_overlay(self, cr):
+        ''' Draw the statistics of the hot paths '''
+        x, y, w, h = self._overlay_area()
+        cr.save()
+        cr.rectangle(x, y, w, h)
+        cr.set_source_rgba(0, 0, 0, 0.75)
+        cr.fill()
+        cr.select_font_face('monospace')
+        cr.set_font_size(12)
+        cr.set_source_rgb(1, 1, 1)
+        for i, line in enumerate(PROFILER.stats()):
+            cr.move_to(x + 5, y + (i + 1) * OVERLAY_LINE)
+            cr.show_text(line)
+        cr.restore()
+
+    def _scroll_cb(self, win, event):
+        ''' Scroll (a virtual abacus) with the mouse wheel '''
+        if event.direction in [Gdk.ScrollDirection.UP,
+                               Gdk.ScrollDirection.LEFT]:
+            self.mode.scroll(-1)
+        elif event.direction in [Gdk.ScrollDirection.DOWN,
+                                 Gdk.ScrollDirection.RIGHT]:
+            self.mode.scroll(1)
         return True
 
     def _process_numeric_input(self, sprite, keyname):
@@ -962,9 +1412,8 @@ class Abacus():
             else:
                 newnum = oldnum + keyname
         elif keyname == 'Return':
-            self.mode.reset_abacus()
             self.mode.set_value_from_number(
-                float(newnum.replace(self.decimal_point, '.')))
+                parse_number(newnum.replace(self.decimal_point, '.')))
             self.mode.label(self.generate_label())
             return
         else:
@@ -973,7 +1422,7 @@ class Abacus():
             newnum = '0.'
         if len(newnum) > 0 and newnum != '-':
             try:
-                float(newnum.replace(self.decimal_point, '.'))
+                parse_number(newnum.replace(self.decimal_point, '.'))
             except ValueError, e:
                 _logger.debug('Error converting numeric input %s: %s' %
                               (str(newnum), e))
@@ -982,100 +1431,156 @@ class Abacus():
 
     # Handle the expose-event by drawing
     def __draw_cb(self, canvas, cr):
-        self.sprites.redraw_sprites(cr=cr)
+        if self._prewarm_queue is None:  # the first paint
+            STARTUP.begin('first_draw')
+            self.sprites.redraw_sprites(cr=cr)
+            STARTUP.end()
+            STARTUP.finish()
+            self.prewarm()
+        elif PROFILER.enabled and self._overlay_only(cr):
+            # The overlay refreshing itself is not part of the profile.
+            PROFILER.pause()
+            try:
+                self.sprites.redraw_sprites(cr=cr)
+            finally:
+                PROFILER.resume()
+        else:
+            self.sprites.redraw_sprites(cr=cr)
+        if PROFILER.enabled:
+            self._draw_overlay(cr)
 
     def generate_label(self, sum_only=False):
-        ''' The complexity below is to make the label as simple as possible '''
-        rod_sums = ''
-        multiple_rods = False
-        for x in self.mode.get_rod_values():
-            if x > 0:
-                if x > 0.005:
-                    rod_value = dec2frac(x)
-                else:
-                    rod_value = str(x)
-                if rod_sums == '':
-                    rod_sums = rod_value
-                else:
-                    multiple_rods = True
-                    rod_sums += ' + %s' % (rod_value)
-            elif x < 0:
-                if x < 0.005:
-                    rod_value = dec2frac(-x)
-                else:
-                    rod_value = str(-x)
-                if rod_sums == '':
-                    rod_sums = '–%s' % (rod_value)
-                else:
-                    multiple_rods = True
-                    rod_sums += ' – %s' % (rod_value)
-        if rod_sums == '':
-            return ''
-        else:
-            abacus_value = float(self.mode.value())
-            if abacus_value == 0:
-                value = '0'
-            elif abacus_value > 0:
-                whole = int(floor(abacus_value))
-                fraction = abacus_value - whole
-                if whole == 0:
-                    if fraction > 0.005:
-                        value = dec2frac(fraction)
-                    else:
-                        value = str(fraction)
-                elif fraction == 0:
-                    value = '%d' % (whole)
-                else:
-                    if fraction > 0.005:
-                        value = '%d %s' % (whole, dec2frac(fraction))
-                    else:
-                        value = '%d %s' % (whole, str(fraction))
-            else:
-                whole = int(ceil(abacus_value))
-                fraction = abacus_value - whole
-                if whole == 0:
-                    if fraction < 0.005:
-                        value = '–%s' % (dec2frac(-fraction))
-                    else:
-                        value = '–%s' % (str(-fraction))
-                elif fraction == 0:
-                    value = '–%d' % (-whole)
-                else:
-                    if fraction < 0.005:
-                        value = '–%d %s' % (-whole, dec2frac(-fraction))
-                    else:
-                        value = '–%d %s' % (-whole, str(-fraction))
-            if value == '' or value == '–':
-                value = '0'
-            if multiple_rods and not sum_only:
-                return rod_sums + ' = ' + value
-            else:
-                return value
+        ''' Label for the current abacus (see AbacusGeneric) '''
+        return self.mode.generate_label(sum_only)
+
+    def undo(self):
+        ''' Undo the last change to the current abacus '''
+        if self.mode.undo():
+            self.mode.label(self.generate_label())
+
+    def redo(self):
+        ''' Redo the last change undone on the current abacus '''
+        if self.mode.redo():
+            self.mode.label(self.generate_label())
 
     def init(self):
         self.sprites.set_delay(False)
         self.sprites.draw_all()
 
+    def export(self, path, abacus=None, value=None, **parameters):
+        ''' Render the abacus to a file: the file type (PNG, SVG, or PDF)
+        is chosen by the extension of path. Optionally, first select an
+        abacus (the custom and virtual abaci are made from parameters, see
+        select_custom and select_virtual) and set its value (raises
+        ValueError if it does not fit). '''
+        if abacus == 'custom':
+            self.select_custom(**parameters)
+        elif abacus == 'virtual':
+            self.select_virtual(**parameters)
+        elif abacus is not None:
+            self.select_abacus(abacus)
+        if value is not None:
+            fits = self.mode.set_value_from_number(parse_number(str(value)))
+            self.mode.label(self.generate_label())
+            if not fits:
+                raise ValueError('%s does not fit on the %s abacus' %
+                                 (value, self.mode.name))
+        width, height = int(self.width), int(self.height)
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.svg':
+            surface = cairo.SVGSurface(path, width, height)
+        elif extension == '.pdf':
+            surface = cairo.PDFSurface(path, width, height)
+        else:
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        cr = cairo.Context(surface)
+        self.sprites.redraw_sprites(cr=cr)
+        if extension in ['.svg', '.pdf']:
+            surface.finish()
+        else:
+            surface.write_to_png(path)
+
+
+def parse_number(text):
+    ''' The exact value of a number written as text: an int, or a Fraction
+    (e.g., for 12.5 or 3/4), so that no digit of a long number is lost (as
+    it would be as a float); raises ValueError if text is not a number '''
+    number = Fraction(text.strip())
+    if number.denominator == 1:
+        return number.numerator
+    return number
+
+
+def _custom_type(rods, top, bot, factor, base):
+    ''' The type of a custom abacus '''
+    if rods > MAX_RODS or top > MAX_TOP or bot > MAX_BOT:
+        raise ValueError('custom: too big for the abacus')
+    return AbacusType('custom', {'rods': rods, 'top': top, 'bottom': bot,
+                                 'factor': factor, 'base': base})
+
 
 class AbacusGeneric():
-    ''' A generic abacus: a frame, rods, and beads. '''
+    ''' A generic abacus: a frame, rods, and beads, as defined by an
+    abacus type (see abacus_definitions). '''
 
-    def __init__(self, abacus, bead_colors=None):
-        ''' Specify parameters that define the abacus '''
+    def __init__(self, abacus, bead_colors=None, name=None):
+        ''' Create the abacus of type name (see Abacus.types) '''
         self.abacus = abacus
         self.bead_colors = bead_colors
+        self.background = None
+        self.foreground = None
+        self._background_scale = None
+        self._size = None  # the (window width, scale) it was created for
+        # The sprites are created once and reused (see create).
+        self.frame = None
+        self.dots = []
+        self.label_bar = None
+        self.bar = None
+        self.mark = None
+        # The rods (and their beads) are views of the model.
+        self.model = AbacusModel(AbacusHistory())
+        self.model.connect(self._model_changed)
+        # The label is maintained rod by rod (see generate_label).
+        self._generation = None
+        self._changed_rods = set()
+        self._stale_terms = set()
+        self._rod_sums = ''
+        self._multiple_rods = False
+        self._message = None  # shown in place of the next label
+        if name is not None:
+            self.set_type(abacus.types[name])
+            self.create()
+
+    def _model_changed(self, rod, first, last):
+        ''' Reposition the beads whose state changed. '''
+        self.rods[rod].beads_changed(first, last)
+        self._changed_rods.add(rod)
+
+    def set_type(self, abacus_type):
+        ''' Define the abacus, and its model, from a type '''
+        self.type = abacus_type
+        self.name = abacus_type.name
+        self.num_rods = abacus_type.num_rods
+        self.top_beads = abacus_type.top_beads
+        self.bot_beads = abacus_type.bot_beads
+        self.top_factor = abacus_type.top_factor
+        self.base = abacus_type.base
+        stride = self.top_beads + self.bot_beads
+        for i, row in enumerate(abacus_type.rods):
+            top_beads, bot_beads, top_factor, bead_value, style, \
+                tristate = row[:6]
+            self.model.define_rod(i, i * stride, top_beads, bot_beads,
+                                  top_factor, bead_value, tristate)
+        self.model.truncate(len(abacus_type.rods))
 
     def set_parameters(self, rods=15, top=2, bot=5, factor=5, base=10):
         ''' Define the physical paramters. '''
-        self.name = 'suanpan'
-        self.num_rods = rods
-        self.bot_beads = top
-        self.top_beads = bot
-        self.top_factor = factor
-        self.base = base
-
-    def create(self, dots=False):
-        ''' Create and position the sprites that compose the abacus '''
+        self.set_type(_custom_type(rods, top, bot, factor, base))
+
+    def create(self, draw_rods=True):
+        ''' Create and position the sprites that compose the abacus; if
+        not draw_rods, the rods are left as they are (see Abacus.prewarm
+        and warm). '''
         # Width is a function of the number of rods
         self.frame_width = self.num_rods * (BEAD_WIDTH + BEAD_OFFSET) + \
             FRAME_STROKE_WIDTH * 2
@@ -1088,70 +1593,51 @@ class AbacusGeneric():
                 FRAME_STROKE_WIDTH * 2
 
         # Draw the frame...
+        self._size = (self.abacus.width, self.abacus.scale)
         x = (self.abacus.width - (self.frame_width * self.abacus.scale)) / 2
         y = int(BEAD_HEIGHT * 1.5)
-        frame = _svg_header(self.frame_width, self.frame_height,
-                            self.abacus.scale) + \
-            _svg_rect(self.frame_width, self.frame_height,
-                      FRAME_STROKE_WIDTH / 2, FRAME_STROKE_WIDTH / 2, 0, 0,
-                      '#000000', '#000000') + \
-            _svg_rect(self.frame_width - (FRAME_STROKE_WIDTH * 2),
-                      self.frame_height - (FRAME_STROKE_WIDTH * 2), 0, 0,
-                      FRAME_STROKE_WIDTH, FRAME_STROKE_WIDTH,
-                      '#C0C0C0', '#000000') + \
-            _svg_footer()
-        self.frame = Sprite(self.abacus.sprites, x, y,
-                            _svg_str_to_pixbuf(frame))
+        frame = ASSETS.get(('frame', self.frame_width, self.frame_height),
+                           '#C0C0C0', '#000000', scale=self.abacus.scale)
+        self.frame = self._reuse(self.frame, x, y, frame)
         self.frame.type = 'frame'
 
         # Some abaci (Soroban) use a dot to show the units position
-        if dots:
+        dots = []
+        if self.type.dots:
             dx = (BEAD_WIDTH + BEAD_OFFSET) * self.abacus.scale
             dotx = int(self.abacus.width / 2) - 5
             doty = [y + 5, y + self.frame.rect[3] - 15]
-            self.dots = []
-            white_dot = _svg_header(10, 10, self.abacus.scale) + \
-                _svg_circle(5, 5, 5, '#FFFFFF', '#000000') + \
-                _svg_footer()
-            self.dots.append(Sprite(self.abacus.sprites,
-                                    dotx, doty[0],
-                                    _svg_str_to_pixbuf(white_dot)))
-            self.dots.append(Sprite(self.abacus.sprites,
-                                    dotx, doty[1],
-                                    _svg_str_to_pixbuf(white_dot)))
-
-            black_dot = _svg_header(10, 10, self.abacus.scale) + \
-                _svg_circle(5, 5, 5, '#282828', '#FFFFFF') + \
-                _svg_footer()
+            white_dot = ASSETS.get('dot', '#FFFFFF', '#000000',
+                                   scale=self.abacus.scale)
+            dots.append((dotx, doty[0], white_dot))
+            dots.append((dotx, doty[1], white_dot))
+
+            black_dot = ASSETS.get('dot', '#282828', '#FFFFFF',
+                                   scale=self.abacus.scale)
             for i in range(int(self.num_rods / 4 - 1)):  # mark 1000s
                 if i % 2 == 0:
                     dot = black_dot
                 else:
                     dot = white_dot
-                self.dots.append(Sprite(self.abacus.sprites,
-                                        dotx - 3 * (i + 1) * dx, doty[0],
-                                        _svg_str_to_pixbuf(dot)))
-                self.dots.append(Sprite(self.abacus.sprites,
-                                        dotx + 3 * (i + 1) * dx, doty[0],
-                                        _svg_str_to_pixbuf(dot)))
-                self.dots.append(Sprite(self.abacus.sprites,
-                                        dotx - 3 * (i + 1) * dx, doty[1],
-                                        _svg_str_to_pixbuf(dot)))
-                self.dots.append(Sprite(self.abacus.sprites,
-                                        dotx + 3 * (i + 1) * dx, doty[1],
-                                        _svg_str_to_pixbuf(dot)))
-            for dot in self.dots:
-                dot.set_layer(DOT_LAYER)
-                dot.type = 'frame'
+                dots.append((dotx - 3 * (i + 1) * dx, doty[0], dot))
+                dots.append((dotx + 3 * (i + 1) * dx, doty[0], dot))
+                dots.append((dotx - 3 * (i + 1) * dx, doty[1], dot))
+                dots.append((dotx + 3 * (i + 1) * dx, doty[1], dot))
+        # Any dots no longer needed are released.
+        self.abacus.sprites.hide_sprites(self.dots[len(dots):])
+        del self.dots[len(dots):]
+        for i, (dotx, doty, dot) in enumerate(dots):
+            if i < len(self.dots):
+                self._reuse(self.dots[i], dotx, doty, dot)
+            else:
+                self.dots.append(self._reuse(None, dotx, doty, dot))
+                self.dots[i].type = 'frame'
+            self.dots[i].set_layer(DOT_LAYER)
 
         # Draw the label bar
-        label = _svg_header(self.frame_width, BEAD_HEIGHT,
-                            self.abacus.scale) + \
-            _svg_rect(self.frame_width, BEAD_HEIGHT, 0, 0, 0, 0,
-                      'none', 'none') + \
-            _svg_footer()
-        self.label_bar = Sprite(self.abacus.sprites, x, 0,
-                                _svg_str_to_pixbuf(label))
+        label = ASSETS.get(('rect', self.frame_width, BEAD_HEIGHT),
+                           'none', 'none', scale=self.abacus.scale)
+        self.label_bar = self._reuse(self.label_bar, x, 0, label)
         self.label_bar.type = 'frame'
         self.label_bar.set_label_attributes(24, rescale=False)
         self.label_bar.set_label_color('black')
@@ -1162,35 +1648,80 @@ class AbacusGeneric():
 
         self.rods = self.abacus.rod_cache
 
-        self.draw_rods_and_beads(x, y)
+        if draw_rods:
+            self.draw_rods_and_beads(x, y)
+        else:  # (drawn when the abacus is selected)
+            self.rod_x = x
+            self.rod_y = y
 
         # Draw the dividing bar...
-        bar = _svg_header(self.frame_width - (FRAME_STROKE_WIDTH * 2),
-                          BEAD_HEIGHT, self.abacus.scale) + \
-            _svg_rect(self.frame_width - (FRAME_STROKE_WIDTH * 2),
-                      BEAD_HEIGHT, 0, 0, 0, 0, '#000000', '#000000') + \
-            _svg_footer()
+        bar = ASSETS.get(('rect', self.frame_width - (FRAME_STROKE_WIDTH * 2),
+                          BEAD_HEIGHT), '#000000', '#000000',
+                         scale=self.abacus.scale)
         if self.top_beads > 0:
-            self.bar = Sprite(self.abacus.sprites, x,
-                              y + (self.top_beads + 2) * BEAD_HEIGHT *
-                              self.abacus.scale,
-                              _svg_str_to_pixbuf(bar))
+            self.bar = self._reuse(self.bar, x,
+                                   y + (self.top_beads + 2) * BEAD_HEIGHT *
+                                   self.abacus.scale, bar)
         else:
-            self.bar = Sprite(self.abacus.sprites, x,
-                              y - FRAME_STROKE_WIDTH * self.abacus.scale,
-                              _svg_str_to_pixbuf(bar))
+            self.bar = self._reuse(self.bar, x,
+                                   y - FRAME_STROKE_WIDTH * self.abacus.scale,
+                                   bar)
         self.bar.type = 'frame'
 
         # and finally, the mark.
-        mark = _svg_header(20, 15, self.abacus.scale) + \
-            _svg_indicator() + \
-            _svg_footer()
+        mark = ASSETS.get('mark', '#FF0000', '#FF0000',
+                          scale=self.abacus.scale)
         dx = (BEAD_WIDTH + BEAD_OFFSET) * self.abacus.scale
-        self.mark = Sprite(self.abacus.sprites, x + (self.num_rods - 1) * dx,
-                           y - (FRAME_STROKE_WIDTH / 2) * self.abacus.scale,
-                           _svg_str_to_pixbuf(mark))
+        self.mark = self._reuse(self.mark, x + (self.num_rods - 1) * dx,
+                                y - (FRAME_STROKE_WIDTH / 2) *
+                                self.abacus.scale, mark)
         self.mark.type = 'mark'
 
+        # The static parts are composited the next time we are shown.
+        self._background_scale = None
+
+    def warm(self):
+        ''' Make the artwork of the beads ahead of time, a rod at a time,
+        yielding before each (see Abacus.prewarm) '''
+        _layout(self.type, self.abacus.scale)
+        for i, row in enumerate(self.type.rods):
+            yield
+            _bead_image(row[4], i, self.type.lozenge, self.abacus.scale)
+            if row[4] == 'middle':
+                _black_bead(self.abacus.scale)
+
+    def _reuse(self, spr, x, y, image):
+        ''' Move spr to (x, y) with a new image; or, if there is no spr
+        yet, create it. '''
+        if spr is None:
+            return Sprite(self.abacus.sprites, x, y, image)
+        spr.set_image(image)
+        spr.move((x, y))
+        return spr
+
+    def relayout(self, abacus_type):
+        ''' Change, in place, to another type of abacus: the sprites are
+        reused, only the rods and beads that changed are redrawn, and
+        those no longer needed are hidden. '''
+        if abacus_type.key == self.type.key and \
+                abacus_type.dots == self.type.dots:
+            return
+        old = self._sprites()
+        self.set_type(abacus_type)
+        self.create()
+        new = set(self._sprites())
+        self.abacus.sprites.hide_sprites([spr for spr in old
+                                          if spr not in new])
+        self.show()
+
+    def redraw(self):
+        ''' Draw the rods and beads again; or, if the window has been
+        resized since the abacus was created, everything. '''
+        if self._size != (self.abacus.width, self.abacus.scale):
+            self.create()
+        else:
+            self.draw_rods_and_beads()
+
     def draw_rods_and_beads(self, x=None, y=None):
         ''' Draw the rods and beads '''
         if x is None:
@@ -1199,84 +1730,198 @@ class AbacusGeneric():
         else:
             self.rod_x = x
             self.rod_y = y
+        self._draw_rods(x, y)
 
+    def _draw_rods(self, x, y, first=0):
+        ''' Lay the rods out from the layout table: in position i is rod
+        first + i of the model. '''
+        layout = _layout(self.type, self.abacus.scale)
         dx = (BEAD_WIDTH + BEAD_OFFSET) * self.abacus.scale
         ro = (BEAD_WIDTH + 5) * self.abacus.scale / 2
-        bead_count = 0
+        stride = self.top_beads + self.bot_beads
+        bead_color = None
         for i in range(self.num_rods):
+            rod = first + i
+            row = self.type.rods[rod]
             if self.bead_colors is not None:
-                bead_color = self.bead_colors[i % 2]
-            bead_value = pow(self.base, self.num_rods - i - 1)
+                bead_color = self.bead_colors[rod % 2]
+            # A rod that looks as it was drawn (wherever it was, and
+            # whatever its beads are worth) is only moved, and its beads
+            # placed.
+            signature = (self, row[:3] + row[4:], rod % 2, layout[rod],
+                         stride, self.frame_height, self.abacus.scale,
+                         bead_color)
+            if self.rods[i].signature == signature:
+                self.rods[i].move(x + i * dx + ro, y, rod, row[3])
+                for bead in self.rods[i].get_beads():
+                    bead.place()
+                self.rods[i].update_label()
+                continue
             self.rods[i].update(self.abacus.sprites,
-                                ROD_COLORS[i % len(ROD_COLORS)],
+                                row[6] or ROD_COLORS[rod % 2],
                                 self.frame_height,
                                 i, x + i * dx + ro, y, self.abacus.scale,
-                                bead_count, bead_color)
-            bead_count += (self.top_beads + self.bot_beads)
-            self.rods[i].allocate_beads(self.top_beads, self.bot_beads,
-                                        self.top_factor,
-                                        bead_value, self.bot_beads)
+                                i * stride, bead_color,
+                                cuisenaire=self.type.lozenge,
+                                model=self.model, rod=rod)
+            self.rods[i].allocate_beads(row, layout[rod])
+            self.rods[i].signature = signature
 
     def hide(self):
         ''' Hide the rod, beads, mark, and frame. '''
-        for i in range(self.num_rods):
-            self.rods[i].hide()
-        self.bar.hide()
-        self.label_bar.hide()
-        self.frame.hide()
-        self.mark.hide()
-        if hasattr(self, 'dots'):
-            for dot in self.dots:
-                dot.hide()
+        self.abacus.sprites.hide_sprites(self._sprites())
+
+    def _sprites(self):
+        ''' All of the sprites in use by this abacus '''
+        sprites = self._static_sprites()
+        for rod in self._allocated_rods():
+            sprites += [bead.spr for bead in rod.get_beads()]
+            sprites += [rod.label, rod.composite]
+        sprites += [self.label_bar, self.mark]
+        if self.background is not None:
+            sprites += [self.background, self.foreground]
+        return sprites
 
     def show(self, reset=False):
         ''' Show the rod, beads, mark, and frame. '''
         if reset:
             self.create()
-        self.frame.set_layer(FRAME_LAYER)
-        for i in range(self.num_rods):
-            self.rods[i].show()
-        self.bar.set_layer(BAR_LAYER)
-        self.label_bar.set_layer(BAR_LAYER)
-        if hasattr(self, 'dots'):
-            for dot in self.dots:
-                dot.set_layer(DOT_LAYER)
-        self.mark.set_layer(MARK_LAYER)
+        if self._background_scale != self.abacus.scale:
+            self._composite_background()
+        # Set the layers in bulk rather than sprite by sprite.
+        sprites = self.abacus.sprites
+        rods = self._allocated_rods()
+        sprites.hide_sprites(self._static_sprites())
+        sprites.set_layers([self.background], FRAME_LAYER)
+        sprites.set_layers([self.foreground], DOT_LAYER)
+        sprites.set_layers([bead.spr for rod in rods
+                            for bead in rod.get_beads()], BEAD_LAYER)
+        # Each rod's beads and label are drawn by the rod's composite.
+        sprites.set_layers([rod.composite for rod in rods], BEAD_LAYER)
+        sprites.set_layers([rod.label for rod in rods], MARK_LAYER)
+        sprites.set_layers([self.label_bar], BAR_LAYER)
+        sprites.set_layers([self.mark], MARK_LAYER)
+
+    def _static_sprites(self):
+        ''' The sprites that never change during interaction, bottom to
+        top: frame, rods, dividing bar, and dots '''
+        sprites = [self.frame]
+        sprites += [rod.spr for rod in self._allocated_rods()]
+        sprites.append(self.bar)
+        sprites += self.dots
+        return sprites
+
+    def _composite_background(self):
+        ''' Composite the static sprites (per abacus and scale) so that
+        they are drawn with two blits: the frame and rods below the beads,
+        and the dividing bar and dots above them. '''
+        self.background = self._composite(
+            self.background,
+            [self.frame] + [rod.spr for rod in self._allocated_rods()])
+        self.foreground = self._composite(self.foreground,
+                                          [self.bar] + self.dots)
+        self._background_scale = self.abacus.scale
+
+    def _composite(self, composite, sprites):
+        ''' Draw sprites (bottom to top) into the image of composite, a
+        sprite just big enough to cover them (created if it is None) '''
+        x = min([spr.rect[0] for spr in sprites])
+        y = min([spr.rect[1] for spr in sprites])
+        w = max([spr.rect[0] + spr.rect[2] for spr in sprites]) - x
+        h = max([spr.rect[1] + spr.rect[3] for spr in sprites]) - y
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+        cr = cairo.Context(surface)
+        cr.translate(-x, -y)
+        for spr in sprites:
+            spr.draw(cr=cr)
+        surface.flush()
+        if composite is None:
+            composite = Sprite(self.abacus.sprites, x, y, surface)
+            composite.type = 'frame'
+        else:
+            composite.set_image(surface)
+            composite.move((x, y))
+        return composite
+
+    def _allocated_rods(self):
+        ''' The rods (with sprites) in use by this abacus '''
+        return [rod for rod in self.rods[:self.num_rods]
+                if rod.spr is not None]
+
+    def _label_rods(self):
+        for rod in self._allocated_rods():
+            rod.update_label()
+
+    def _set_counts(self, counts):
+        ''' Move the beads on every rod to their counts in one write '''
+        for rod in self._allocated_rods():
+            rod.clear_fade()
+        self.model.set_counts(counts)
+        self._label_rods()
 
     def set_value(self, string):
         ''' Set abacus to value in string '''
         value = string.split()
         # Move the beads to correspond to column values.
         try:
-            for i in range(self.num_rods):
-                self.rods[i].set_value(int(value[i]))
+            counts = [int(value[i]) for i in range(len(self.model))]
         except IndexError:
             _logger.debug('bad saved string length %s (%d != 2 * %d)',
-                          string, len(string), self.num_rods)
+                          string, len(string), len(self.model))
+            return
         except ValueError:
-            _logger.debug('bad saved string type %s (%s)',
-                          string, str(value[i]))
+            _logger.debug('bad saved string type %s', string)
+            return
+        self._set_counts(counts)
 
     def max_value(self):
         ''' Maximum value possible on abacus '''
-        max = 0
-        for i in range(self.num_rods):
-            max += self.rods[i].get_max_value()
-        return max
+        return self.model.max_value()
 
     def set_value_from_number(self, number):
-        ''' Set abacus to value in string '''
-        self.reset_abacus()
-        if number <= self.max_value():
-            for i in range(self.num_rods):
-                number = self.rods[i].set_number(number)
-                if number == 0:
-                    break
+        ''' Set abacus to value in string; if the number does not fit,
+        the abacus is left as it is, and if it is finer than the smallest
+        bead, the abacus is set as close as it can be (without exceeding
+        it); either way, the reason is shown in the label bar (see
+        generate_label). Returns False unless the number fits exactly. '''
+        # Decompose the number into (exact) bead counts, rod by rod.
+        try:
+            counts, remainder = self.model.decompose(number)
+        except ValueError, e:
+            _logger.debug('cannot set %s: %s', self.name, e)
+            self._message = str(e)
+            return False
+        self._set_counts(counts)
+        if remainder != 0:
+            _logger.debug('%s is short of %s by %s', self.name, number,
+                          remainder)
+            # (the exact remainder of 12.7, a float, is not quite 7/10)
+            self._message = '%s: %s is left over' % (
+                dec2frac(number), dec2frac(float(remainder)))
+            return False
+        return True
 
     def reset_abacus(self):
         ''' Reset beads to original position '''
-        for i in range(self.num_rods):
-            self.rods[i].reset()
+        self._set_counts([0] * len(self.model))
+
+    def undo(self):
+        ''' Undo the last change to the abacus '''
+        for rod in self._allocated_rods():
+            rod.clear_fade()
+        if self.model.undo():
+            self._label_rods()
+            return True
+        return False
+
+    def redo(self):
+        ''' Redo the last change undone '''
+        for rod in self._allocated_rods():
+            rod.clear_fade()
+        if self.model.redo():
+            self._label_rods()
+            return True
+        return False
 
     def value(self, count_beads=False):
         ''' Return a string representing the value of each rod. '''
@@ -1295,16 +1940,87 @@ class AbacusGeneric():
             for i in value[1:]:
                 string += '%2d ' % (i)
         else:
-            rod_sum = 0
-            for i in range(self.num_rods):
-                rod_sum += self.rods[i].get_value()
-            string = str(rod_sum)
+            # Callers expect a decimal string.
+            value = self.model.value()
+            if value.denominator == 1:
+                string = str(value.numerator)
+            else:
+                string = str(float(value))
         return(string)
 
     def label(self, string):
         ''' Label with the string. (Used with self.value) '''
+        if self.label_bar.labels and self.label_bar.labels[0] == string:
+            return
         self.label_bar.set_label(string)
 
+    def _update_terms(self, sum_only=False):
+        ''' Keep a running total (in units) of the rods that changed
+        since the last label, and reformat the terms of just those rods
+        (unless only the sum is shown: then they wait until they are). '''
+        if self._generation != self.model.generation:
+            self._generation = self.model.generation
+            self._rod_units = [0] * len(self.model)
+            self._terms = [None] * len(self.model)
+            self._total = 0
+            self._changed_rods = set(range(len(self.model)))
+            self._stale_terms = set()
+        for i in self._changed_rods:
+            units = self.model.get_units(i)
+            self._total += units - self._rod_units[i]
+            self._rod_units[i] = units
+        self._stale_terms |= self._changed_rods
+        self._changed_rods.clear()
+        if sum_only or not self._stale_terms:
+            return
+        for i in self._stale_terms:
+            value = Fraction(self._rod_units[i], self.model.unit)
+            if value > 0:
+                self._terms[i] = (' + ', dec2frac(value))
+            elif value < 0:
+                self._terms[i] = (' – ', dec2frac(-value))
+            else:
+                self._terms[i] = None
+        self._stale_terms.clear()
+        terms = [term for term in self._terms if term is not None]
+        if len(terms) == 0:
+            self._rod_sums = ''
+        else:
+            sign, term = terms[0]
+            if sign == ' – ':
+                self._rod_sums = '–%s' % (term)
+            else:
+                self._rod_sums = term
+            self._rod_sums += ''.join([sign + term
+                                       for sign, term in terms[1:]])
+        self._multiple_rods = len(terms) > 1
+
+    def generate_label(self, sum_only=False):
+        ''' The complexity below is to make the label as simple as possible:
+        each rod's term is only reformatted when the rod changes. '''
+        if self._message is not None:
+            message, self._message = self._message, None
+            return message
+        self._update_terms(sum_only)
+        if sum_only and self._total == 0 or \
+                not sum_only and self._rod_sums == '':
+            return ''
+        value = Fraction(self._total, self.model.unit)
+        if value == 0:
+            value = '0'
+        elif value > 0:
+            value = dec2frac(value)
+        else:
+            value = '–%s' % (dec2frac(-value))
+        if self._multiple_rods and not sum_only:
+            return self._rod_sums + ' = ' + value
+        else:
+            return value
+
+    def scroll(self, n):
+        ''' Only a virtual abacus scrolls. '''
+        return
+
     def move_mark(self, dx):
         ''' Move indicator horizontally across the top of the frame. '''
         self.mark.move_relative((dx, 0))
@@ -1323,17 +2039,13 @@ class AbacusGeneric():
 
     def get_rod_values(self):
         ''' Return the sum of the values per rod as an array '''
-        v = [0] * (self.num_rods + 1)
-
-        for i in range(self.num_rods):
-            v[i + 1] = self.rods[i].get_value()
-        return v[1:]
+        return self.model.get_rod_values()
 
 
 class Custom(AbacusGeneric):
     ''' A custom-made abacus '''
 
-    def __init__(self, abacus, bead_colors=None):
+    def __init__(self, abacus, bead_colors=None, name='custom'):
         ''' Specify parameters that define the abacus '''
         AbacusGeneric.__init__(self, abacus, bead_colors)
         self.set_custom_parameters()
@@ -1341,366 +2053,76 @@ class Custom(AbacusGeneric):
 
     def set_custom_parameters(self, rods=15, top=2, bot=5, factor=5, base=10):
         ''' Specify parameters that define the abacus '''
-        self.name = 'custom'
-        self.num_rods = rods
-        self.bot_beads = bot
-        self.top_beads = top
-        self.top_factor = factor
-        self.base = base
-
-
-class Nepohualtzintzin(AbacusGeneric):
-    ''' A Mayan abacus '''
-
-    def __init__(self, abacus, bead_colors=None):
-        ''' Specify parameters that define the abacus '''
-        AbacusGeneric.__init__(self, abacus, bead_colors)
-        self.set_parameters()
-        self.create()
+        self.set_parameters(rods, top, bot, factor, base)
 
-    def set_parameters(self):
-        ''' Specify parameters that define the abacus '''
-        self.name = 'nepohualtzintzin'
-        self.num_rods = 13
-        self.bot_beads = 4
-        self.top_beads = 3
-        self.base = 20
-        self.top_factor = 5
+    def change_custom_parameters(self, rods=15, top=2, bot=5, factor=5,
+                                 base=10):
+        ''' Change the parameters of the abacus as it is shown '''
+        self.relayout(_custom_type(rods, top, bot, factor, base))
 
 
-class Suanpan(AbacusGeneric):
-    ''' A Chinese abacus '''
+class Virtual(AbacusGeneric):
+    ''' A very wide abacus: the model holds every rod, but only the rods
+    in view have sprites, which are recycled as the abacus scrolls. '''
 
-    def __init__(self, abacus, bead_colors=None):
+    def __init__(self, abacus, bead_colors=None, name='virtual',
+                 rods=VIRTUAL_RODS):
         ''' Specify parameters that define the abacus '''
         AbacusGeneric.__init__(self, abacus, bead_colors)
-        self.set_parameters()
+        self.set_parameters(rods)
         self.create()
 
-    def set_parameters(self):
-        ''' Create a Chinese abacus: 15 by (5,2). '''
-        self.name = 'suanpan'
-        self.num_rods = 15
-        self.bot_beads = 5
-        self.top_beads = 2
-        self.base = 10
-        self.top_factor = 5
-
-
-class Soroban(AbacusGeneric):
-    ''' A Japanese abacus '''
-
-    def __init__(self, abacus, bead_colors=None):
-        ''' Specify parameters that define the abacus '''
-        AbacusGeneric.__init__(self, abacus, bead_colors)
-        self.set_parameters()
-        self.create(dots=True)
-
-    def set_parameters(self):
-        ''' create a Japanese abacus: 15 by (4,1) '''
-        self.name = 'soroban'
-        self.num_rods = 15
-        self.bot_beads = 4
-        self.top_beads = 1
-        self.base = 10
-        self.top_factor = 5
+    def set_parameters(self, rods=VIRTUAL_RODS):
+        ''' Create a virtual abacus: rods by (4,1), 15 at a time '''
+        self.set_type(AbacusType('virtual', {'rods': rods, 'top': 1,
+                                             'bottom': 4, 'factor': 5}))
+        self.model_rods = rods
+        self.num_rods = min(rods, VISIBLE_RODS)  # the rods in view
+        self.offset = rods - self.num_rods  # start with the units in view
 
     def draw_rods_and_beads(self, x=None, y=None):
-        ''' Draw the rods and beads: units offset to center'''
+        ''' Draw the rods in view: rod i shows rod offset + i '''
         if x is None:
             x = self.rod_x
             y = self.rod_y
         else:
             self.rod_x = x
             self.rod_y = y
+        self._draw_rods(x, y, self.offset)
+
+    def _model_changed(self, rod, first, last):
+        ''' Only the rods in view have beads to reposition. '''
+        if self.offset <= rod < self.offset + self.num_rods:
+            self.rods[rod - self.offset].beads_changed(first, last)
+        self._changed_rods.add(rod)
+
+    def scroll(self, n):
+        ''' Scroll the view n rods to the right (left if n < 0). '''
+        offset = max(0, min(self.offset + n, self.model_rods - self.num_rods))
+        if offset == self.offset:
+            return
+        self.offset = offset
+        self.draw_rods_and_beads()
+        # The rods (whose colors alternate) are in the background.
+        self._composite_background()
 
-        dx = (BEAD_WIDTH + BEAD_OFFSET) * self.abacus.scale
-        ro = (BEAD_WIDTH + 5) * self.abacus.scale / 2
-        bead_count = 0
-        for i in range(self.num_rods):
-            if self.bead_colors is not None:
-                bead_color = self.bead_colors[i % 2]
-            bead_value = pow(self.base, int(self.num_rods / 2) - i)
-            self.rods[i].update(self.abacus.sprites,
-                                ROD_COLORS[i % len(ROD_COLORS)],
-                                self.frame_height,
-                                i, x + i * dx + ro, y, self.abacus.scale,
-                                bead_count, bead_color)
-            bead_count += (self.top_beads + self.bot_beads)
-            self.rods[i].allocate_beads(self.top_beads, self.bot_beads,
-                                        self.top_factor,
-                                        bead_value, self.bot_beads)
-
-
-class Hexadecimal(AbacusGeneric):
-    ''' A hexadecimal abacus '''
-
-    def __init__(self, abacus, bead_colors=None):
-        ''' Specify parameters that define the abacus '''
-        AbacusGeneric.__init__(self, abacus, bead_colors)
-        self.set_parameters()
-        self.create()
-
-    def set_parameters(self):
-        ''' create a hexadecimal abacus: 15 by (7,1) '''
-        self.name = 'hexadecimal'
-        self.num_rods = 15
-        self.bot_beads = 7
-        self.top_beads = 1
-        self.base = 16
-        self.top_factor = 8
-
-
-class Decimal(AbacusGeneric):
-    ''' A decimal abacus '''
-
-    def __init__(self, abacus, bead_colors=None):
-        ''' Specify parameters that define the abacus '''
-        AbacusGeneric.__init__(self, abacus, bead_colors)
-        self.set_parameters()
-        self.create()
-
-    def set_parameters(self):
-        ''' create a decimal abacus: 10 by (10,0) '''
-        self.name = 'decimal'
-        self.num_rods = 10
-        self.bot_beads = 10
-        self.top_beads = 0
-        self.base = 10
-        self.top_factor = 1
-
-    def draw_rods_and_beads(self, x=None, y=None):
-        ''' Draw the rods and beads: override bead color'''
-        if x is None:
-            x = self.rod_x
-            y = self.rod_y
-        else:
-            self.rod_x = x
-            self.rod_y = y
-        dx = (BEAD_WIDTH + BEAD_OFFSET) * self.abacus.scale
-        ro = (BEAD_WIDTH + 5) * self.abacus.scale / 2
-        bead_count = 0
-        for i in range(self.num_rods):
-            if self.bead_colors is not None:
-                bead_color = self.bead_colors[i % 2]
-            bead_value = pow(self.base, self.num_rods - i - 1)
-            self.rods[i].update(self.abacus.sprites, '#404040',
-                                self.frame_height,
-                                i, x + i * dx + ro, y, self.abacus.scale,
-                                bead_count, bead_color)
-            bead_count += (self.top_beads + self.bot_beads)
-            self.rods[i].allocate_beads(self.top_beads, self.bot_beads,
-                                        self.top_factor,
-                                        bead_value, self.bot_beads,
-                                        color=True)
-
-
-class Binary(AbacusGeneric):
-    ''' A binary abacus '''
-
-    def __init__(self, abacus, bead_colors=None):
-        ''' Specify parameters that define the abacus '''
-        AbacusGeneric.__init__(self, abacus, bead_colors)
-        self.set_parameters()
-        self.create()
-
-    def set_parameters(self):
-        ''' create a Binary abacus: 15 by (1,0) '''
-        self.name = 'binary'
-        self.num_rods = 15
-        self.bot_beads = 1
-        self.top_beads = 0
-        self.base = 2
-        self.top_factor = 1
-
-
-class Schety(AbacusGeneric):
-    ''' A Russian abacus '''
-
-    def __init__(self, abacus, bead_colors=None):
-        ''' Specify parameters that define the abacus '''
-        AbacusGeneric.__init__(self, abacus, bead_colors)
-        self.set_parameters()
-        self.create()
-
-    def set_parameters(self):
-        ''' Create a Russian abacus: 15 by 10 (with one rod of 4 beads). '''
-        self.name = 'schety'
-        self.top_beads = 0
-        self.bot_beads = 10
-        self.bead_count = (10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 4, 10, 10,
-                           10, 10)
-        self.bead_value = (10 ** 9, 10 ** 8, 10 ** 7, 10 ** 6, 10 ** 5,
-                           10000, 1000, 100, 10, 1, .25, .1, .01, .001, .0001)
-        self.num_rods = len(self.bead_count)
-        self.base = 10
-        self.top_factor = 1
-
-    def draw_rods_and_beads(self, x=None, y=None):
-        ''' Draw the rods and beads: short column for 1/4 '''
-        if x is None:
-            x = self.rod_x
-            y = self.rod_y
-        else:
-            self.rod_x = x
-            self.rod_y = y
-        dx = (BEAD_WIDTH + BEAD_OFFSET) * self.abacus.scale
-        ro = (BEAD_WIDTH + 5) * self.abacus.scale / 2
-        bead_count = 0
-        for i in range(self.num_rods):
-            if self.bead_colors is not None:
-                bead_color = self.bead_colors[i % 2]
-            self.rods[i].update(self.abacus.sprites, '#404040',
-                                self.frame_height,
-                                i, x + i * dx + ro, y, self.abacus.scale,
-                                bead_count, bead_color)
-            bead_count += (self.top_beads + self.bot_beads)
-            self.rods[i].allocate_beads(self.top_beads, self.bead_count[i],
-                                        self.top_factor, self.bead_value[i],
-                                        self.bead_count[-1], middle_black=True)
-
-
-class Fractions(Schety):
-    ''' Inherit from Russian abacus. '''
-
-    def __init__(self, abacus, bead_colors=None):
-        ''' Specify parameters that define the abacus '''
-        Schety.__init__(self, abacus, bead_colors)
-
-    def set_parameters(self):
-        ''' Create an abacus with fractions: 15 by 10 (with 1/2, 1/3. 1/4,
-            1/5, 1/6, 1/8, 1/9, 1/10, 1/12). '''
-        self.bead_count = (10, 10, 10, 10, 10, 10, 2, 3, 4, 5, 6, 8, 9, 10, 12)
-        self.bead_value = (100000, 10000, 1000, 100, 10, 1, .5, 1 / 3., .25,
-                           .2, 1 / 6., .125, 1 / 9., .1, 1 / 12.)
-        self.name = 'fraction'
-        self.num_rods = 15
-        self.top_beads = 0
-        self.bot_beads = 12
-        self.base = 10
-        self.top_factor = 1
-
-    def draw_rods_and_beads(self, x=None, y=None):
-        ''' Draw the rods and beads: short columns for fractions '''
-        if x is None:
-            x = self.rod_x
-            y = self.rod_y
-        else:
-            self.rod_x = x
-            self.rod_y = y
-        dx = (BEAD_WIDTH + BEAD_OFFSET) * self.abacus.scale
-        ro = (BEAD_WIDTH + 5) * self.abacus.scale / 2
-        bead_count = 0
-        for i in range(self.num_rods):
-            if self.bead_colors is not None:
-                bead_color = self.bead_colors[i % 2]
-            self.rods[i].update(self.abacus.sprites, '#404040',
-                                self.frame_height,
-                                i, x + i * dx + ro, y, self.abacus.scale,
-                                bead_count, bead_color)
-            bead_count += (self.top_beads + self.bot_beads)
-            if i < 6:
-                all_black = False
-            else:
-                all_black = True
-            self.rods[i].allocate_beads(self.top_beads, self.bead_count[i],
-                                        self.top_factor,
-                                        self.bead_value[i],
-                                        self.bead_count[-1],
-                                        all_black=all_black)
-
-
-class Caacupe(Fractions):
-    ''' Inherit from Fraction abacus. '''
-
-    def __init__(self, abacus, bead_colors=None):
-        ''' Specify parameters that define the abacus '''
-        Fractions.__init__(self, abacus, bead_colors)
-
-    def set_parameters(self):
-        ''' Create an abacus with fractions: 15 by 10 (with 1/2, 1/3. 1/4,
-            1/5, 1/6, 1/8, 1/9, 1/10, 1/12). '''
-        self.bead_count = (10, 10, 10, 10, 10, 10, 2, 3, 4, 5, 6, 8, 9, 10, 12)
-        self.bead_value = (100000, 10000, 1000, 100, 10, 1, .5, 1 / 3., .25,
-                           .2, 1 / 6., .125, 1 / 9., .1, 1 / 12.)
-        self.name = 'caacupe'
-        self.num_rods = 15
-        self.top_beads = 0
-        self.bot_beads = 12
-        self.base = 10
-        self.top_factor = 1
-
-    def draw_rods_and_beads(self, x=None, y=None):
-        ''' Draw the rods and beads: short columns for fractions '''
-        if x is None:
-            x = self.rod_x
-            y = self.rod_y
-        else:
-            self.rod_x = x
-            self.rod_y = y
-        dx = (BEAD_WIDTH + BEAD_OFFSET) * self.abacus.scale
-        ro = (BEAD_WIDTH + 5) * self.abacus.scale / 2
-        bead_count = 0
-        for i in range(self.num_rods):
-            if self.bead_colors is not None:
-                bead_color = self.bead_colors[i % 2]
-            self.rods[i].update(self.abacus.sprites, '#404040',
-                                self.frame_height,
-                                i, x + i * dx + ro, y, self.abacus.scale,
-                                bead_count, bead_color)
-            bead_count += (self.top_beads + self.bot_beads)
-            if i < 6:
-                all_black = False
-            else:
-                all_black = True
-            self.rods[i].allocate_beads(self.top_beads, self.bead_count[i],
-                                        self.top_factor,
-                                        self.bead_value[i],
-                                        self.bead_count[-1],
-                                        all_black=all_black, tristate=True)
-
-
-class Cuisenaire(Caacupe):
-    ''' Inherit from Caacupe abacus. '''
-
-    def __init__(self, abacus, bead_colors=None):
-        ''' Specify parameters that define the abacus '''
-        Caacupe.__init__(self, abacus, bead_colors)
-
-    def set_parameters(self):
-        ''' Create an abacus with fractions: 10 by 10 (with 1/1, 1/2, 1/3. 1/4,
-            1/5, 1/6, 1/7, 1/8, 1/9, 1/10). '''
-        self.bead_count = (1, 2, 3, 4, 5, 6, 7, 8, 9, 10)
-        self.bead_value = (1, .5, 1 / 3., .25,
-                           .2, 1 / 6., 1 / 7., .125, 1 / 9., .1)
-        self.name = 'cuisenaire'
-        self.num_rods = 10
-        self.top_beads = 0
-        self.bot_beads = 10
-        self.base = 10
-        self.top_factor = 1
+    def value(self, count_beads=False):
+        ''' Return a string representing the value of each rod. '''
+        if count_beads:
+            return ''.join(['%2d ' % (self.model.get_bead_count(i))
+                            for i in range(self.model_rods)])
+        return AbacusGeneric.value(self)
 
-    def draw_rods_and_beads(self, x=None, y=None):
-        ''' Draw the rods and beads: short columns for fractions '''
-        if x is None:
-            x = self.rod_x
-            y = self.rod_y
-        else:
-            self.rod_x = x
-            self.rod_y = y
-        dx = (BEAD_WIDTH + BEAD_OFFSET) * self.abacus.scale
-        ro = (BEAD_WIDTH + 5) * self.abacus.scale / 2
-        bead_count = 0
-        for i in range(self.num_rods):
-            if self.bead_colors is not None:
-                bead_color = self.bead_colors[i % 2]
-            self.rods[i].update(self.abacus.sprites, '#404040',
-                                self.frame_height,
-                                i, x + i * dx + ro, y, self.abacus.scale,
-                                bead_count, bead_color, cuisenaire=True)
-            bead_count += (self.top_beads + self.bot_beads)
-            self.rods[i].allocate_beads(self.top_beads, self.bead_count[i],
-                                        self.top_factor,
-                                        self.bead_value[i],
-                                        self.bead_count[-1],
-                                        color=True, tristate=True)
+    def generate_label(self, sum_only=False):
+        ''' There are too many rods to list: just show the sum. '''
+        return AbacusGeneric.generate_label(self, sum_only=True)
+
+
+# The hot paths of the interaction, timed while profiling (F12)
+PROFILER.hook(Sprites, 'redraw_sprites')
+PROFILER.hook(Sprites, 'find_sprite')
+PROFILER.hook(Sprite, 'draw_label')
+PROFILER.hook(Rod, 'move_bead')
+PROFILER.hook(AbacusGeneric, 'fade_colors')
+PROFILER.hook(Abacus, 'generate_label')
+PROFILER.hook(sys.modules[__name__], '_build_asset')
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright 2010-13, Walter Bender
+
+# This file is part of the Abacus Activity.
+
+# The Abacus Activity is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# The Abacus Activity is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with the Abacus Activity.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+fraction_labels.py formats the values of beads, rods, and sums as the
+fractions the abacus is labeled with (and needs neither Gtk nor Cairo).
+
+Example usage:
+        from fraction_labels import dec2frac
+
+        dec2frac(Fraction(29, 12))  # '2 5/12'
+        dec2frac(0.6)  # '3/5'
+
+'''
+
+from fractions import Fraction
+
+MAX_CACHED_FRACTIONS = 256
+MAX_DENOMINATOR = 10000  # of the fractions used to label floats
+
+# Memoized conversions of exact values: (numerator, denominator) -> string
+_fractions = {}
+
+
+def dec2frac(d, max_denominator=MAX_DENOMINATOR):
+    ''' Convert float to its approximate fractional representation.
+    Exact values (ints and Fractions) are converted directly. '''
+
+    '''
+    For example:
+    >>> 3./5
+    0.59999999999999998
+
+    >>> dec2frac(3./5)
+    "3/5"
+
+    The same few exact values are labeled over and over again, so their
+    conversions are memoized. (A float is converted in less time than it
+    takes to look it up.)
+    '''
+
+    if isinstance(d, float):
+        return _dec2frac(d, max_denominator)
+    key = (d.numerator, d.denominator)
+    if key in _fractions:
+        return _fractions[key]
+    string = _dec2frac(d, max_denominator)
+    if len(_fractions) >= MAX_CACHED_FRACTIONS:
+        _fractions.clear()
+    _fractions[key] = string
+    return string
+
+
+def _dec2frac(d, max_denominator):
+    if d < 0:
+        string = _dec2frac(-d, max_denominator)
+        if string == '':
+            return ''
+        return '–' + string
+
+    if not isinstance(d, float):
+        d = Fraction(d)
+        whole = d.numerator / d.denominator
+        if d.denominator == 1:
+            return '%d' % whole
+        fraction = '%d/%d' % (d.numerator - whole * d.denominator,
+                              d.denominator)
+        if whole == 0:
+            return fraction
+        return '%d %s' % (whole, fraction)
+
+    if d > 1:
+        return '%s' % d
+    top, bot = _approximate(d, max_denominator)
+    if top == 0:
+        return ''
+    elif bot == 1:
+        return '%s' % top
+    return '%s/%s' % (top, bot)
+
+
+def _approximate(d, max_denominator):
+    ''' The first convergent of the continued fraction of d that is
+    within 1e-8 of d (or the last one with a denominator no larger than
+    max_denominator). The denominators grow at least as fast as the
+    Fibonacci numbers, so there are at most log_phi(max_denominator) + 2
+    steps. '''
+    top, bot, previous_top, previous_bot = 1, 0, 0, 1
+    x = d
+    while True:
+        a = int(x)
+        if a * bot + previous_bot > max_denominator:
+            return top, bot
+        top, bot, previous_top, previous_bot = \
+            a * top + previous_top, a * bot + previous_bot, top, bot
+        if abs(float(top) / bot - d) <= 0.00000001 or x == a:
+            return top, bot
+        x = 1. / (x - a)
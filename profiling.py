@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+# Copyright 2010-13, Walter Bender
+
+# This file is part of the Abacus Activity.
+
+# The Abacus Activity is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# The Abacus Activity is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with the Abacus Activity.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+profiling.py times the activity.
+
+STARTUP times how long the activity takes to start: the time from
+launch (when this module is first imported) to the first frame, broken
+down by phase. The trace is logged once, as JSON, e.g.:
+
+        startup trace: {"first_frame": 412.3, "format": 1, "phases":
+        [{"duration": 85.1, "name": "toolbars", "start": 40.2}, ...]}
+
+(all times in milliseconds), so that it can be compared between
+releases.
+
+Example usage:
+        from profiling import STARTUP
+
+        STARTUP.begin('toolbars')
+        ...
+        STARTUP.end()
+
+        STARTUP.finish()  # once the first frame is drawn
+
+PROFILER times the calls to hooked functions (the hot paths of the
+interaction), but only while it is enabled: until then, the functions
+are left as they are and cost nothing extra. The calls are counted, and
+the most recent are kept in a ring buffer, which can be written as a
+Chrome trace (load it in chrome://tracing).
+
+Example usage:
+        from profiling import PROFILER
+
+        PROFILER.hook(Sprites, 'redraw_sprites')
+        PROFILER.enable()
+        ...
+        PROFILER.pause()  # e.g., while the statistics are drawn
+        ...
+        PROFILER.resume()
+        PROFILER.disable()
+        for line in PROFILER.stats():
+            print line
+        PROFILER.dump_chrome_trace('abacus-trace.json')
+
+'''
+
+import json
+import os
+import time
+from array import array
+
+import logging
+_logger = logging.getLogger('abacus-activity')
+
+STARTUP_FORMAT = 1  # change if the fields of the trace change
+MAX_PROFILE_EVENTS = 4096  # the calls kept for the Chrome trace
+
+
+class StartupTrace():
+    ''' The phases of startup: (name, start, duration), in seconds since
+    the trace began. A phase begun within another is named outer/inner. '''
+
+    def __init__(self, start=None):
+        if start is None:
+            start = time.time()
+        self.start = start
+        self.phases = []
+        self.first_frame = None  # set by finish
+        self._stack = []
+
+    def begin(self, name):
+        ''' Begin a phase (within any phase not yet ended) '''
+        self._stack.append((name, time.time()))
+
+    def end(self):
+        ''' End the phase begun last '''
+        if not self._stack:
+            return
+        start = self._stack[-1][1]
+        name = '/'.join([phase[0] for phase in self._stack])
+        self._stack.pop()
+        if self.first_frame is None:
+            self.phases.append((name, start - self.start,
+                                time.time() - start))
+
+    def finish(self):
+        ''' The first frame is drawn: log the trace (just once). '''
+        if self.first_frame is not None:
+            return
+        self.first_frame = time.time() - self.start
+        _logger.info('startup trace: %s', self.to_json())
+
+    def to_json(self):
+        ''' The trace, in milliseconds, as JSON '''
+        trace = {'format': STARTUP_FORMAT,
+                 'first_frame': _ms(self.first_frame),
+                 'phases': [{'name': name, 'start': _ms(start),
+                             'duration': _ms(duration)}
+                            for name, start, duration in self.phases]}
+        return json.dumps(trace, sort_keys=True)
+
+
+def _ms(seconds):
+    if seconds is None:
+        return None
+    return round(seconds * 1000, 1)
+
+
+class Profiler():
+    ''' Time the calls to hooked functions (methods of a class, or
+    functions of a module) while enabled. '''
+
+    def __init__(self, size=MAX_PROFILE_EVENTS):
+        self.enabled = False
+        self.start = None
+        self._size = size
+        self._hooks = []  # (owner, name, label)
+        self._originals = []  # (owner, name, function) while enabled
+        self._paused = 0  # (pause may be nested)
+        self.clear()
+
+    def clear(self):
+        ''' Forget the calls timed so far '''
+        self._labels = [None] * self._size
+        self._starts = array('d', [0.0]) * self._size
+        self._durations = array('d', [0.0]) * self._size
+        self._calls = 0  # ever recorded (the ring buffer keeps _size)
+        self.counts = {}  # label: [calls, total, longest] (in seconds)
+        self.start = time.time()
+
+    def hook(self, owner, name):
+        ''' Time owner.name (once enabled) '''
+        label = '%s.%s' % (owner.__name__, name)
+        self._hooks.append((owner, name, label))
+        if self.enabled:
+            self._wrap(owner, name, label)
+
+    def enable(self):
+        ''' Replace the hooked functions by timed ones '''
+        if self.enabled:
+            return
+        self.enabled = True
+        for owner, name, label in self._hooks:
+            self._wrap(owner, name, label)
+
+    def disable(self):
+        ''' Restore the hooked functions '''
+        for owner, name, function in self._originals:
+            setattr(owner, name, function)
+        self._originals = []
+        self.enabled = False
+
+    def pause(self):
+        ''' Stop timing calls until resume '''
+        self._paused += 1
+
+    def resume(self):
+        ''' Time calls again '''
+        self._paused = max(0, self._paused - 1)
+
+    def _wrap(self, owner, name, label):
+        function = vars(owner)[name]
+        record = self._record
+
+        def timed(*args, **kwargs):
+            if self._paused:
+                return function(*args, **kwargs)
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(label, start, time.time() - start)
+
+        timed.__name__ = function.__name__
+        timed.__doc__ = function.__doc__
+        self._originals.append((owner, name, function))
+        setattr(owner, name, timed)
+
+    def _record(self, label, start, duration):
+        i = self._calls % self._size
+        self._labels[i] = label
+        self._starts[i] = start
+        self._durations[i] = duration
+        self._calls += 1
+        count = self.counts.get(label)
+        if count is None:
+            self.counts[label] = [1, duration, duration]
+        else:
+            count[0] += 1
+            count[1] += duration
+            if duration > count[2]:
+                count[2] = duration
+
+    def events(self):
+        ''' The calls in the ring buffer, oldest first: (label, start,
+        duration), in seconds '''
+        first = max(0, self._calls - self._size)
+        return [(self._labels[i % self._size], self._starts[i % self._size],
+                 self._durations[i % self._size])
+                for i in range(first, self._calls)]
+
+    def stats(self):
+        ''' Lines of text: the calls, and their total, mean, and longest
+        times (in milliseconds), of each hooked function, slowest first '''
+        lines = ['%-32s %7s %9s %8s %8s' % ('', 'calls', 'total ms',
+                                            'mean ms', 'max ms')]
+        for label, (calls, total, longest) in sorted(
+                self.counts.iteritems(), key=lambda item: -item[1][1]):
+            lines.append('%-32s %7d %9.1f %8.3f %8.3f' % (
+                label[-32:], calls, total * 1000, total * 1000 / calls,
+                longest * 1000))
+        return lines
+
+    def chrome_trace(self):
+        ''' The calls in the ring buffer as Chrome trace events '''
+        pid = os.getpid()
+        return {'displayTimeUnit': 'ms',
+                'traceEvents': [{'name': label, 'cat': 'abacus', 'ph': 'X',
+                                 'ts': round((start - self.start) * 1e6, 1),
+                                 'dur': round(duration * 1e6, 1),
+                                 'pid': pid, 'tid': 0}
+                                for label, start, duration in self.events()]}
+
+    def dump_chrome_trace(self, path):
+        ''' Write the calls in the ring buffer to path as a Chrome trace '''
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+# The trace of this launch
+STARTUP = StartupTrace()
+# The hot paths (hooked by their modules)
+PROFILER = Profiler()
@@ -54,6 +54,11 @@ Example usage:
         # Create a sprite at position x2, y2.
         your_sprite = sprites.Sprite(self.sprite_list, x2, y2, my_pixbuf)
 
+        # Sprites that show the same image can share one Cairo surface.
+        shared_surface = pixbuf_to_surface(your_pixbuf)
+        my_sprite.set_image(shared_surface)
+        your_sprite.set_image(shared_surface)
+
         # Assign the sprites to layers.
         # In this example, your_sprite will be on top of my_sprite.
         my_sprite.set_layer(100)
@@ -62,10 +67,27 @@ Example usage:
         # Now put my_sprite on top of your_sprite.
         my_sprite.set_layer(300)
 
+        # Many sprites can be shown (or hidden) at once.
+        self.sprite_list.set_layers([my_sprite, your_sprite], 400)
+        self.sprite_list.hide_sprites([my_sprite, your_sprite])
+
+        # A sprite can cache a composite of other sprites, which are then
+        # only re-rendered when one of them changes.
+        group = sprites.Sprite(self.sprite_list, x1, y1, my_pixbuf)
+        group.set_composite([my_sprite, your_sprite])
+
         cr = self.window.cairo_create()
         # In your activity's do_expose_event, put in a call to redraw_sprites
         self.sprites.redraw_sprites(event.area, cairo_context)
 
+        # Without a widget, sprites can be drawn to any Cairo surface,
+        # e.g., to render to a file when there is no display.
+        headless = Sprites()
+        ...
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        headless.redraw_sprites(cr=cairo.Context(surface))
+        surface.write_to_png('sprites.png')
+
 # method for converting SVG to a gtk pixbuf
 def svg_str_to_pixbuf(svg_string):
     pl = GdkPixbuf.PixbufLoader('svg')
@@ -81,17 +103,94 @@ gi.require_version('PangoCairo', '1.0')
 from gi.repository import Gtk, GdkPixbuf, Gdk
 from gi.repository import Pango, PangoCairo
 import cairo
+import weakref
+from bisect import bisect, bisect_left
+from collections import OrderedDict
+
+GRID_SIZE = 64  # size (in pixels) of a cell in the spatial index
+MAX_LAYOUTS = 256  # number of laid-out labels to keep
+
+# Pixbuf to Cairo surface conversions are shared by every sprite
+_surfaces = weakref.WeakKeyDictionary()
+# Laid-out labels: (text, font, size, width, rescale) -> (layout, w, h)
+_layouts = OrderedDict()
+
+
+def pixbuf_to_surface(pixbuf):
+    ''' Convert a pixbuf to a Cairo surface: the conversion is done once
+    per pixbuf and the surface is shared. '''
+    surface = _surfaces.get(pixbuf)
+    if surface is None:
+        surface = cairo.ImageSurface(
+            cairo.FORMAT_ARGB32, pixbuf.get_width(), pixbuf.get_height())
+        context = cairo.Context(surface)
+        Gdk.cairo_set_source_pixbuf(context, pixbuf, 0, 0)
+        context.paint()
+        _surfaces[pixbuf] = surface
+    return surface
+
+
+def _get_layout(cr, text, font, size, width=None, rescale=True):
+    ''' Return a (cached) Pango layout for a label, with its width and
+    height. Labels wider than width are shrunk (rescale) or truncated. '''
+    key = (text, font, size, width, rescale)
+    layout = _layouts.pop(key, None)
+    if layout is None:
+        layout = _layout_label(cr, text, font, size, width, rescale)
+        while len(_layouts) >= MAX_LAYOUTS:
+            _layouts.popitem(last=False)
+    _layouts[key] = layout
+    return layout
+
+
+def _layout_label(cr, text, font, size, width, rescale):
+    ''' Lay out a label, shrinking or truncating it to fit width. '''
+    pl = PangoCairo.create_layout(cr)
+    fd = Pango.FontDescription(font)
+    fd.set_size(size)
+    pl.set_font_description(fd)
+    pl.set_text(text, -1)
+    w = pl.get_size()[0] / Pango.SCALE
+    if width is not None and w > width:
+        if rescale:
+            fd.set_size(int(size * width / w))
+            pl.set_font_description(fd)
+        elif len(text) > 1:
+            # Binary search for the longest tail that fits after an ellipsis.
+            lo, hi = 1, len(text) - 1
+            while lo < hi:
+                j = (lo + hi + 1) / 2
+                pl.set_text("…" + text[len(text) - j:], -1)
+                if pl.get_size()[0] / Pango.SCALE > width:
+                    hi = j - 1
+                else:
+                    lo = j
+            pl.set_text("…" + text[len(text) - lo:], -1)
+        w = pl.get_size()[0] / Pango.SCALE
+    return pl, w, pl.get_size()[1] / Pango.SCALE
+
+
+def _union(a, b):
+    ''' The bounding box of two (x, y, width, height) rectangles '''
+    x = min(a[0], b[0])
+    y = min(a[1], b[1])
+    return [x, y, max(a[0] + a[2], b[0] + b[2]) - x,
+            max(a[1] + a[3], b[1] + b[3]) - y]
 
 
 class Sprites:
     ''' A class for the list of sprites and everything they share in common '''
 
-    def __init__(self, widget):
-        ''' Initialize an empty array of sprites '''
+    def __init__(self, widget=None):
+        ''' Initialize an empty array of sprites; without a widget, the
+        sprites are headless and are only drawn by redraw_sprites. '''
         self.cr = None
         self._widget = widget
         self._delay = False
-        self.list = []
+        self.list = []  # visible sprites, sorted by (layer, sequence)
+        self._keys = []  # the (layer, sequence) of each sprite in the list
+        self._grid = {}  # spatial index: (column, row) -> set of sprites
+        self._sequence = 0  # sprites in the same layer are drawn in order
 
     def set_cairo_context(self, cr):
         ''' Cairo context may be set or reset after __init__ '''
@@ -109,34 +208,120 @@ class Sprites:
         return(len(self.list))
 
     def append_to_list(self, spr):
-        ''' Append a new sprite to the end of the list. '''
-        self.list.append(spr)
-
-    def insert_in_list(self, spr, i):
-        ''' Insert a sprite at position i. '''
-        if i < 0:
-            self.list.insert(0, spr)
-        elif i > len(self.list) - 1:
-            self.list.append(spr)
-        else:
-            self.list.insert(i, spr)
+        ''' Add a sprite to the list, on top of the others in its layer. '''
+        if spr.cells is not None:
+            self.remove_from_list(spr)
+        self._sequence += 1
+        spr.sequence = self._sequence
+        key = (spr.layer, spr.sequence)
+        i = bisect(self._keys, key)
+        self._keys.insert(i, key)
+        self.list.insert(i, spr)
+        self._add_to_grid(spr)
 
     def remove_from_list(self, spr):
         ''' Remove a sprite from the list. '''
-        if spr in self.list:
-            self.list.remove(spr)
+        if spr.cells is None:  # not in the list
+            return
+        i = bisect_left(self._keys, (spr.layer, spr.sequence))
+        del self._keys[i]
+        del self.list[i]
+        self._remove_from_grid(spr)
+
+    def set_layers(self, sprites, layer):
+        ''' Move many sprites to a layer at once; they are drawn in the
+        order given, on top of the other sprites in the layer. '''
+        moving = set(sprites)
+        for spr in sprites:
+            self._remove_from_grid(spr)
+        self.list = [spr for spr in self.list if spr not in moving]
+        for spr in sprites:
+            self._sequence += 1
+            spr.sequence = self._sequence
+            spr.layer = layer
+            self._add_to_grid(spr)
+            spr.inval()
+        # Both runs are already sorted, so this is a linear merge.
+        self.list.extend(sprites)
+        self.list.sort(key=lambda spr: (spr.layer, spr.sequence))
+        self._keys = [(spr.layer, spr.sequence) for spr in self.list]
+
+    def hide_sprites(self, sprites):
+        ''' Hide many sprites at once. '''
+        hiding = set(sprites)
+        for spr in sprites:
+            spr.inval()
+            self._remove_from_grid(spr)
+        self.list = [spr for spr in self.list if spr not in hiding]
+        self._keys = [(spr.layer, spr.sequence) for spr in self.list]
+
+    def _grid_cells(self, x, y, width, height):
+        ''' The spatial index cells covered by a rectangle '''
+        x0, y0 = int(x) // GRID_SIZE, int(y) // GRID_SIZE
+        x1, y1 = int(x + width) // GRID_SIZE, int(y + height) // GRID_SIZE
+        return [(i, j) for i in range(x0, x1 + 1) for j in range(y0, y1 + 1)]
+
+    def _add_to_grid(self, spr):
+        ''' Add a (visible) sprite to the spatial index. '''
+        self._set_grid_cells(spr, self._grid_cells(*spr.rect))
+
+    def _remove_from_grid(self, spr):
+        ''' Remove a (hidden) sprite from the spatial index. '''
+        self._set_grid_cells(spr, None)
+
+    def update_grid(self, spr):
+        ''' Update the spatial index after a sprite moves or resizes. '''
+        if spr.cells is None:
+            return
+        cells = self._grid_cells(*spr.rect)
+        if cells != spr.cells:
+            self._set_grid_cells(spr, cells)
+
+    def _set_grid_cells(self, spr, cells):
+        ''' Move a sprite from its old cells to new ones. '''
+        if spr.cells is not None:
+            for cell in spr.cells:
+                self._grid[cell].discard(spr)
+                if len(self._grid[cell]) == 0:
+                    del self._grid[cell]
+        spr.cells = cells
+        if cells is not None:
+            for cell in cells:
+                if cell in self._grid:
+                    self._grid[cell].add(spr)
+                else:
+                    self._grid[cell] = set([spr])
 
     def find_sprite(self, pos):
         ''' Search based on (x, y) position. Return the 'top/first' one. '''
-        list = self.list[:]
-        list.reverse()
-        for spr in list:
-            if spr.hit(pos):
-                return spr
-        return None
+        x, y = pos
+        top = None
+        for spr in self._grid.get((int(x) // GRID_SIZE, int(y) // GRID_SIZE),
+                                  ()):
+            if spr._members is None and spr.hit(pos) and \
+               (top is None or (spr.layer, spr.sequence) >
+                               (top.layer, top.sequence)):
+                top = spr
+        return top
+
+    def find_sprites_in_area(self, x, y, width, height):
+        ''' Return the sprites that intersect an area, bottom to top. '''
+        return self.find_sprites_in_areas([(x, y, width, height)])
+
+    def find_sprites_in_areas(self, areas):
+        ''' Return the sprites that intersect any of the (x, y, width,
+        height) areas, bottom to top. '''
+        found = set()
+        for area in areas:
+            for cell in self._grid_cells(*area):
+                for spr in self._grid.get(cell, ()):
+                    if spr not in found and spr.intersects(*area):
+                        found.add(spr)
+        return sorted(found, key=lambda spr: (spr.layer, spr.sequence))
 
     def redraw_sprites(self, area=None, cr=None):
-        ''' Redraw the sprites that intersect area. '''
+        ''' Redraw the sprites that intersect area (by default, the clip
+        region of the Cairo context, i.e., the area Gtk asked us to draw). '''
         # I think I need to do this to save Cairo some work
         if cr is None:
             cr = self.cr
@@ -145,25 +330,41 @@ class Sprites:
         if cr is None:
             print 'sprites.redraw_sprites: no Cairo context'
             return
-        for spr in self.list:
-            if area == None:
+        if area is None:
+            areas = self._clip_areas(cr)
+        elif hasattr(area, 'width'):
+            areas = [(area.x, area.y, area.width, area.height)]
+        else:
+            areas = [area]
+        for spr in self.find_sprites_in_areas(areas):
+            if spr._composite is None:  # else drawn by its composite
                 spr.draw(cr=cr)
-            else:
-                intersection = spr.rect.intersect(area)
-                if intersection.width > 0 or intersection.height > 0:
-                    spr.draw(cr=cr)
+
+    def _clip_areas(self, cr):
+        ''' The rectangles in the clip region of a Cairo context '''
+        try:
+            return [tuple(rect) for rect in cr.copy_clip_rectangle_list()]
+        except (cairo.Error, AttributeError):
+            x1, y1, x2, y2 = cr.clip_extents()
+            return [(x1, y1, x2 - x1, y2 - y1)]
 
     def set_delay(self, delay):
         self._delay = delay
 
+    def get_delay(self):
+        ''' Are invalidated areas not being redrawn (yet)? '''
+        return self._delay
+
     def invalidate_area(self, x, y, width, height):
         if self._delay:
             return
-        self._widget.queue_draw_area(x, y, width, height)
+        if self._widget is not None:
+            self._widget.queue_draw_area(x, y, width, height)
 
     def draw_all(self):
         self._delay = False
-        self._widget.queue_draw()
+        if self._widget is not None:
+            self._widget.queue_draw()
 
 
 class Sprite:
@@ -181,11 +382,18 @@ class Sprite:
         self._x_pos = [None]
         self._y_pos = [None]
         self._fd = None
+        self._font = None
         self._bold = False
         self._italic = False
         self._color = None
         self._margins = [0, 0, 0, 0]
         self.layer = 100
+        self.sequence = 0  # drawing order within the layer
+        self.cells = None  # spatial index cells occupied when visible
+        self._composite = None  # the sprite that draws this one, if any
+        self._members = None  # the sprites drawn by this one, if any
+        self._dirty = False  # the members have changed since rendering
+        self._composite_surface = None  # (reused) surface for the members
         self.labels = []
         self.cached_surfaces = []
         self._dx = []  # image offsets
@@ -195,11 +403,15 @@ class Sprite:
         self._sprites.append_to_list(self)
 
     def set_image(self, image, i=0, dx=0, dy=0):
-        ''' Add an image to the sprite. '''
+        ''' Add an image (a pixbuf or a shared Cairo surface) to the
+        sprite. '''
         while len(self.cached_surfaces) < i + 1:
             self.cached_surfaces.append(None)
             self._dx.append(0)
             self._dy.append(0)
+        if self.cached_surfaces[i] is image and self._dx[i] == dx and \
+           self._dy[i] == dy:
+            return
         self._dx[i] = dx
         self._dy[i] = dy
         if hasattr(image, 'get_width'):
@@ -215,21 +427,17 @@ class Sprite:
                 self.rect[2] = w + dx
             if h + dy > self.rect[3]:
                 self.rect[3] = h + dy
+        self._sprites.update_grid(self)
         if isinstance(image, cairo.ImageSurface):
             self.cached_surfaces[i] = image
         else:
-            surface = cairo.ImageSurface(
-                cairo.FORMAT_ARGB32, self.rect[2], self.rect[3])
-            context = cairo.Context(surface)
-            Gdk.cairo_set_source_pixbuf(context, image, 0, 0)
-            context.rectangle(0, 0, self.rect[2], self.rect[3])
-            context.fill()
-            self.cached_surfaces[i] = surface
+            self.cached_surfaces[i] = pixbuf_to_surface(image)
 
     def move(self, pos):
         ''' Move to new (x, y) position '''
         self.inval()
         self.rect[0], self.rect[1] = int(pos[0]), int(pos[1])
+        self._sprites.update_grid(self)
         self.inval()
 
     def move_relative(self, pos):
@@ -237,6 +445,7 @@ class Sprite:
         self.inval()
         self.rect[0] += int(pos[0])
         self.rect[1] += int(pos[1])
+        self._sprites.update_grid(self)
         self.inval()
 
     def get_xy(self):
@@ -262,11 +471,6 @@ class Sprite:
         self._sprites.remove_from_list(self)
         if layer is not None:
             self.layer = layer
-        for i in range(self._sprites.length_of_list()):
-            if self.layer < self._sprites.get_sprite(i).layer:
-                self._sprites.insert_in_list(self, i)
-                self.inval()
-                return
         self._sprites.append_to_list(self)
         self.inval()
 
@@ -301,6 +505,7 @@ class Sprite:
 
     def set_font(self, font):
         ''' Set the font for a label '''
+        self._font = font
         self._fd = Pango.FontDescription(font)
 
     def set_label_color(self, rgb):
@@ -340,9 +545,64 @@ class Sprite:
 
     def inval(self):
         ''' Invalidate a region for gtk '''
+        if self._composite is not None:
+            self._composite._member_changed()
         self._sprites.invalidate_area(self.rect[0], self.rect[1],
                                       self.rect[2], self.rect[3])
 
+    def set_composite(self, members):
+        ''' Draw the member sprites into a cached surface belonging to this
+        sprite, re-rendered only when a member changes. (The members are
+        still found by find_sprite; this sprite is not.) '''
+        if self._members is not None:
+            for spr in self._members:
+                if spr._composite is self:  # (not since taken by another)
+                    spr._composite = None
+        self._members = members
+        for spr in members:
+            # A sprite is drawn by one composite at a time.
+            if spr._composite is not None and spr._composite is not self:
+                spr._composite._members.remove(spr)
+                spr._composite._member_changed()
+            spr._composite = self
+        self._member_changed()
+
+    def _member_changed(self):
+        ''' Mark the composite dirty; it grows to cover all its members. '''
+        self._dirty = True
+        rect = None
+        for spr in self._members:
+            if rect is None:
+                rect = spr.rect[:]
+            else:
+                rect = _union(rect, spr.rect)
+        if rect is not None and rect != self.rect:
+            self.rect = rect
+            self._sprites.update_grid(self)
+
+    def _render_composite(self):
+        ''' Render the visible members into the cached surface. '''
+        w, h = max(1, self.rect[2]), max(1, self.rect[3])
+        surface = self._composite_surface
+        if surface is None or surface.get_width() != w or \
+           surface.get_height() != h:
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+            self._composite_surface = surface
+        cr = cairo.Context(surface)
+        cr.set_operator(cairo.OPERATOR_CLEAR)
+        cr.paint()
+        cr.set_operator(cairo.OPERATOR_OVER)
+        cr.translate(-self.rect[0], -self.rect[1])
+        for spr in sorted(self._members,
+                          key=lambda spr: (spr.layer, spr.sequence)):
+            if spr.cells is not None:
+                spr.draw(cr=cr)
+        surface.flush()
+        self.cached_surfaces = [surface]
+        self._dx = [0]
+        self._dy = [0]
+        self._dirty = False
+
     def draw(self, cr=None):
         ''' Draw the sprite (and label) '''
         if cr is None:
@@ -350,6 +610,8 @@ class Sprite:
         if cr is None:
             print 'sprite.draw: no Cairo context.'
             return
+        if self._dirty:
+            self._render_composite()
         for i, img in enumerate(self.cached_surfaces):
             cr.set_source_surface(img, self.rect[0] + self._dx[i],
                                   self.rect[1] + self._dy[i])
@@ -362,6 +624,13 @@ class Sprite:
         if len(self.labels) > 0:
             self.draw_label(cr)
 
+    def intersects(self, x, y, width, height):
+        ''' Does the sprite overlap the area? '''
+        return x <= self.rect[0] + self.rect[2] and \
+            self.rect[0] <= x + width and \
+            y <= self.rect[1] + self.rect[3] and \
+            self.rect[1] <= y + height
+
     def hit(self, pos):
         ''' Is (x, y) on top of the sprite? '''
         x, y = pos
@@ -382,26 +651,9 @@ class Sprite:
             my_width = 0
         my_height = self.rect[3] - self._margins[1] - self._margins[3]
         for i in range(len(self.labels)):
-            pl = PangoCairo.create_layout(cr)
-            pl.set_text(str(self.labels[i]), -1)
-            self._fd.set_size(int(self._scale[i] * Pango.SCALE))
-            pl.set_font_description(self._fd)
-            w = pl.get_size()[0] / Pango.SCALE
-            if w > my_width:
-                if self._rescale[i]:
-                    self._fd.set_size(
-                            int(self._scale[i] * Pango.SCALE * my_width / w))
-                    pl.set_font_description(self._fd)
-                    w = pl.get_size()[0] / Pango.SCALE
-                else:
-                    j = len(self.labels[i]) - 1
-                    while(w > my_width and j > 0):
-                        pl.set_text(
-                            "…" + self.labels[i][len(self.labels[i]) - j:], -1)
-                        self._fd.set_size(int(self._scale[i] * Pango.SCALE))
-                        pl.set_font_description(self._fd)
-                        w = pl.get_size()[0] / Pango.SCALE
-                        j -= 1
+            pl, w, h = _get_layout(cr, str(self.labels[i]), self._font,
+                                   int(self._scale[i] * Pango.SCALE),
+                                   my_width, self._rescale[i])
             if self._x_pos[i] is not None:
                 x = int(self.rect[0] + self._x_pos[i])
             elif self._horiz_align[i] == "center":
@@ -410,7 +662,6 @@ class Sprite:
                 x = int(self.rect[0] + self._margins[0])
             else: # right
                 x = int(self.rect[0] + self.rect[2] - w - self._margins[2])
-            h = pl.get_size()[1] / Pango.SCALE
             if self._y_pos[i] is not None:
                 y = int(self.rect[1] + self._y_pos[i])
             elif self._vert_align[i] == "middle":
@@ -432,11 +683,8 @@ class Sprite:
             cr = self._sprites.cr
         max = 0
         for i in range(len(self.labels)):
-            pl = PangoCairo.create_layout(cr)
-            pl.set_text(str(self.labels[i]), -1)
-            self._fd.set_size(int(self._scale[i] * Pango.SCALE))
-            pl.set_font_description(self._fd)
-            w = pl.get_size()[0] / Pango.SCALE
+            w = _get_layout(cr, str(self.labels[i]), self._font,
+                            int(self._scale[i] * Pango.SCALE))[1]
             if w > max:
                 max = w
         return max
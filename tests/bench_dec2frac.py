@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Copyright 2010-13, Walter Bender
+
+# This file is part of the Abacus Activity.
+
+# The Abacus Activity is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# The Abacus Activity is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with the Abacus Activity.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+bench_dec2frac.py times the labeling of rod values: dec2frac (a
+continued-fraction search, with exact values memoized) against the
+linear search it replaced, and checks that they give the same labels.
+(It needs neither Gtk nor Cairo.)
+
+Example usage:
+        python tests/bench_dec2frac.py
+
+'''
+
+import os
+import sys
+import timeit
+from fractions import Fraction
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import fraction_labels
+from fraction_labels import dec2frac, _dec2frac, MAX_DENOMINATOR
+
+RUNS = 5  # the best of which is reported
+
+# Typical rod values (see abacus_definitions): the fraction and Schety
+# rods, and the sums of a few of their beads
+VALUES = [Fraction(1, n) for n in (2, 3, 4, 5, 6, 8, 9, 10, 12)] + \
+    [Fraction(5, 12), Fraction(2, 3), Fraction(3, 4), Fraction(1, 25),
+     Fraction(1, 100), Fraction(1, 1000), Fraction(1, 10000)]
+
+
+def linear_dec2frac(d):
+    ''' The linear search that dec2frac replaced (for floats < 1) '''
+    df = 1.0
+    top = 1
+    bot = 1
+    while abs(df - d) > 0.00000001:
+        if df < d:
+            top += 1
+        else:
+            bot += 1
+            top = int(d * bot)
+        df = float(top) / bot
+    if bot == 1:
+        return '%s' % top
+    elif top == 0:
+        return ''
+    return '%s/%s' % (top, bot)
+
+
+def best(function, values):
+    ''' The best time (in microseconds) per value of RUNS runs '''
+    def run():
+        for value in values:
+            function(value)
+    return min(timeit.repeat(run, number=1, repeat=RUNS)) * 1e6 / \
+        len(values)
+
+
+def unmemoized(d):
+    return _dec2frac(d, MAX_DENOMINATOR)
+
+
+def main():
+    floats = [float(value) for value in VALUES]
+    for d in floats:
+        if linear_dec2frac(d) != dec2frac(d):
+            print 'MISMATCH %r: %s != %s' % (d, linear_dec2frac(d),
+                                             dec2frac(d))
+    print '%-24s %8.1f us per value (.0001: %.1f us)' % (
+        'old linear search:', best(linear_dec2frac, floats),
+        best(linear_dec2frac, [0.0001]))
+    print '%-24s %8.1f us per value (.0001: %.1f us)' % (
+        'continued fraction:', best(dec2frac, floats),
+        best(dec2frac, [0.0001]))
+    fraction_labels._fractions.clear()
+    print '%-24s %8.1f us unmemoized, %.1f us memoized' % (
+        'exact Fractions:', best(unmemoized, VALUES),
+        best(dec2frac, VALUES))
+
+
+if __name__ == '__main__':
+    main()
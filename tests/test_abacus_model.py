@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+# Copyright 2010-13, Walter Bender
+
+# This file is part of the Abacus Activity.
+
+# The Abacus Activity is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# The Abacus Activity is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with the Abacus Activity.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Tests of the abacus model (which does not need Gtk) '''
+
+import random
+from fractions import Fraction
+
+import pytest
+
+from abacus_model import AbacusHistory, AbacusModel
+from abacus_definitions import TYPES
+
+
+def _model(name, history=None):
+    ''' A model of one of the built-in abaci, defined as the activity
+    does (see AbacusGeneric.set_type) '''
+    abacus_type = TYPES[name]
+    model = AbacusModel(history)
+    stride = abacus_type.top_beads + abacus_type.bot_beads
+    for i, row in enumerate(abacus_type.rods):
+        top_beads, bot_beads, top_factor, bead_value, style, tristate = \
+            row[:6]
+        model.define_rod(i, i * stride, top_beads, bot_beads, top_factor,
+                         bead_value, tristate)
+    return model
+
+
+def _random_value(name, rnd):
+    ''' The value of a random (but exactly settable) state of the beads '''
+    model = _model(name)
+    model.set_counts([rnd.randint(0, model._capacity(i))
+                      if rnd.random() < 0.5 else 0
+                      for i in range(len(model))])
+    return model.value()
+
+
+@pytest.mark.parametrize('name', list(TYPES))
+def test_moves_reach_the_sum_and_difference(name):
+    rnd = random.Random(name)
+    model = _model(name)
+    tried = 0
+    for attempt in range(200):
+        if tried == 25:
+            break
+        a = _random_value(name, rnd)
+        b = _random_value(name, rnd)
+        subtract = rnd.random() < 0.5
+        if subtract:
+            a, b = max(a, b), min(a, b)
+            expected = a - b
+        else:
+            expected = a + b
+        reference = _model(name)
+        if expected > reference.max_value() or \
+                reference.set_number(expected) != 0 or \
+                model.set_number(a) != 0:
+            continue
+        tried += 1
+        for move in model.moves(b, subtract=subtract):
+            model.play(move)
+        assert model.value() == expected == reference.value()
+    assert tried > 0
+
+
+def test_moves_start_from_the_beads_as_they_are():
+    model = _model('suanpan')
+    model.set_rod(14, 0, 5)  # 5, but not as decompose would set it
+    for move in model.moves(3, subtract=True):
+        model.play(move)
+    assert model.value() == 2
+    model.set_number(107543)
+    for move in model.moves(51760, subtract=True):
+        model.play(move)
+    assert model.value() == 55783
+
+
+def test_moves_where_rods_cannot_carry():
+    model = _model('cuisenaire')
+    model.set_number(9)
+    for move in model.moves(1):
+        model.play(move)
+    assert model.value() == 10
+
+
+def test_moves_are_checked_before_any_is_made():
+    model = _model('soroban')
+    model.set_number(5)
+    with pytest.raises(ValueError):
+        model.moves(6, subtract=True)
+    with pytest.raises(ValueError):
+        model.moves(model.max_value())
+    with pytest.raises(ValueError):
+        model.moves(1e-9)
+    assert model.value() == 5
+
+
+def test_moves_are_an_iterator_from_a_snapshot():
+    model = _model('soroban')
+    model.set_number(107543)
+    planned = list(model.moves(51760, subtract=True))
+    moves = model.moves(51760, subtract=True)
+    assert iter(moves) is moves  # (generated as they are needed)
+    model.set_number(5)  # the moves are from the beads as they were
+    assert list(moves) == planned
+    model.set_number(107543)
+    for move in planned:
+        model.play(move)
+    assert model.value() == 107543 - 51760
+    moves = _model('fraction').moves(Fraction(1, 3))  # (set, not carried)
+    assert iter(moves) is moves
+
+
+@pytest.mark.parametrize('name', list(TYPES))
+def test_set_number_round_trip(name):
+    rnd = random.Random(name)
+    model = _model(name)
+    for k in range(20):
+        number = _random_value(name, rnd)
+        remainder = model.set_number(number)
+        assert model.value() + remainder == number
+        assert sum(model.get_rod_values()) == model.value()
+        if name in ('suanpan', 'soroban', 'decimal', 'nepohualtzintzin',
+                    'hexadecimal', 'binary', 'schety'):
+            assert remainder == 0
+    assert model.set_number(model.max_value()) == 0
+    assert model.value() == model.max_value()
+    model.set_number(0)
+    assert model.value() == 0
+    assert list(model.top) + list(model.up) + list(model.down) == \
+        [0] * (3 * len(model))
+
+
+@pytest.mark.parametrize('name, unit', [('schety', 10000),
+                                        ('fraction', 360),
+                                        ('caacupe', 360)])
+def test_fraction_units(name, unit):
+    model = _model(name)
+    assert model.unit == unit
+    for i in range(len(model)):
+        bead_value = model.definitions[i][4]
+        assert model.weights[i][1] == bead_value * unit
+        assert Fraction(model.weights[i][1], unit) == bead_value
+    model.set_counts([1] * len(model))
+    assert model.value() == sum([model.definitions[i][4]
+                                 for i in range(len(model))])
+    assert model.max_value() == sum([model.get_max_value(i)
+                                     for i in range(len(model))])
+
+
+def test_fraction_values_are_exact():
+    model = _model('fraction')  # the last nine rods are 1/2 to 1/12
+    model.set_counts([0] * 6 + [1, 1, 0, 0, 0, 0, 0, 0, 0])
+    assert model.value() == Fraction(5, 6)  # not 0.8333...
+    assert model.get_value(7) == Fraction(1, 3)
+    # A float is taken to be the closest number of units.
+    assert model.to_units(1 / 3.) == 120
+    assert model.to_units(0.1) == 36
+    assert model.set_number(1 / 3.) == 0
+    assert model.value() == Fraction(1, 3)
+    model = _model('schety')  # 1/4 ruble on rod 10, kopeks after it
+    assert model.set_number(Fraction(5, 4) + Fraction(3, 100)) == 0
+    assert model.get_value(10) == Fraction(1, 4)
+    assert model.get_value(12) == Fraction(3, 100)
+    assert model.set_number(0.0001) == 0
+    assert model.get_bead_count(14) == 1
+
+
+def _states(model, i):
+    top_beads, bot_beads = model.definitions[i][1:3]
+    return [model.get_state(i, k) for k in range(top_beads + bot_beads)]
+
+
+def test_move_top_beads():
+    model = _model('suanpan')  # two top beads, worth 5 each
+    assert model.move(14, 0, 1) == (98, 100)  # both move to the bar
+    assert _states(model, 14)[:2] == [1, 1]
+    assert model.get_bead_count(14) == 10
+    assert model.move(14, 0, -1) == (98, 99)  # the far one moves back
+    assert _states(model, 14)[:2] == [0, 1]
+    assert model.move(14, 0, -1) is None  # nothing to move
+    assert model.value() == 5
+
+
+def test_move_bottom_beads():
+    model = _model('soroban')  # one top bead, four bottom beads
+    assert model.move(7, 3, -1) == (36, 39)  # pushes the two above it
+    assert _states(model, 7) == [0, 1, 1, 1, 0]
+    assert model.move(7, 2, 1) == (37, 39)  # pushes the one below it
+    assert _states(model, 7) == [0, 1, 0, 0, 0]
+    assert model.value() == 1  # rod 7 is the units
+
+
+def test_move_tristate_beads():
+    model = _model('caacupe')
+    first = model.definitions[14][0]  # 12 beads of 1/12
+    assert model.move(14, 9, 1) == (first + 9, first + 12)  # down
+    assert _states(model, 14)[9:] == [-1, -1, -1]
+    assert model.get_value(14) == Fraction(-3, 12)
+    assert model.move(14, 9, -1) == (first + 9, first + 10)  # to center
+    assert _states(model, 14)[9:] == [0, -1, -1]
+    assert model.move(14, 0, -1) == (first, first + 1)  # up
+    assert _states(model, 14)[:1] == [1]
+    assert model.get_value(14) == Fraction(-1, 12)
+
+
+def test_history_undo_and_redo():
+    model = _model('soroban', AbacusHistory())
+    model.set_number(123)
+    model.set_number(45)
+    model.move(6, 0, 1)  # a top bead on the tens rod: 50
+    assert model.value() == 95
+    assert model.undo() and model.value() == 45
+    assert model.undo() and model.value() == 123
+    assert model.undo() and model.value() == 0
+    assert not model.undo()
+    assert model.redo() and model.value() == 123
+    assert model.redo() and model.value() == 45
+    model.set_number(6)  # nothing left to redo
+    assert not model.redo()
+    assert model.undo() and model.value() == 45
+    model.define_rod(len(model) - 1, 0, 1, 4, 5, 1)  # a new abacus
+    assert not model.undo()
+
+
+def test_history_wraps_around():
+    history = AbacusHistory(4)
+    history.record([(0, 0, 1), (1, 0, 1)])
+    history.record([(2, 0, 1)])
+    history.record([(3, 0, 1), (4, 0, 1)])  # overwrites the first
+    assert history.undo() == [(4, 0), (3, 0)]
+    assert history.undo() == [(2, 0)]
+    assert not history.can_undo()  # the first action is forgotten
+    assert history.undo() == []
+    assert history.redo() == [(2, 1)]
+    assert history.redo() == [(3, 1), (4, 1)]
+    assert not history.can_redo()
+    for k in range(10):  # many times around the buffer
+        history.record([(k, k, k + 1)])
+    assert [history.undo() for k in range(5)] == \
+        [[(9, 9)], [(8, 8)], [(7, 7)], [(6, 6)], []]
+    history.record([(k, 0, 1) for k in range(5)])  # too big to remember
+    assert not history.can_undo() and not history.can_redo()
+
+
+def test_decompose():
+    model = _model('suanpan')  # whole numbers only
+    counts, remainder = model.decompose(1234)
+    assert counts[-4:] == [1, 2, 3, 4] and sum(counts[:-4]) == 0
+    assert remainder == 0
+    assert model.decompose(12.75)[1] == Fraction(3, 4)
+    assert model.decompose(Fraction(1, 3))[1] == Fraction(1, 3)
+    assert model.decompose(0.9999999999)[1] == 0  # (floating-point error)
+    for number in (-1, model.max_value() + 1, float('nan'), float('inf')):
+        with pytest.raises(ValueError):
+            model.decompose(number)
+    model = _model('fraction')
+    counts, remainder = model.decompose(Fraction(1, 7))  # not a bead
+    assert model.value() == 0
+    model.set_counts(counts)
+    assert model.value() + remainder == Fraction(1, 7)
+
+
+@pytest.mark.parametrize('name', list(TYPES))
+def test_decompose_many(name):
+    rnd = random.Random(name)
+    model = _model(name)
+    numbers = [_random_value(name, rnd) for k in range(10)] + \
+        [0.1, float(model.max_value()) / 3]
+    counts, remainders = model.decompose_many(numbers)
+    assert (counts, remainders) == \
+        tuple(map(list, zip(*[model.decompose(n) for n in numbers])))
+    with pytest.raises(ValueError):
+        model.decompose_many(numbers + [-1])
+
+
+@pytest.mark.parametrize('name', list(TYPES))
+def test_decompose_many_with_numpy(name):
+    numpy = pytest.importorskip('numpy')
+    rnd = random.Random(name)
+    model = _model(name)
+    numbers = [float(_random_value(name, rnd)) for k in range(10)] + \
+        [0.1, float(model.max_value()) / 3, -1e-15]
+    counts, remainders = model.decompose_many(numpy.array(numbers))
+    for j in range(len(numbers)):
+        count, remainder = model.decompose(numbers[j])
+        assert list(counts[j]) == count and remainders[j] == remainder
+    for number in (-1, float(model.max_value()) * 2, 1e30):
+        with pytest.raises(ValueError):
+            model.decompose_many(numpy.array([number]))
+    with pytest.raises(ValueError):
+        model.decompose_many(numpy.array([2 ** 62], numpy.int64))
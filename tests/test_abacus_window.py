@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+# Copyright 2010-13, Walter Bender
+
+# This file is part of the Abacus Activity.
+
+# The Abacus Activity is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# The Abacus Activity is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with the Abacus Activity.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Tests of the (headless) abacus: these need Gtk and Cairo. '''
+
+import sys
+from xml.dom import minidom
+
+import pytest
+
+pytest.importorskip('gi')
+pytest.importorskip('cairo')
+
+import abacus_window
+from abacus_window import Abacus
+
+
+def _abacus():
+    return Abacus(None, width=1200, height=900)
+
+
+def _check_composites(abacus):
+    ''' Each sprite is drawn by at most one composite, which lists it '''
+    for rod in abacus.rod_cache:
+        if rod.composite is None or rod.composite._members is None:
+            continue
+        for spr in rod.composite._members:
+            assert spr._composite is rod.composite
+    for bead in abacus.bead_cache:
+        if bead.spr is not None and bead.spr._composite is not None:
+            assert bead.spr in bead.spr._composite._members
+
+
+def _check_only_the_mode_is_shown(abacus):
+    ''' No sprites are left on screen from rods that are not in use '''
+    shown = set(abacus.mode._sprites())
+    for spr in abacus.sprites.list:
+        assert spr in shown or spr.layer == 1  # (or the window background)
+
+
+def test_rods_reallocated_at_a_larger_stride():
+    abacus = _abacus()  # a suanpan: 7 beads a rod
+    abacus.select_abacus('soroban')  # 5 beads a rod
+    _check_composites(abacus)
+    abacus.select_abacus('suanpan')
+    _check_composites(abacus)
+    # Moving a bead dirties the composite of its rod.
+    for rod in abacus.mode._allocated_rods():
+        rod.composite._dirty = False
+        rod.get_beads()[-1].spr.move((0, 0))
+        assert rod.composite._dirty
+
+
+def test_the_bar_and_dots_are_drawn_above_the_beads():
+    abacus = _abacus()
+    abacus.select_abacus('soroban')  # (which has dots)
+    mode = abacus.mode
+    assert mode.background.layer < abacus_window.BEAD_LAYER
+    assert mode.foreground.layer > abacus_window.BEAD_LAYER
+    # The foreground is just big enough for the bar and dots.
+    x, y, w, h = mode.foreground.rect
+    for spr in [mode.bar] + mode.dots:
+        assert x <= spr.rect[0] and spr.rect[0] + spr.rect[2] <= x + w
+        assert y <= spr.rect[1] and spr.rect[1] + spr.rect[3] <= y + h
+    assert w == mode.bar.rect[2]
+    assert h < mode.frame.rect[3]
+
+
+def _shown(abacus):
+    return sorted((spr.type, tuple(spr.rect)) for spr in abacus.sprites.list)
+
+
+def test_resizing_redraws_the_artwork():
+    abacus = _abacus()
+    abacus.select_abacus('soroban')
+    abacus.select_abacus('suanpan')
+    abacus.mode.set_value_from_number(42)
+    abacus.width, abacus.height, abacus.scale = 1600, 1200, 2.0
+    abacus._resize()
+    # Nothing in the cache (or in view) is left at the old scale.
+    assert all(key[4] == 2.0 for key in abacus_window.ASSETS._assets)
+    fresh = Abacus(None, width=1600, height=1200, scale=2.0)
+    fresh.mode.set_value_from_number(42)
+    assert _shown(abacus) == _shown(fresh)
+    # and an abacus made before the resize is redrawn when selected.
+    abacus.select_abacus('soroban')
+    fresh.select_abacus('soroban')
+    assert _shown(abacus) == _shown(fresh)
+
+
+def test_a_number_that_does_not_fit_is_shown():
+    abacus = _abacus()
+    assert abacus.mode.set_value_from_number(123)
+    assert not abacus.mode.set_value_from_number(1e20)
+    assert 'is not between 0 and' in abacus.generate_label()
+    assert abacus.mode.value() == '123'  # left as it was
+    assert abacus.generate_label() == '100 + 20 + 3 = 123'
+    # A number finer than the smallest bead is set as close as it can be.
+    assert not abacus.mode.set_value_from_number(
+        abacus_window.Fraction(25, 2))
+    assert abacus.generate_label() == '12 1/2: 1/2 is left over'
+    assert abacus.mode.value() == '12'
+
+
+def _pixels(surface):
+    ''' The bytes of an image surface (or skip if they cannot be read) '''
+    try:
+        return bytearray(surface.get_data())
+    except (AttributeError, NotImplementedError):
+        pytest.skip('cannot read the pixels of a Cairo surface')
+
+
+ARTWORK = [
+    ('bead', '#FFFFFF', '#000000', 1.0, 1.0),
+    ('bead', '#FF8080', '#A00000', 1.0, 1.5),
+    ('bead', '#FFFF00', '#000000', 2.5, 1.0),  # a lozenge
+    ('dot', '#000000', '#000000', 1.0, 1.0),
+    ('mark', '#FF0000', '#000000', 1.0, 2.0),
+    (('rect', 60, 10), '#000000', '#000000', 1.0, 1.0),
+    (('frame', 300, 200), '#8B4513', '#000000', 1.0, 0.75),
+]
+
+
+@pytest.mark.parametrize('shape, fill, stroke, stretch, scale', ARTWORK)
+def test_cairo_artwork_is_the_size_of_the_svg(shape, fill, stroke, stretch,
+                                              scale):
+    ''' The shapes drawn with Cairo are the size (rounded to the pixel)
+    given in the header of the SVG artwork (which is parsed, but not
+    rasterized, so this needs no librsvg) '''
+    drawn = abacus_window._cairo_asset(shape, fill, stroke, stretch, scale)
+    svg = minidom.parseString(abacus_window._svg_document(
+        shape, fill, stroke, stretch, scale)).documentElement
+    assert (drawn.get_width(), drawn.get_height()) == \
+        (int(float(svg.getAttribute('width')) + 0.5),
+         int(float(svg.getAttribute('height')) + 0.5))
+
+
+def _pixel(surface, x, y):
+    ''' The (r, g, b, a) of a pixel, given as fractions of the width and
+    height of an ARGB32 surface '''
+    pixels = _pixels(surface)
+    x = min(int(x * surface.get_width()), surface.get_width() - 1)
+    y = min(int(y * surface.get_height()), surface.get_height() - 1)
+    offset = y * surface.get_stride() + x * 4
+    pixel = pixels[offset:offset + 4]
+    if sys.byteorder == 'little':
+        pixel.reverse()  # (B, G, R, A in memory)
+    a, r, g, b = pixel
+    return (r, g, b, a)
+
+
+@pytest.mark.parametrize('shape, fill, stroke, stretch, scale', ARTWORK)
+def test_cairo_artwork_is_painted_like_the_svg(shape, fill, stroke, stretch,
+                                               scale):
+    ''' The shapes drawn with Cairo are filled and stroked where the SVG
+    artwork is (a check that needs Cairo, but not librsvg) '''
+    drawn = abacus_window._cairo_asset(shape, fill, stroke, stretch, scale)
+    clear = (0, 0, 0, 0)
+    filled = abacus_window._hex_to_rgb(fill)
+    filled = tuple([int(c * 255 + 0.5) for c in filled]) + (255,)
+    stroked = abacus_window._hex_to_rgb(stroke)
+    stroked = tuple([int(c * 255 + 0.5) for c in stroked]) + (255,)
+    if shape == 'mark':  # (a wedge, pointing down)
+        probes = [(0.5, 0.3, filled), (0.02, 0.98, clear)]
+    else:
+        probes = [(0.5, 0.5, filled)]
+    if shape in ['bead', 'dot']:
+        probes.append((0, 0, clear))
+    elif shape[0] == 'frame':
+        probes.append((0.25 * abacus_window.FRAME_STROKE_WIDTH / shape[1],
+                       0.5, stroked))
+    for x, y, color in probes:
+        assert _pixel(drawn, x, y) == color
+
+
+@pytest.mark.parametrize('shape, fill, stroke, stretch, scale', ARTWORK)
+def test_cairo_artwork_matches_svg(shape, fill, stroke, stretch, scale):
+    ''' The shapes drawn with Cairo look like the SVG artwork: the same
+    size, and close in color (but for antialiasing at the edges) '''
+    drawn = abacus_window._cairo_asset(shape, fill, stroke, stretch, scale)
+    cairo_pixels = _pixels(drawn)
+    try:
+        loaded = abacus_window._svg_asset(shape, fill, stroke, stretch,
+                                          scale)
+    except Exception, e:  # (GLib.Error, if there is no SVG loader)
+        pytest.skip('cannot load SVG: %s' % e)
+    assert (drawn.get_width(), drawn.get_height()) == \
+        (loaded.get_width(), loaded.get_height())
+    svg_pixels = _pixels(loaded)
+    differences = [abs(a - b) for a, b in zip(cairo_pixels, svg_pixels)]
+    assert sum(differences) / float(len(differences)) < 4  # (of 255)
+    far = len([d for d in differences if d > 64])
+    assert far < 0.02 * len(differences)
+
+
+def test_prewarm_leaves_the_current_abacus_alone():
+    abacus = _abacus()  # a suanpan, whose white beads fade
+    abacus.mode.set_value_from_number(4870123)
+    rods = abacus.mode._allocated_rods()
+    rods[-1].get_beads()[-1].set_fade_level(3)
+
+    def _seen():
+        return [(bead.spr.get_xy(), bead.get_state(), bead.fade_level,
+                 bead.spr.layer) for rod in rods for bead in rod.get_beads()]
+
+    seen = _seen()
+    abacus.prewarm()
+    while abacus._prewarm_cb(1.0):
+        pass
+    assert _seen() == seen
+    assert abacus.mode_dict['virtual'][0] is None  # not worth making
+    abacus.select_abacus('schety')  # (prewarmed)
+    assert abacus.mode.set_value_from_number(12.25)
+    assert abacus.generate_label() == '10 + 2 + 1/4 = 12 1/4'
+    _check_composites(abacus)
+
+
+def test_prewarm_in_small_steps_without_redrawing():
+    abacus = _abacus()
+
+    class _Widget():
+        areas = []
+
+        def queue_draw_area(self, *area):
+            self.areas.append(area)
+
+    abacus.sprites._widget = _Widget()
+    abacus.sprites.set_delay(False)
+    abacus.prewarm()
+    steps = 1
+    while abacus._prewarm_cb(0):  # (one step at a time)
+        steps += 1
+    # A step to build each mode, and one per rod of it (see warm)
+    modes = [name for name in abacus.types if name != 'suanpan']
+    assert steps == sum([1 + len(abacus.types[name].rods)
+                         for name in modes])
+    assert _Widget.areas == []
+    assert not abacus.sprites.get_delay()
+
+
+def test_select_a_custom_abacus():
+    abacus = _abacus()
+    abacus.select_abacus('custom')  # made with the default parameters
+    assert abacus.mode is abacus.custom and abacus.mode.num_rods == 15
+    abacus.select_custom(rods=4, top=0, bot=1, factor=1, base=2)
+    _check_only_the_mode_is_shown(abacus)
+    assert abacus.mode.set_value_from_number(5)
+    assert abacus.generate_label() == '4 + 1 = 5'
+    with pytest.raises(ValueError):
+        abacus.select_custom(rods=100)
+    assert abacus.mode.num_rods == 4  # as it was
+    abacus.select_abacus('soroban')
+    abacus.select_abacus('custom')
+    assert abacus.mode.num_rods == 4
+    _check_composites(abacus)
+
+
+def test_rods_only_move_when_the_rod_count_changes(monkeypatch):
+    abacus = _abacus()
+    abacus.select_custom(rods=10)
+    updates = []
+    update = abacus_window.Rod.update
+    monkeypatch.setattr(abacus_window.Rod, 'update',
+                        lambda self, *args, **kwargs: updates.append(self)
+                        or update(self, *args, **kwargs))
+    abacus.select_custom(rods=12)  # (the frame is wider: every rod moves)
+    assert updates == abacus.rod_cache[10:12]
+    assert abacus.mode.set_value_from_number(12345)
+    assert abacus.generate_label() == '10000 + 2000 + 300 + 40 + 5 = 12345'
+    fresh = _abacus()
+    fresh.select_custom(rods=12)
+    fresh.mode.set_value_from_number(12345)
+    for rod, other in zip(abacus.mode._allocated_rods(),
+                          fresh.mode._allocated_rods()):
+        assert rod.spr.rect == other.spr.rect
+        assert rod.label.rect == other.label.rect
+        assert rod.label.labels == other.label.labels
+        assert [(bead.spr.rect, bead.value) for bead in rod.get_beads()] == \
+            [(bead.spr.rect, bead.value) for bead in other.get_beads()]
+    _check_composites(abacus)
+
+
+def test_export_a_custom_abacus(tmpdir):
+    abacus = _abacus()
+    if not hasattr(abacus_window.cairo, 'SVGSurface'):
+        pytest.skip('no Cairo SVG surfaces')
+    path = str(tmpdir.join('custom.svg'))
+    abacus.export(path, 'custom', 42)
+    assert abacus.generate_label() == '40 + 2 = 42'
+    assert tmpdir.join('custom.svg').size() > 0
+    abacus.export(path, 'custom', 5, rods=4, top=0, bot=1, factor=1,
+                  base=2)
+    assert abacus.generate_label() == '4 + 1 = 5'
+    # The rods beyond the fourth are not left on screen (or exported).
+    for rod in abacus.rod_cache[4:]:
+        assert rod.spr is None or rod.spr not in abacus.sprites.list
+        if rod.composite is not None:
+            assert rod.composite not in abacus.sprites.list
+    _check_only_the_mode_is_shown(abacus)
+
+
+def test_virtual_background_follows_the_scrolled_rods():
+    abacus = _abacus()
+    abacus.select_abacus('virtual')
+    mode = abacus.mode
+    rods = mode._allocated_rods()
+    colors = [rod.spr.cached_surfaces[0] for rod in rods]
+    background = mode.background.cached_surfaces[0]
+    mode.scroll(-1)
+    for rod, color in zip(rods, colors):  # (two colors, alternating)
+        assert rod.spr.cached_surfaces[0] is not color
+    assert mode.background.cached_surfaces[0] is not background
+    mode.scroll(1000)  # back to the units
+    background = mode.background.cached_surfaces[0]
+    mode.scroll(1)  # and no further
+    assert mode.background.cached_surfaces[0] is background
+
+
+def test_a_virtual_abacus_of_any_width():
+    abacus = _abacus()
+    abacus.select_virtual(rods=30)
+    assert abacus.mode is abacus.virtual and abacus.mode.model_rods == 30
+    _check_only_the_mode_is_shown(abacus)
+    number = abacus_window.parse_number('1' * 30)  # too long for a float
+    assert abacus.mode.set_value_from_number(number)
+    assert abacus.mode.value() == '1' * 30
+    assert abacus.generate_label() == '1' * 30
+    assert abacus.mode._terms == [None] * 30  # (only the sum is shown)
+    with pytest.raises(ValueError):
+        abacus.select_virtual(rods=0)
+    abacus.select_abacus('soroban')
+    abacus.select_abacus('virtual')
+    assert abacus.mode.model_rods == 30
+    abacus.select_virtual()
+    assert abacus.mode.model_rods == abacus_window.VIRTUAL_RODS
+    _check_only_the_mode_is_shown(abacus)
+    _check_composites(abacus)
+
+
+def test_parse_number():
+    assert abacus_window.parse_number(' 12 ') == 12
+    assert abacus_window.parse_number('12.5') == abacus_window.Fraction(
+        25, 2)
+    assert abacus_window.parse_number('3/4') == abacus_window.Fraction(3, 4)
+    with pytest.raises(ValueError):
+        abacus_window.parse_number('1,2')
+
+
+def test_profile_the_artwork_but_not_the_overlay():
+    abacus = _abacus()
+    profiler = abacus_window.PROFILER
+    profiler.clear()
+    profiler.enable()
+    try:
+        abacus_window.ASSETS.get(('rect', 33, 7), '#123456', '#654321')
+        assert profiler.counts['abacus_window._build_asset'][0] == 1
+        x, y, w, h = abacus._overlay_area()
+        surface = abacus_window.cairo.ImageSurface(
+            abacus_window.cairo.FORMAT_ARGB32, int(abacus.width),
+            int(abacus.height))
+        cr = abacus_window.cairo.Context(surface)
+        cr.rectangle(x, y, w, h)
+        cr.clip()
+        if cr.clip_extents() != (x, y, x + w, y + h):
+            pytest.skip('cannot clip a Cairo context')
+        abacus._prewarm_queue = []  # (not the first paint)
+        abacus._Abacus__draw_cb(None, cr)  # the overlay refreshing itself
+        assert 'Sprites.redraw_sprites' not in profiler.counts
+    finally:
+        profiler.disable()
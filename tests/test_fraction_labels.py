@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Copyright 2010-13, Walter Bender
+
+# This file is part of the Abacus Activity.
+
+# The Abacus Activity is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# The Abacus Activity is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with the Abacus Activity.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Tests of the fraction labels (which do not need Gtk) '''
+
+from fractions import Fraction
+
+import fraction_labels
+from fraction_labels import dec2frac
+
+
+def test_exact_values():
+    assert dec2frac(12) == '12'
+    assert dec2frac(Fraction(5, 12)) == '5/12'
+    assert dec2frac(Fraction(29, 12)) == '2 5/12'
+    assert dec2frac(Fraction(-5, 12)) == '–5/12'
+    assert dec2frac(Fraction(-29, 12)) == '–2 5/12'
+    assert dec2frac(-3) == '–3'
+
+
+def test_floats():
+    assert dec2frac(3. / 5) == '3/5'
+    assert dec2frac(0.0001) == '1/10000'
+    assert dec2frac(-0.75) == '–3/4'
+    assert dec2frac(1e-9) == ''
+    assert dec2frac(-1e-9) == ''
+
+
+def test_only_exact_values_are_memoized():
+    fraction_labels._fractions.clear()
+    dec2frac(0.5)
+    assert fraction_labels._fractions == {}
+    for n in range(2, fraction_labels.MAX_CACHED_FRACTIONS + 10):
+        assert dec2frac(Fraction(1, n)) == '1/%d' % n
+    assert len(fraction_labels._fractions) <= \
+        fraction_labels.MAX_CACHED_FRACTIONS
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Copyright 2010-13, Walter Bender
+
+# This file is part of the Abacus Activity.
+
+# The Abacus Activity is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# The Abacus Activity is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with the Abacus Activity.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Tests of the profiler (which does not need Gtk) '''
+
+from profiling import Profiler
+
+
+class _Hooked():
+
+    def double(self, x):
+        return x * 2
+
+
+def test_profiler_times_hooked_calls_while_enabled():
+    profiler = Profiler(size=8)
+    original = _Hooked.__dict__['double']
+    profiler.hook(_Hooked, 'double')
+    assert _Hooked.__dict__['double'] is original  # (until enabled)
+    profiler.enable()
+    assert [_Hooked().double(x) for x in range(20)][-1] == 38
+    assert profiler.counts['_Hooked.double'][0] == 20
+    assert len(profiler.events()) == 8  # the most recent
+    profiler.disable()
+    assert _Hooked.__dict__['double'] is original
+
+
+def test_profiler_pause():
+    profiler = Profiler()
+    profiler.hook(_Hooked, 'double')
+    profiler.enable()
+    _Hooked().double(1)
+    profiler.pause()
+    profiler.pause()
+    _Hooked().double(2)
+    profiler.resume()
+    assert _Hooked().double(3) == 6
+    profiler.resume()
+    _Hooked().double(4)
+    profiler.disable()
+    assert profiler.counts['_Hooked.double'][0] == 2